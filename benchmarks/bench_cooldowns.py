@@ -0,0 +1,77 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Cost and memory of per-user cooldowns, a dict of limiters vs bots.ratelimit.BucketTable.
+
+    python -m benchmarks.bench_cooldowns [--chatters 100000] [--rate 500]
+
+Simulates distinct chatters each using a command once, at --rate uses per
+second of simulated time, against a 1 use per 30 seconds per user limit.
+twitchio's own Cooldown is left out: it rescans every key on each use.
+"""
+
+import argparse
+import time
+import tracemalloc
+import types
+
+from bots.ratelimit import BucketTable, RateLimiter
+
+
+def contexts(chatters):
+    channel = types.SimpleNamespace(name="raided")
+    return [
+        types.SimpleNamespace(author=types.SimpleNamespace(name=f"viewer{i}"), channel=channel)
+        for i in range(chatters)
+    ]
+
+
+def run_dict(ctxs, rate):
+    limiters = {}
+    start = time.perf_counter()
+    for ctx in ctxs:
+        key = (ctx.channel.name, ctx.author.name)
+        limiter = limiters.get(key)
+        if limiter is None:
+            limiter = limiters[key] = RateLimiter(1, 30)
+        limiter.try_acquire()
+    return time.perf_counter() - start, limiters
+
+
+def run_table(ctxs, rate):
+    table = BucketTable(1, 30)
+    now = time.monotonic()
+    start = time.perf_counter()
+    for ctx in ctxs:
+        now += 1 / rate
+        key = (ctx.channel.name, ctx.author.name)
+        if not table.delay(key, now):
+            table.take(key, now)
+    return time.perf_counter() - start, table
+
+
+def measure(run, ctxs, rate):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    _, state = run(ctxs, rate)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # Timed again without tracemalloc, which slows every allocation down.
+    elapsed, _ = run(ctxs, rate)
+    return elapsed / len(ctxs) * 1e6, len(state), retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chatters", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=500, help="command uses per simulated second")
+    args = parser.parse_args()
+
+    ctxs = contexts(args.chatters)
+    print(f"{'':>12}{'us/use':>10}{'keys kept':>12}{'retained':>12}")
+    for label, run in (("dict", run_dict), ("BucketTable", run_table)):
+        us, keys, retained = measure(run, ctxs, args.rate)
+        print(f"{label:>12}{us:>10.2f}{keys:>12}{retained / 1024:>10.0f}KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Per-message command dispatch cost, stock twitchio vs bots.router.
+
+    python -m benchmarks.bench_dispatch [--messages 200000] [--command-ratio 0.02]
+
+Commands are resolved but not invoked, so the numbers are the cost of
+deciding what a chat line is.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import types
+
+from twitchio.ext import commands
+
+from bots.bot import Bot
+
+COMMANDS = [f"cmd{i}" for i in range(40)]
+PREFIXES = ["!", "$"]
+
+
+class StockBot(commands.Bot):
+    async def invoke(self, context):
+        pass
+
+    def run_event(self, event_name, *args, **kwargs):
+        pass
+
+
+class RoutedBot(Bot):
+    def __init__(self, case_insensitive):
+        # Skip token generation and cog loading; only dispatch is measured.
+        self.prefix = PREFIXES
+        self.case_insensitive = case_insensitive
+        self._router = None
+        commands.Bot.__init__(self, token="benchmark", prefix=PREFIXES, case_insensitive=case_insensitive)
+
+    async def invoke(self, context):
+        pass
+
+    def run_event(self, event_name, *args, **kwargs):
+        pass
+
+
+def add_commands(bot):
+    async def callback(ctx):
+        pass
+
+    for name in COMMANDS:
+        bot.add_command(commands.Command(name=name, func=callback, aliases=[name.upper() + "x"]))
+
+
+def make_messages(count, command_ratio, seed=7):
+    rng = random.Random(seed)
+    author = types.SimpleNamespace(_ws=None, name="viewer")
+    messages = []
+    for _ in range(count):
+        if rng.random() < command_ratio:
+            content = f"{rng.choice(PREFIXES)}{rng.choice(COMMANDS)} some args here"
+        else:
+            content = "just chatting about the stream " + "lol " * rng.randint(0, 8)
+        messages.append(types.SimpleNamespace(content=content, echo=False, channel=None, author=author))
+    return messages
+
+
+async def dispatch(bot, messages):
+    start = time.perf_counter()
+    for message in messages:
+        await bot.handle_commands(message)
+    return time.perf_counter() - start
+
+
+async def main(args):
+    messages = make_messages(args.messages, args.command_ratio)
+    bots = {
+        "twitchio": StockBot(token="benchmark", prefix=PREFIXES),
+        "twitchio (case insensitive)": StockBot(token="benchmark", prefix=PREFIXES, case_insensitive=True),
+        "router": RoutedBot(False),
+        "router (case insensitive)": RoutedBot(True),
+    }
+    for bot in bots.values():
+        add_commands(bot)
+        await dispatch(bot, messages[:1000])  # warm up
+    print(f"{args.messages} messages, {args.command_ratio:.1%} commands")
+    for label, bot in bots.items():
+        elapsed = min([await dispatch(bot, messages) for _ in range(args.repeat)])
+        print(f"{label:>28}: {elapsed / len(messages) * 1e9:8.0f} ns/message")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--command-ratio", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Chat records handed to a fast and a slow subscriber, twitchio-style tasks vs bots.eventbus.
+
+    python -m benchmarks.bench_eventbus [--rate 5000] [--seconds 3] [--slow-ms 2]
+
+The slow handler works through one resource at a time, like a database
+connection. twitchio's run_event starts one task per event and handler, so a
+handler that can't keep up piles up tasks without bound; on the bus each
+subscriber drains its own bounded queue. Reports CPU per record, the most
+tasks alive at once, peak memory, the fast handler's p99 latency and what
+the slow one lost.
+"""
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from bots.eventbus import ChatMessage, EventBus
+
+
+def record(i):
+    return ChatMessage("bench", "channel", f"viewer{i % 500}", str(i % 500), f"just chatting {i}", {}, "")
+
+
+class Handlers:
+    def __init__(self, slow_ms):
+        self.slow = slow_ms / 1000
+        self.latencies = []
+        self.slow_handled = 0
+        self.resource = asyncio.Lock()
+
+    async def fast(self, rec):
+        self.latencies.append(time.monotonic() - rec.received_at)
+
+    async def slow_handler(self, rec):
+        async with self.resource:
+            await asyncio.sleep(self.slow)
+        self.slow_handled += 1
+
+
+async def publish(rate, seconds, send):
+    """send(record) rate times a second for seconds, in 10ms bursts; returns the most tasks alive."""
+    start = time.monotonic()
+    sent = peak = 0
+    while time.monotonic() - start < seconds:
+        due = int((time.monotonic() - start) * rate) + 1
+        while sent < due:
+            send(record(sent))
+            sent += 1
+        peak = max(peak, len(asyncio.all_tasks()))
+        await asyncio.sleep(0.01)
+    return sent, peak
+
+
+async def run_tasks(args, handlers):
+    loop = asyncio.get_running_loop()
+    callbacks = (handlers.fast, handlers.slow_handler)
+
+    def send(rec):
+        for callback in callbacks:
+            loop.create_task(callback(rec))
+
+    sent, peak = await publish(args.rate, args.seconds, send)
+    await asyncio.sleep(0.1)
+    pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return sent, peak, sent - handlers.slow_handled
+
+
+async def run_bus(args, handlers):
+    bus = EventBus()
+    subscriptions = [
+        bus.subscribe(ChatMessage, handlers.fast, maxsize=args.queue_size),
+        bus.subscribe(ChatMessage, handlers.slow_handler, maxsize=args.queue_size),
+    ]
+    sent, peak = await publish(args.rate, args.seconds, bus.publish)
+    await asyncio.sleep(0.1)
+    for subscription in subscriptions:
+        subscription.close()
+    return sent, peak, sent - handlers.slow_handled
+
+
+async def measure(run, args):
+    handlers = Handlers(args.slow_ms)
+    tracemalloc.start()
+    cpu = time.process_time()
+    sent, peak_tasks, slow_lost = await run(args, handlers)
+    cpu = time.process_time() - cpu
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies = sorted(handlers.latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else float("nan")
+    return cpu / sent * 1e6, peak_tasks, peak_memory, p99 * 1000, slow_lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=5000, help="records per second")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--slow-ms", type=float, default=2.0, help="time the slow handler takes per record")
+    parser.add_argument("--queue-size", type=int, default=1000, help="bus queue per subscriber")
+    args = parser.parse_args()
+
+    print(f"{'':>8}{'us/rec':>8}{'tasks':>8}{'peak mem':>12}{'fast p99':>10}{'slow lost':>11}")
+    for label, run in (("tasks", run_tasks), ("bus", run_bus)):
+        us, tasks, memory, p99, lost = asyncio.run(measure(run, args))
+        print(f"{label:>8}{us:>8.1f}{tasks:>8}{memory / 1024:>10.0f}KiB{p99:>8.2f}ms{lost:>11}")
+
+
+if __name__ == "__main__":
+    main()
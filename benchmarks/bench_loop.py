@@ -0,0 +1,61 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Compare startup time and per-message cost of the asyncio and uvloop event loops.
+
+    python -m benchmarks.bench_loop --runs 3 --bots 20 --channels 5 --rate 20
+
+Runs benchmarks.loadtest once per loop and run, each in a fresh process so
+neither loop inherits the other's imports or warm caches, and prints the
+median of every figure. Extra arguments are passed on to the load test.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from bots.eventloop import LOOPS
+
+FIGURES = (
+    ("startup_s", "startup", "{:.3f}s"),
+    ("cpu_us_per_message", "cpu/message", "{:.0f}us"),
+    (("irc", "p50_ms"), "p50", "{:.2f}ms"),
+    (("irc", "p99_ms"), "p99", "{:.2f}ms"),
+    ("rss_per_bot_kib", "rss/bot", "{:.0f}KiB"),
+)
+
+
+def run_once(loop, extra):
+    command = [sys.executable, "-m", "benchmarks.loadtest", "--json", "--loop", loop] + extra
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def figure(report, key):
+    if isinstance(key, tuple):
+        section, name = key
+        return report[section][name]
+    return report[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    args, extra = parser.parse_known_args()
+
+    results = {}
+    for loop in LOOPS:
+        try:
+            results[loop] = [run_once(loop, extra) for _ in range(args.runs)]
+        except subprocess.CalledProcessError as e:
+            print(f"{loop}: load test failed\n{e.stderr.strip().splitlines()[-1]}")
+
+    print(f"{'':>12}" + "".join(f"{loop:>12}" for loop in results))
+    for key, label, fmt in FIGURES:
+        cells = [fmt.format(statistics.median(figure(r, key) for r in reports)) for reports in results.values()]
+        print(f"{label:>12}" + "".join(f"{cell:>12}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Cost of many timed jobs, one twitchio routine each vs bots.scheduler.Scheduler.
+
+    python -m benchmarks.bench_routines [--jobs 1000] [--every 1] [--seconds 5]
+
+Starts --jobs jobs that each run every --every seconds, at staggered offsets
+like per-channel reminders added over time, and reports the memory kept for
+them, the tasks they need and the CPU used while running for --seconds.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from twitchio.ext import routines
+
+from bots.scheduler import Every, Job, Scheduler
+
+
+async def start_routines(count, every, callback):
+    started = []
+    for i in range(count):
+        routine = routines.routine(seconds=every, wait_first=True)(callback)
+        started.append(routine)
+        routine.start()
+        await asyncio.sleep(every / count)
+    return started, lambda: [routine.cancel() for routine in started]
+
+
+async def start_scheduler(count, every, callback):
+    scheduler = Scheduler(os.path.join(tempfile.mkdtemp(), "routines.json"))
+    for i in range(count):
+        scheduler.add(Job(f"bench.{i}", Every(every), callback))
+        await asyncio.sleep(every / count)
+    return scheduler, scheduler.stop
+
+
+async def measure(start, args):
+    runs = 0
+
+    async def callback():
+        nonlocal runs
+        runs += 1
+
+    tasks = len(asyncio.all_tasks())
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state, stop = await start(args.jobs, args.every, callback)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    tasks = len(asyncio.all_tasks()) - tasks
+
+    runs = 0
+    cpu = time.process_time()
+    await asyncio.sleep(args.seconds)
+    cpu = time.process_time() - cpu
+    result = stop()
+    if asyncio.iscoroutine(result):
+        await result
+    return retained, tasks, cpu, runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--every", type=float, default=1.0, help="seconds between runs of each job")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long to run them for")
+    args = parser.parse_args()
+
+    print(f"{'':>12}{'retained':>12}{'tasks':>8}{'cpu s':>8}{'runs':>8}{'us/run':>8}")
+    for label, start in (("routines", start_routines), ("Scheduler", start_scheduler)):
+        retained, tasks, cpu, runs = asyncio.run(measure(start, args))
+        print(f"{label:>12}{retained / 1024:>10.0f}KiB{tasks:>8}{cpu:>8.2f}{runs:>8}{cpu / max(runs, 1) * 1e6:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
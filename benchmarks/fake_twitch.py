@@ -0,0 +1,583 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Local stand-ins for the Twitch services the bots talk to.
+
+FakeIRC, FakePubSub and FakeHelix (which also answers the id.twitch.tv
+OAuth endpoints) are aiohttp applications served on 127.0.0.1.
+FakeEventSubSender POSTs signed notifications to an eventsub cog the way
+Twitch's webhook sender does; FakeEventSubWS serves EventSub WebSocket
+sessions for the subscriptions made on a FakeHelix. FakeResolver maps the real Twitch hostnames
+to the local servers so the bots' own HTTP sessions need no patching.
+"""
+
+import asyncio
+import collections
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import tempfile
+import time
+import uuid
+
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+CLIENT_ID = "loadtestclientid"
+TIMESTAMP_TAG = "bench-sent-ns"
+
+IRC_HOST = "irc-ws.chat.twitch.tv"
+PUBSUB_HOST = "pubsub-edge.twitch.tv"
+API_HOST = "api.twitch.tv"
+ID_HOST = "id.twitch.tv"
+EVENTSUB_WS_HOST = "eventsub.wss.twitch.tv"
+
+
+def user_id_for(login):
+    """Stable fake user id for a login."""
+    return int(hashlib.sha1(login.lower().encode()).hexdigest()[:8], 16)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def follow_event(broadcaster_id, login, now):
+    return {
+        "user_id": str(user_id_for(login)),
+        "user_login": login,
+        "user_name": login,
+        "broadcaster_user_id": str(broadcaster_id),
+        "broadcaster_user_login": "channel",
+        "broadcaster_user_name": "channel",
+        "followed_at": now,
+    }
+
+
+def server_ssl_context():
+    """A TLS context with a throwaway self-signed certificate for localhost."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    directory = tempfile.mkdtemp(prefix="fake-twitch-")
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as file:
+        file.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as file:
+        file.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption(),
+            )
+        )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class FakeResolver(AbstractResolver):
+    """Resolves the given hostnames to 127.0.0.1 and the port serving them."""
+
+    def __init__(self, ports):
+        self.ports = ports
+
+    async def resolve(self, host, port=0, family=0):
+        if host not in self.ports:
+            raise OSError(f"{host} is not served by the fakes; the load test runs offline")
+        return [
+            {
+                "hostname": host,
+                "host": "127.0.0.1",
+                "port": self.ports[host],
+                "family": 2,
+                "proto": 0,
+                "flags": 0,
+            }
+        ]
+
+    async def close(self):
+        pass
+
+
+class _Server:
+    """An aiohttp application bound to an ephemeral local port."""
+
+    def __init__(self):
+        self.app = web.Application()
+        self.runner = None
+        self.port = None
+
+    async def start(self, ssl_context=None):
+        """Listen on one more port, with TLS when given a context, and return it."""
+        if self.runner is None:
+            self.runner = web.AppRunner(self.app)
+            await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0, ssl_context=ssl_context)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class FakeIRC(_Server):
+    """Twitch chat over websocket: login, JOIN, PING and a chat generator."""
+
+    def __init__(self):
+        super().__init__()
+        self.app.router.add_get("/", self._handle)
+        self.members = collections.defaultdict(set)
+        self.connections = 0
+        self.sent = 0
+        self.received_privmsg = 0
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.connections += 1
+        nick = None
+        try:
+            async for msg in ws:
+                for line in msg.data.split("\r\n"):
+                    if line:
+                        nick = await self._command(ws, nick, line) or nick
+        finally:
+            for members in self.members.values():
+                members.discard(ws)
+        return ws
+
+    async def _command(self, ws, nick, line):
+        if line.startswith("@"):
+            line = line.split(" ", 1)[1]
+        verb, _, rest = line.partition(" ")
+        if verb == "NICK":
+            nick = rest.strip()
+            welcome = [f":tmi.twitch.tv {code:03d} {nick} :-" for code in (1, 2, 3, 4, 375, 372, 376)]
+            await ws.send_str("\r\n".join(welcome) + "\r\n")
+            return nick
+        if verb == "CAP":
+            await ws.send_str(f":tmi.twitch.tv CAP * ACK :{rest.split(':', 1)[-1]}\r\n")
+        elif verb == "PING":
+            await ws.send_str("PONG :tmi.twitch.tv\r\n")
+        elif verb == "JOIN":
+            for channel in rest.strip().lstrip("#").split(",#"):
+                self.members[channel].add(ws)
+                await ws.send_str(
+                    f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN #{channel}\r\n"
+                    f":{nick}.tmi.twitch.tv 353 {nick} = #{channel} :{nick}\r\n"
+                    f":{nick}.tmi.twitch.tv 366 {nick} #{channel} :End of /NAMES list\r\n"
+                    f"{self._userstate(nick, channel)}"
+                )
+        elif verb == "PART":
+            self.members[rest.strip().lstrip("#")].discard(ws)
+        elif verb == "PRIVMSG":
+            self.received_privmsg += 1
+            await ws.send_str(self._userstate(nick, rest.split(" ", 1)[0].lstrip("#")))
+        return None
+
+    @staticmethod
+    def _userstate(nick, channel):
+        return (
+            f"@badge-info=;badges=;color=;display-name={nick};emote-sets=0;mod=0;subscriber=0;user-type="
+            f" :tmi.twitch.tv USERSTATE #{channel}\r\n"
+        )
+
+    def chat_line(self, channel, content, login="viewer"):
+        tags = (
+            f"badge-info=;badges=;color=;display-name={login};emotes=;id={uuid.uuid4()};mod=0;"
+            f"room-id={user_id_for(channel)};subscriber=0;tmi-sent-ts={int(time.time() * 1000)};turbo=0;"
+            f"user-id={user_id_for(login)};user-type=;{TIMESTAMP_TAG}={time.perf_counter_ns()}"
+        )
+        return f"@{tags} :{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel} :{content}\r\n"
+
+    async def say(self, channel, content, login="viewer"):
+        """Deliver one chat message to every connection in channel."""
+        line = self.chat_line(channel, content, login)
+        for ws in list(self.members.get(channel, ())):
+            if not ws.closed:
+                await ws.send_str(line)
+                self.sent += 1
+
+
+class FakePubSub(_Server):
+    """The PubSub edge: LISTEN/UNLISTEN, PING and bits messages on demand."""
+
+    def __init__(self):
+        super().__init__()
+        self.app.router.add_get("/", self._handle)
+        self.listeners = collections.defaultdict(set)
+        self.sent = 0
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        try:
+            async for msg in ws:
+                data = json.loads(msg.data)
+                if data["type"] == "PING":
+                    await ws.send_json({"type": "PONG"})
+                elif data["type"] in ("LISTEN", "UNLISTEN"):
+                    for topic in data["data"]["topics"]:
+                        if data["type"] == "LISTEN":
+                            self.listeners[topic].add(ws)
+                        else:
+                            self.listeners[topic].discard(ws)
+                    await ws.send_json({"type": "RESPONSE", "nonce": data.get("nonce", ""), "error": ""})
+        finally:
+            for listeners in self.listeners.values():
+                listeners.discard(ws)
+        return ws
+
+    async def publish(self, topic, message):
+        """Send message (a dict) to every listener of topic."""
+        frame = {"type": "MESSAGE", "data": {"topic": topic, "message": json.dumps(message)}}
+        for ws in list(self.listeners.get(topic, ())):
+            if not ws.closed:
+                await ws.send_json(frame)
+                self.sent += 1
+
+    @staticmethod
+    def bits_message(channel_id, login="viewer"):
+        """A channel-bits-events-v2 message as Twitch sends it."""
+        return {
+            "data": {
+                "user_name": login,
+                "channel_name": "channel",
+                "user_id": str(user_id_for(login)),
+                "channel_id": str(channel_id),
+                "time": datetime.datetime.utcnow().isoformat() + "Z",
+                "chat_message": "cheer100",
+                "bits_used": 100,
+                "total_bits_used": 100,
+                "is_anonymous": False,
+                "context": "cheer",
+                "badge_entitlement": {"new_version": 1000, "previous_version": 100},
+                TIMESTAMP_TAG: time.perf_counter_ns(),
+            },
+            "version": "1.0",
+            "message_type": "bits_event",
+            "message_id": str(uuid.uuid4()),
+        }
+
+
+class FakeHelix(_Server):
+    """The Helix endpoints the bots use plus id.twitch.tv's OAuth endpoints."""
+
+    def __init__(self, expires_in=14400):
+        super().__init__()
+        self.expires_in = expires_in
+        self.tokens = {}
+        self.subscriptions = {}
+        self.requests = collections.Counter()
+        self.app.router.add_get("/oauth2/validate", self._validate)
+        self.app.router.add_post("/oauth2/token", self._token)
+        self.app.router.add_post("/oauth2/revoke", self._revoke)
+        self.app.router.add_get("/helix/users", self._users)
+        self.app.router.add_get("/helix/eventsub/subscriptions", self._list_subscriptions)
+        self.app.router.add_post("/helix/eventsub/subscriptions", self._create_subscription)
+        self.app.router.add_delete("/helix/eventsub/subscriptions", self._delete_subscription)
+
+    def issue(self, login):
+        """A valid access token for login."""
+        token = uuid.uuid4().hex
+        self.tokens[token] = login
+        return token
+
+    async def _validate(self, request):
+        self.requests["validate"] += 1
+        token = request.headers.get("Authorization", "").split(" ")[-1]
+        login = self.tokens.get(token)
+        if login is None:
+            return web.json_response({"status": 401, "message": "invalid access token"}, status=401)
+        return web.json_response(
+            {
+                "client_id": CLIENT_ID,
+                "login": login,
+                "user_id": str(user_id_for(login)),
+                "scopes": ["chat:read", "chat:edit"],
+                "expires_in": self.expires_in,
+            }
+        )
+
+    async def _token(self, request):
+        self.requests["token"] += 1
+        form = dict(request.query)
+        if request.can_read_body:
+            form.update(await request.post())
+        if form.get("grant_type") == "refresh_token":
+            login = self.tokens.get(form.get("refresh_token"), "app")
+        else:
+            login = "app"
+        return web.json_response(
+            {
+                "access_token": self.issue(login),
+                "refresh_token": self.issue(login),
+                "expires_in": self.expires_in,
+                "token_type": "bearer",
+            }
+        )
+
+    async def _revoke(self, request):
+        self.requests["revoke"] += 1
+        self.tokens.pop(request.query.get("token"), None)
+        return web.Response(status=200)
+
+    async def _users(self, request):
+        self.requests["users"] += 1
+        logins = request.query.getall("login", [])
+        return web.json_response(
+            {
+                "data": [
+                    {
+                        "id": str(user_id_for(login)),
+                        "login": login.lower(),
+                        "display_name": login,
+                        "type": "",
+                        "broadcaster_type": "",
+                        "description": "",
+                        "profile_image_url": "",
+                        "offline_image_url": "",
+                        "view_count": 0,
+                        "created_at": "2020-01-01T00:00:00Z",
+                    }
+                    for login in logins
+                ]
+            }
+        )
+
+    def _eventsub_method(self, request):
+        """The transport a request's token may manage, as Twitch has it: webhooks for app tokens."""
+        login = self.tokens.get(request.headers.get("Authorization", "").split(" ")[-1])
+        if login is None:
+            raise web.HTTPUnauthorized(text="invalid access token")
+        return "webhook" if login == "app" else "websocket"
+
+    async def _list_subscriptions(self, request):
+        self.requests["list_subscriptions"] += 1
+        method = self._eventsub_method(request)
+        data = [s for s in self.subscriptions.values() if s["transport"]["method"] == method]
+        return web.json_response({"data": data, "total": len(data), "pagination": {}})
+
+    async def _create_subscription(self, request):
+        self.requests["create_subscription"] += 1
+        method = self._eventsub_method(request)
+        body = await request.json()
+        if body["transport"]["method"] != method:
+            raise web.HTTPForbidden(text=f"{body['transport']['method']} subscriptions need a different token")
+        subscription = {
+            "id": str(uuid.uuid4()),
+            "status": "enabled",
+            "type": body["type"],
+            "version": body["version"],
+            "condition": body["condition"],
+            "transport": self._transport(body["transport"]),
+            "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+            "cost": 0,
+        }
+        self.subscriptions[subscription["id"]] = subscription
+        return web.json_response({"data": [subscription], "total": len(self.subscriptions)}, status=202)
+
+    @staticmethod
+    def _transport(transport):
+        if transport["method"] == "websocket":
+            return {"method": "websocket", "session_id": transport["session_id"], "connected_at": _now()}
+        return {"method": "webhook", "callback": transport["callback"]}
+
+    async def _delete_subscription(self, request):
+        self.requests["delete_subscription"] += 1
+        method = self._eventsub_method(request)
+        subscription = self.subscriptions.get(request.query.get("id"))
+        if subscription is None or subscription["transport"]["method"] != method:
+            raise web.HTTPNotFound(text="subscription not found")
+        del self.subscriptions[subscription["id"]]
+        return web.Response(status=204)
+
+    def session_subscriptions(self, session_id):
+        """The subscriptions of a websocket session."""
+        return [
+            s for s in self.subscriptions.values() if s["transport"].get("session_id") == session_id
+        ]
+
+
+class FakeEventSubSender:
+    """Delivers signed EventSub notifications to a webhook callback."""
+
+    def __init__(self, session, url, secret):
+        self.session = session
+        self.url = url
+        self.secret = secret
+        self.sent = 0
+        self.statuses = collections.Counter()
+
+    async def notify_follow(self, broadcaster_id, login="viewer"):
+        now = _now()
+        body = json.dumps(
+            {
+                "subscription": {
+                    "id": str(uuid.uuid4()),
+                    "status": "enabled",
+                    "type": "channel.follow",
+                    "version": "1",
+                    "condition": {"broadcaster_user_id": str(broadcaster_id)},
+                    "transport": {"method": "webhook", "callback": self.url},
+                    "created_at": now,
+                    "cost": 0,
+                },
+                "event": follow_event(broadcaster_id, login, now),
+                TIMESTAMP_TAG: time.perf_counter_ns(),
+            }
+        )
+        message_id = str(uuid.uuid4())
+        signature = hmac.new(
+            self.secret.encode(), (message_id + now + body).encode(), hashlib.sha256
+        ).hexdigest()
+        headers = {
+            "Content-Type": "application/json",
+            "Twitch-Eventsub-Message-Id": message_id,
+            "Twitch-Eventsub-Message-Retry": "0",
+            "Twitch-Eventsub-Message-Type": "notification",
+            "Twitch-Eventsub-Message-Signature": "sha256=" + signature,
+            "Twitch-Eventsub-Message-Timestamp": now,
+            "Twitch-Eventsub-Subscription-Type": "channel.follow",
+            "Twitch-Eventsub-Subscription-Version": "1",
+        }
+        async with self.session.post(self.url, data=body, headers=headers) as response:
+            self.statuses[response.status] += 1
+        self.sent += 1
+
+
+class FakeEventSubWS(_Server):
+    """EventSub's WebSocket endpoint: welcomes, keepalives, notifications and reconnects.
+
+    Notifications go to the sessions holding a matching subscription on
+    helix. Sessions ended by a close are marked websocket_disconnected there,
+    as Twitch does; a session moved by reconnect() keeps its subscriptions.
+    """
+
+    def __init__(self, helix, keepalive=10):
+        super().__init__()
+        self.app.router.add_get("/ws", self._handle)
+        self.helix = helix
+        self.keepalive = keepalive
+        self.sessions = {}
+        self.sent = 0
+        # Cleared to let sessions miss their keepalives.
+        self.keepalives = True
+
+    @staticmethod
+    def _message(typ, payload, subscription=None):
+        metadata = {"message_id": str(uuid.uuid4()), "message_type": typ, "message_timestamp": _now()}
+        if subscription:
+            metadata["subscription_type"] = subscription["type"]
+            metadata["subscription_version"] = subscription["version"]
+        return {"metadata": metadata, "payload": payload}
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        # A reconnect URL carries the session it continues.
+        session_id = request.query.get("session") or uuid.uuid4().hex
+        previous, keepalive = self.sessions.get(session_id, (None, self.keepalive))
+        keepalive = int(request.query.get("keepalive_timeout_seconds", keepalive))
+        self.sessions[session_id] = (ws, keepalive)
+        session = {
+            "id": session_id,
+            "status": "connected",
+            "keepalive_timeout_seconds": keepalive,
+            "reconnect_url": None,
+            "connected_at": _now(),
+        }
+        await ws.send_json(self._message("session_welcome", {"session": session}))
+        if previous is not None:
+            await previous.close()
+        pinger = asyncio.ensure_future(self._keep_alive(ws, keepalive))
+        try:
+            async for msg in ws:
+                # Clients send nothing; Twitch closes the connection when they do.
+                await ws.close(code=4001)
+        finally:
+            pinger.cancel()
+            if self.sessions.get(session_id, (None,))[0] is ws:
+                del self.sessions[session_id]
+                for subscription in self.helix.session_subscriptions(session_id):
+                    subscription["status"] = "websocket_disconnected"
+        return ws
+
+    async def _keep_alive(self, ws, keepalive):
+        while not ws.closed:
+            await asyncio.sleep(keepalive / 2)
+            if self.keepalives and not ws.closed:
+                await ws.send_json(self._message("session_keepalive", {}))
+
+    async def reconnect(self, session_id):
+        """Ask a session to move to a new connection, as Twitch does before maintenance."""
+        ws, _ = self.sessions[session_id]
+        session = {
+            "id": session_id,
+            "status": "reconnecting",
+            "keepalive_timeout_seconds": None,
+            "reconnect_url": f"wss://{EVENTSUB_WS_HOST}/ws?session={session_id}",
+            "connected_at": _now(),
+        }
+        await ws.send_json(self._message("session_reconnect", {"session": session}))
+
+    async def drop(self, session_id):
+        """Close a session's connection, ending the session."""
+        ws, _ = self.sessions[session_id]
+        await ws.close()
+
+    async def notify_follow(self, broadcaster_id, login="viewer"):
+        for session_id, (ws, _) in list(self.sessions.items()):
+            for subscription in self.helix.session_subscriptions(session_id):
+                if (
+                    subscription["type"] == "channel.follow"
+                    and subscription["status"] == "enabled"
+                    and subscription["condition"].get("broadcaster_user_id") == str(broadcaster_id)
+                    and not ws.closed
+                ):
+                    payload = {
+                        "subscription": subscription,
+                        "event": follow_event(broadcaster_id, login, _now()),
+                        TIMESTAMP_TAG: time.perf_counter_ns(),
+                    }
+                    await ws.send_json(self._message("notification", payload, subscription))
+                    self.sent += 1
+
+
+async def paced(rate, duration, send):
+    """Call send(i) rate times per second for duration seconds, in small bursts."""
+    if rate <= 0:
+        return 0
+    tick = 0.01
+    start = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= duration:
+            return sent
+        due = int(elapsed * rate) + 1
+        while sent < due:
+            await send(sent)
+            sent += 1
+        await asyncio.sleep(tick)
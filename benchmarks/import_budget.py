@@ -0,0 +1,73 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Fail when importing the bot entry point gets slower or heavier.
+
+    python -m benchmarks.import_budget --budget-ms 1000
+
+Imports bot.py in fresh interpreters under -X importtime, prints the median
+total and the slowest modules of the median run, and exits non-zero when the
+total is over budget or a module that only some cogs need was imported at
+startup. Those belong behind the cog that uses them, see bots/cogloader.py.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+ENTRY_POINT = "bot"
+BUDGET_MS = 1000
+# Imported on demand by the cogs and services that need them, never by bot.py itself.
+DEFERRED = (
+    "aiohttp.web",
+    "sqlite3",
+    "twitchio.ext.eventsub",
+    "twitchio.ext.pubsub",
+    "uvloop",
+)
+
+
+def import_times(module):
+    """{module: (self_us, cumulative_us)} of one fresh import of module."""
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    stderr = subprocess.run(command, check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default=ENTRY_POINT)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list, by their own time")
+    args = parser.parse_args()
+
+    runs = sorted((import_times(args.module) for _ in range(args.runs)), key=lambda t: t[args.module][1])
+    median = runs[len(runs) // 2]
+    total_ms = statistics.median(t[args.module][1] for t in runs) / 1000
+
+    print(f"{'self ms':>10}{'cumulative ms':>15}  module")
+    slowest = sorted(median.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+    for name, (own, cumulative) in slowest:
+        print(f"{own / 1000:>10.1f}{cumulative / 1000:>15.1f}  {name}")
+    print(f"import {args.module}: {total_ms:.0f}ms over {len(median)} modules (budget {args.budget_ms:.0f}ms)")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import {args.module} took {total_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+    for name in DEFERRED:
+        if name in median:
+            failures.append(f"{name} was imported at startup ({median[name][1] / 1000:.1f}ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Drive real bots and cogs against the local fakes and report how they cope.
+
+    python -m benchmarks.loadtest --bots 10 --channels 5 --rate 20 --duration 30
+    python -m benchmarks.loadtest --cogs echo_console,pubsub,eventsub --pubsub-rate 50 --eventsub-rate 50
+    python -m benchmarks.loadtest --cogs eventsub --eventsub-transport websocket
+
+Everything runs offline: chat, Helix and OAuth traffic of the bots goes
+through a SharedTransport whose resolver points the Twitch hostnames at
+the fakes; only the endpoints twitchio and oauth.user reach through their
+own clients (PubSub, OAuth refreshes) are re-pointed at them directly.
+
+Reports throughput and p50/p99 latency from the fake server's send to the
+end of the bot's handler, per source, plus startup time and memory per bot.
+Exits with an error when an exception went unhandled, such as a task that
+died with nobody awaiting it.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+import aiohttp
+from cryptography.fernet import Fernet
+from twitchio.ext.pubsub.websocket import PubSubWebsocket
+
+import oauth.user
+from benchmarks import fake_twitch
+from bots import eventloop, metrics
+from bots.bot import Bot
+from bots.hosting import SharedTransport
+from bots.logsink import install_log_sink
+from bots.resolver import get_resolver
+from bots.startup import StartupScheduler
+from token_manager import SecureTokenStorage, get_token_store
+
+EVENTSUB_SECRET = "loadtestsecret"
+
+
+class LoadTestTransport(SharedTransport):
+    """SharedTransport that resolves the Twitch hostnames to the fakes."""
+
+    def __init__(self, ports, **kwargs):
+        super().__init__(**kwargs)
+        self.ports = ports
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                resolver=fake_twitch.FakeResolver(self.ports),
+                ssl=False,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+
+class Latencies:
+    """Send-to-handled latencies of one source, in milliseconds."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, sent_ns):
+        self.samples.append((time.perf_counter_ns() - int(sent_ns)) / 1e6)
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return float("nan")
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def summary(self, duration):
+        return {
+            "handled": len(self.samples),
+            "per_second": len(self.samples) / duration,
+            "p50_ms": self.percentile(0.50),
+            "p99_ms": self.percentile(0.99),
+        }
+
+
+def rss_bytes():
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_config(args, eventsub_ports):
+    """A bots mapping and matching env for args.bots synthetic bots."""
+    cogs = [cog for cog in args.cogs.split(",") if cog]
+    bots_config, env_config = {}, {}
+    for index in range(args.bots):
+        name = f"loadbot{index}"
+        cog_config = {}
+        for cog in cogs:
+            cog_config[cog] = {}
+            if cog == "pubsub":
+                cog_config[cog] = {"topics": ["bits"]}
+            elif cog == "eventsub":
+                cog_config[cog] = {
+                    "port": eventsub_ports[index],
+                    "EVENTSUB_SECRET_WORD": EVENTSUB_SECRET,
+                    "EVENTSUB_CALLBACK": f"https://loadtest.invalid/{name}",
+                    "events": ["channel_follow"],
+                    "transport": args.eventsub_transport,
+                }
+        bots_config[name] = {
+            "prefix": "!",
+            "auth_port": 0,
+            "channels": [f"{name}_chan{c}" for c in range(args.channels)],
+            "scopes": ["chat:read", "chat:edit"],
+            "membership": False,
+            "cogs": cog_config,
+        }
+        env_config[f"{name.upper()}_CLIENT_ID"] = fake_twitch.CLIENT_ID
+        env_config[f"{name.upper()}_CLIENT_SECRET"] = "loadtestsecret"
+    return bots_config, env_config
+
+
+def free_ports(count):
+    import socket
+
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+class UnhandledExceptions:
+    """Collects the exceptions that reach the loop's exception handler, then logs them as usual."""
+
+    def __init__(self, loop):
+        self.contexts = []
+        loop.set_exception_handler(self)
+
+    def __call__(self, loop, context):
+        # Unclosed sessions and the like are reported without an exception.
+        if context.get("exception") is not None:
+            self.contexts.append(context)
+        loop.default_exception_handler(context)
+
+
+def instrument(bot, latencies):
+    """Record send-to-handled latency of everything the bot receives."""
+    handle = bot.event_message
+
+    async def event_message(message):
+        await handle(message)
+        sent = (message.tags or {}).get(fake_twitch.TIMESTAMP_TAG)
+        if sent:
+            latencies["irc"].add(sent)
+
+    bot.event_message = event_message
+
+    async def on_pubsub(message):
+        latencies["pubsub"].add(message._data["data"][fake_twitch.TIMESTAMP_TAG])
+
+    async def on_eventsub(subscription_type, payload):
+        latencies["eventsub"].add(json.loads(payload)[fake_twitch.TIMESTAMP_TAG])
+
+    bot.add_event(on_pubsub, "event_pubsub_message")
+    bot.add_event(on_eventsub, "event_eventsub_raw")
+
+
+async def drive(args, bots, irc, pubsub, senders):
+    """Generate chat, PubSub and EventSub traffic for args.duration seconds."""
+    rng = random.Random(7)
+    jobs = []
+    for bot in bots:
+        for channel in bot.channels:
+
+            async def chat(i, channel=channel):
+                command = rng.random() < args.command_ratio
+                await irc.say(channel, "!hello" if command else f"just chatting {i}", login=f"viewer{i % 500}")
+
+            jobs.append(fake_twitch.paced(args.rate, args.duration, chat))
+
+            channel_id = fake_twitch.user_id_for(channel)
+            if "pubsub" in args.cogs:
+
+                async def bits(i, channel_id=channel_id):
+                    await pubsub.publish(
+                        f"channel-bits-events-v2.{channel_id}", pubsub.bits_message(channel_id)
+                    )
+
+                jobs.append(fake_twitch.paced(args.pubsub_rate, args.duration, bits))
+            if bot.name in senders:
+
+                async def follow(i, sender=senders[bot.name], channel_id=channel_id):
+                    await sender.notify_follow(channel_id)
+
+                jobs.append(fake_twitch.paced(args.eventsub_rate, args.duration, follow))
+    await asyncio.gather(*jobs)
+
+
+async def main(args):
+    install_log_sink(level=getattr(logging, args.log_level.upper()))
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+
+    tls = fake_twitch.server_ssl_context()
+    irc, pubsub, helix = fake_twitch.FakeIRC(), fake_twitch.FakePubSub(), fake_twitch.FakeHelix()
+    eventsub_ws = fake_twitch.FakeEventSubWS(helix)
+    irc_port = await irc.start(tls)
+    helix_port = await helix.start(tls)
+    id_plain_port = await helix.start()
+    pubsub_port = await pubsub.start()
+    PubSubWebsocket.ENDPOINT = f"ws://127.0.0.1:{pubsub_port}"
+    oauth.user.TWITCH_AUTH_BASE_URL = f"http://127.0.0.1:{id_plain_port}/"
+    ports = {
+        fake_twitch.IRC_HOST: irc_port,
+        fake_twitch.API_HOST: helix_port,
+        fake_twitch.ID_HOST: helix_port,
+        fake_twitch.EVENTSUB_WS_HOST: await eventsub_ws.start(tls),
+    }
+
+    store = get_token_store(
+        os.path.join(workdir, "tokens.enc"), Fernet.generate_key().decode(), os.path.join(workdir, "key")
+    )
+    get_resolver(os.path.join(workdir, "user_ids.json"))
+    eventsub_ports = free_ports(args.bots)
+    bots_config, env_config = make_config(args, eventsub_ports)
+    for name in bots_config:
+        SecureTokenStorage(name, store).store_tokens(helix.issue(name), helix.issue(name))
+        for channel in bots_config[name]["channels"]:
+            os.environ[f"{channel.upper()}_PUBSUB_TOKEN"] = helix.issue(channel)
+
+    rss_before = rss_bytes()
+    started_at = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    unhandled = UnhandledExceptions(loop)
+    bots = [Bot(name, env_config, config, loop=loop) for name, config in bots_config.items()]
+    latencies = {source: Latencies() for source in ("irc", "pubsub", "eventsub")}
+    for bot in bots:
+        instrument(bot, latencies)
+    transport = LoadTestTransport(ports)
+    scheduler = StartupScheduler(transport=transport)
+    started = await scheduler.start_all(bots)
+    startup = time.perf_counter() - started_at
+    # Let cogs finish their event_ready work (topics, subscriptions, listeners).
+    await asyncio.sleep(args.settle)
+    rss_started = rss_bytes()
+
+    client = aiohttp.ClientSession()
+    senders = {}
+    if "eventsub" in args.cogs:
+        for bot, port in zip(bots, eventsub_ports):
+            if args.eventsub_transport == "websocket":
+                senders[bot.name] = eventsub_ws
+                continue
+            url = f"http://127.0.0.1:{port}/{bot.name}"
+            senders[bot.name] = fake_twitch.FakeEventSubSender(client, url, EVENTSUB_SECRET)
+    # Websocket sessions all share the one sender.
+    eventsub_senders = {id(sender): sender for sender in senders.values()}.values()
+
+    cpu_before = time.process_time()
+    await drive(args, started, irc, pubsub, senders)
+    await asyncio.sleep(args.drain)
+    cpu = time.process_time() - cpu_before
+    rss_after = rss_bytes()
+
+    eventsub_sent = sum(sender.sent for sender in eventsub_senders)
+    delivered = irc.sent + pubsub.sent + eventsub_sent
+    report = {
+        "loop": args.loop,
+        "bots": len(bots),
+        "started": len(started),
+        "channels": sum(len(bot.channels) for bot in bots),
+        "startup_s": startup,
+        "slowest_ready_s": max((t.phases[-1][1] for t in scheduler.timelines.values()), default=0),
+        "rss_per_bot_kib": (rss_started - rss_before) / max(len(bots), 1) / 1024,
+        "rss_growth_during_run_kib": (rss_after - rss_started) / 1024,
+        # Includes the fake servers, which run on the same loop.
+        "cpu_us_per_message": cpu / max(delivered, 1) * 1e6,
+        "irc_sent": irc.sent,
+        "replies_received": irc.received_privmsg,
+        "pubsub_sent": pubsub.sent,
+        "eventsub_sent": eventsub_sent,
+        "helix_requests": dict(helix.requests),
+    }
+    for source, values in latencies.items():
+        report[source] = values.summary(args.duration)
+
+    exposition = metrics.registry.render()
+
+    await client.close()
+    await asyncio.gather(*(bot.close() for bot in bots), return_exceptions=True)
+    await transport.close()
+    for server in (irc, pubsub, helix, eventsub_ws):
+        await server.stop()
+    # Failed tasks nobody awaited are only reported once collected.
+    gc.collect()
+    report["unhandled_exceptions"] = len(unhandled.contexts)
+
+    if args.metrics:
+        print(exposition)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"{report['started']}/{report['bots']} bots, {report['channels']} channels, {args.loop} loop")
+    print(f"startup {report['startup_s']:.2f}s (slowest ready {report['slowest_ready_s']:.2f}s)")
+    print(
+        f"memory {report['rss_per_bot_kib']:.0f} KiB/bot at startup, "
+        f"+{report['rss_growth_during_run_kib']:.0f} KiB during the run"
+    )
+    for source in latencies:
+        summary = report[source]
+        if summary["handled"]:
+            print(
+                f"{source:>8}: {summary['handled']} handled, {summary['per_second']:.0f}/s, "
+                f"p50 {summary['p50_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms"
+            )
+    print(f"cpu {report['cpu_us_per_message']:.0f}us per message, fakes included")
+    print(f"sent irc={report['irc_sent']} pubsub={report['pubsub_sent']} eventsub={report['eventsub_sent']}")
+    print(f"bot replies seen by the fake IRC server: {report['replies_received']}")
+    print(f"unhandled exceptions: {report['unhandled_exceptions']}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loop", choices=eventloop.LOOPS, default="asyncio")
+    parser.add_argument("--bots", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=3, help="channels per bot")
+    parser.add_argument("--rate", type=float, default=20, help="chat messages per second per channel")
+    parser.add_argument("--command-ratio", type=float, default=0.02, help="fraction of chat lines that are commands")
+    parser.add_argument("--pubsub-rate", type=float, default=5, help="bits messages per second per channel")
+    parser.add_argument("--eventsub-rate", type=float, default=5, help="notifications per second per channel")
+    parser.add_argument("--eventsub-transport", choices=("webhook", "websocket"), default="webhook")
+    parser.add_argument("--cogs", default="echo_console", help="comma separated cogs loaded by every bot")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds between startup and load")
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to wait for in-flight events")
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--metrics", action="store_true", help="also print the bots' Prometheus metrics")
+    args = parser.parse_args()
+    loop = eventloop.create_loop(args.loop)
+    report = eventloop.run(loop, main(args))
+    if report["unhandled_exceptions"]:
+        sys.exit(f"{report['unhandled_exceptions']} unhandled exceptions, see the log above")
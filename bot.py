@@ -9,35 +9,173 @@ import yaml
 import asyncio
 from dotenv import dotenv_values
 import argparse
+import multiprocessing
 
+from bots import eventloop, metrics
 from bots.bot import Bot
-
-logging.basicConfig(level=logging.INFO)
+from bots.hosting import SharedTransport
+from bots.logsink import install_log_sink
+from bots.reload import ConfigWatcher, RunningBots
+from bots.resolver import get_resolver
+from bots.scheduler import get_scheduler
+from bots.startup import StartupScheduler
+from bots.supervisor import Supervisor, owns_bot, worker_index
+from bots.watchdog import HEARTBEAT_INTERVAL, REPORT_INTERVAL, STALL_THRESHOLD, StallWatchdog
+from oauth.callback import get_callback_server
+from token_manager import TokenRefreshScheduler, get_token_store
 
 PUBSUB_BOT_NAME = os.getenv("PUBSUB_BOT_NAME", "pubsub")
 
 
-def setup_bots(env_config, bots_config):
+def setup_logging(log_config):
+    """Send all logging through the batched JSON lines sink.
+
+    The optional top-level `logging` section of bots.yaml may set `level` and
+    per-logger `sample` fractions and `rate_limit`s in records per second.
+    """
+    log_config = log_config or {}
+    level = logging.getLevelName(str(log_config.get("level", "INFO")).upper())
+    return install_log_sink(
+        level=level,
+        sample=log_config.get("sample"),
+        rate_limit=log_config.get("rate_limit"),
+    )
+
+
+async def start_monitoring(metrics_config, watchdog_config):
+    """Start the metrics endpoint and the loop lag sampler or stall watchdog.
+
+    Set by the `metrics` and `watchdog` sections of bots.yaml. The watchdog is
+    on unless disabled; it samples loop lag itself. Each --workers process
+    serves metrics on `port` plus its worker index.
+    """
+    services = []
+    metrics_config = metrics_config or {}
+    watchdog_config = watchdog_config or {}
+    if watchdog_config.get("enabled", True):
+        services.append(
+            StallWatchdog(
+                threshold=watchdog_config.get("threshold", STALL_THRESHOLD),
+                interval=watchdog_config.get("interval", HEARTBEAT_INTERVAL),
+                report_interval=watchdog_config.get("report_interval", REPORT_INTERVAL),
+            )
+        )
+    elif metrics_config and metrics_config.get("enabled", True):
+        services.append(metrics.LoopLagMonitor(metrics_config.get("loop_lag_interval", metrics.LOOP_LAG_INTERVAL)))
+    for service in services:
+        service.start()
+    if metrics_config and metrics_config.get("enabled", True):
+        port = metrics_config.get("port", metrics.METRICS_PORT) + (worker_index() or 0)
+        server = metrics.MetricsServer(metrics_config.get("host", "127.0.0.1"), port)
+        await server.start()
+        services.append(server)
+    return services
+
+
+def setup_oauth(oauth_config):
+    """Have every bot authorize through one redirect URL.
+
+    Set by the optional `oauth` section of bots.yaml: `redirect_uri`, registered
+    with every bot's app, and the `port` to listen on if it isn't the URL's.
+    Without it each bot is redirected to localhost on its own `auth_port`.
+    """
+    if oauth_config and oauth_config.get("redirect_uri"):
+        get_callback_server().configure(oauth_config["redirect_uri"], oauth_config.get("port"))
+
+
+def load_token_store(env_config):
+    """Decrypt every bot's tokens with a single read before the bots ask for them."""
+    get_token_store(
+        env_config.get("TOKEN_STORE_PATH"),
+        env_config.get("TOKEN_STORE_KEY"),
+        env_config.get("TOKEN_KEY_PATH"),
+    ).load()
+
+
+def setup_bots(env_config, bots_config, loop=None):
     bot_list = []
     for bot_name, bot_config in (bots_config or {}).items():
         print(f"Bot config for {bot_name}: {bot_config}")
-        bot = Bot(bot_name, env_config, bot_config)
+        bot = Bot(bot_name, env_config, bot_config, loop=loop)
         bot_list.append(bot)
     return bot_list
 
 
-async def run_bots(bots):
-    tasks = []
-    for bot in bots:
-        tasks.append(bot.run())
-        await asyncio.sleep(1)  # Sleep for 1 second between starting each bot
-    await asyncio.gather(*tasks)
+async def run_bots(bots, shared_transport=False, config=None, env_config=None, reload_from=None):
+    """Run the bots until cancelled; with reload_from, keep them in step with that bots.yaml."""
+    config = config or {}
+    setup_oauth(config.get("oauth"))
+    services = await start_monitoring(config.get("metrics"), config.get("watchdog"))
+    transport = SharedTransport() if shared_transport else None
+    scheduler = StartupScheduler(transport=transport)
+    tokens = TokenRefreshScheduler()
+    running = RunningBots(env_config or {}, scheduler, tokens, loop=asyncio.get_running_loop())
+    tokens.start()
+    started = await running.start_all(bots)
+    watcher = None
+    if reload_from:
+        # A worker runs the bots whose names hash to its shard, including new ones.
+        watcher = ConfigWatcher(reload_from, running, owns=owns_bot if worker_index() is not None else None)
+        watcher.start()
+    try:
+        if started or watcher:
+            await asyncio.Future()  # Run forever
+    finally:
+        if watcher:
+            await watcher.stop()
+        await tokens.stop()
+        # Routine next runs changed since the last periodic save would be lost otherwise.
+        await get_scheduler().stop()
+        await running.close_all()
+        if transport:
+            await transport.close()
+        for service in services:
+            await service.stop()
+
+
+def run(env_config, bots_config, config, loop_kind="asyncio", shared_transport=False, reload_from=None):
+    """Create this process's event loop, build every bot on it and run them."""
+    loop = eventloop.create_loop(loop_kind)
+    bots = setup_bots(env_config, bots_config, loop)
+    eventloop.run(loop, run_bots(bots, shared_transport, config, env_config, reload_from))
+
+
+def run_worker(bots_config, env_config, config, loop_kind, shared_transport, reload_from):
+    """Entry point of a --workers process, running its shard of the bots."""
+    load_token_store(env_config)
+    get_resolver(env_config.get("USER_ID_CACHE_PATH"))
+    get_scheduler(env_config.get("ROUTINES_STATE_PATH"))
+    run(env_config, bots_config, config, loop_kind, shared_transport, reload_from)
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", help="The path to bots.yaml configuration file", default="bots.yaml")
+    parser.add_argument(
+        "--shared-transport",
+        action="store_true",
+        help="Host every bot on one shared HTTP session and connection pool",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Split the bots across this many supervised worker processes",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=eventloop.LOOPS,
+        default="asyncio",
+        help="The event loop implementation; uvloop is faster but not available on Windows",
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="Apply changes to the bots section of the configuration file without restarting",
+    )
     args = parser.parse_args()
+    reload_from = args.config if args.reload else None
 
     # Load environment configuration
     env_config = dotenv_values(".env")
@@ -45,11 +183,31 @@ if __name__ == "__main__":
     try:
         # Load bots configuration
         with open(args.config, "r") as file:
-            bots_config = yaml.safe_load(file)["bots"]
+            config = yaml.safe_load(file)
+        bots_config = config["bots"]
     except FileNotFoundError:
         print(f"Configuration file not found: {args.config}")
         sys.exit(1)
 
-    # Setup bots using the loaded configurations
-    bots = setup_bots(env_config, bots_config)
-    asyncio.run(run_bots(bots))
+    sink = setup_logging(config.get("logging"))
+    metrics.registry.add_collector(lambda: metrics.QUEUE_DEPTH.labels("", "log_sink").set(sink.queue.qsize()))
+
+    load_token_store(env_config)
+    get_resolver(env_config.get("USER_ID_CACHE_PATH"))
+    get_scheduler(env_config.get("ROUTINES_STATE_PATH"))
+
+    if args.workers > 1:
+        supervisor = Supervisor(
+            run_worker,
+            bots_config,
+            args.workers,
+            args=(env_config, config, args.loop, args.shared_transport, reload_from),
+            log_filter=sink.filter,
+            log_handler=sink.handler,
+            # Bots added later may hash to a shard that has none yet.
+            keep_empty=bool(reload_from),
+        )
+        supervisor.run()
+        sys.exit(0)
+
+    run(env_config, bots_config, config, args.loop, args.shared_transport, reload_from)
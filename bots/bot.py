@@ -1,5 +1,17 @@
+import asyncio
+import inspect
+import time
+import warnings
+
+from twitchio.channel import Channel
 from twitchio.ext import commands
 
+from bots import cogloader, metrics
+from bots.eventbus import RECORDS, get_event_bus
+from bots.hosting import LEAN_MODES
+from bots.outbound import OutboundScheduler
+from bots.router import CommandRouter
+from bots.shards import SHARD_CAPACITY, Connection, ShardPool
 from token_manager import TokenManager, SecureTokenStorage
 
 import logging
@@ -8,15 +20,71 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_PREFIX = "!"
 
+
+class Context(commands.Context):
+    """commands.Context whose send is timed; see bots.metrics."""
+
+    async def send(self, content):
+        start = time.perf_counter()
+        try:
+            return await super().send(content)
+        except Exception:
+            self.bot._send_errors.inc()
+            raise
+        finally:
+            self.bot._send_seconds.observe(time.perf_counter() - start)
+
+
+def _cog_of(callback):
+    """The cog instance an event callback is bound to, else None."""
+    instance = getattr(callback, "__self__", None)
+    if instance is None:
+        # Cogs register their listeners as partial(func, cog).
+        args = getattr(callback, "args", None)
+        instance = args[0] if args else None
+    if isinstance(instance, commands.Cog):
+        return instance
+    return None
+
+
+def _owner(callback):
+    """The name of the cog an event callback belongs to, else "bot"."""
+    cog = _cog_of(callback)
+    return cog.name if cog is not None else "bot"
+
+
+def cog_configs(bot_config):
+    """The bot's cogs as {name: config}; a plain list loads each with an empty config."""
+    cogs = bot_config.get('cogs') or {}
+    if isinstance(cogs, list):
+        cogs = {cog_name: {} for cog_name in cogs}
+    return cogs
+
+
 class Bot(commands.Bot):
-    def __init__(self, name, env_config, bot_config):
+    def __init__(self, name, env_config, bot_config, loop=None):
         self.name = name
+        # What the bot was built from, for bots.reload to diff against.
+        self.config = bot_config
         self.client_id = env_config[f'{name.upper()}_CLIENT_ID']
         self.client_secret = env_config[f'{name.upper()}_CLIENT_SECRET']
         self.prefix = bot_config.get('prefix', '!')
-        self.auth_port = bot_config['auth_port']
+        # Only used without a shared oauth.redirect_uri; see oauth.callback.
+        self.auth_port = bot_config.get('auth_port')
         self.channels = bot_config['channels']
         self.scopes = bot_config['scopes']
+        self.verified = bot_config.get('verified', False)
+        # None lets the hosting mode decide; see bots.hosting.SharedTransport.
+        self.membership = bot_config.get('membership')
+        self.case_insensitive = bot_config.get('case_insensitive', False)
+        self.transport = None
+        self.bus = get_event_bus()
+        self._router = None
+        # Metric children per command and per event callback, made on first use.
+        self._command_metrics = {}
+        self._event_metrics = {}
+        self._send_seconds = metrics.SEND_SECONDS.labels(self.name, "ctx")
+        self._send_errors = metrics.SEND_ERRORS.labels(self.name, "ctx")
 
         # Initialize the TokenManager and get the access and refresh tokens
         self.token_manager = TokenManager(
@@ -24,28 +92,222 @@ class Bot(commands.Bot):
             self.client_secret,
             self.auth_port,
             self.scopes,
-            SecureTokenStorage(f"{self.name}_tokens"),
+            SecureTokenStorage(self.name),
         )
 
-        # Initialize the Bot with the generated token
-        self._app_token, self._refresh_token = self.loop.run_until_complete(self.token_manager.generate_token())
+        # Stored tokens are enough to construct the client; authorize() runs
+        # the OAuth flow for bots that have none yet. Channels are joined after
+        # connecting so that JOINs can be paced by the startup scheduler.
+        self._app_token, self._refresh_token = self.token_manager.token_storage.retrieve_tokens()
         super().__init__(
-            command_prefix=self.prefix,
-            initial_channels=self.channels,
-            loop=bot_config.get("loop"),
+            token=self._app_token or "",
+            client_secret=self.client_secret,
+            prefix=self.prefix,
+            case_insensitive=self.case_insensitive,
         )
+        if loop is not None:
+            # commands.Bot does not pass a loop on to twitchio's Client.
+            self.loop = loop
+        self._connection = Connection(
+            client=self, token=self._connection._token, loop=self.loop, heartbeat=self._heartbeat
+        )
+        if self.membership is False:
+            self._connection.modes = LEAN_MODES
+        self.shards = ShardPool(self, bot_config.get('channels_per_connection', SHARD_CAPACITY))
+        self.outbound = OutboundScheduler(self)
+        metrics.registry.add_collector(self.collect_metrics)
 
-        for cog_name, cog_config in bot_config.get('cogs', {}).items():
+        for cog_name, cog_config in cog_configs(bot_config).items():
             self.load_cog(cog_name, cog_config)
 
     def load_cog(self, cog_name, cog_config):
-        """Loads a cog dynamically."""
+        """Loads a cog dynamically.
+
+        A bot that is already connected won't fire event_ready again, so the
+        cog's own event_ready handlers are run right away instead.
+        """
         try:
-            module = __import__(f"cogs.{cog_name}", fromlist=[''])
-            cog_class = getattr(module, 'Cog')
-            self.add_cog(cog_class(self, cog_config))
+            cog_class = cogloader.cog_class(cog_name)
         except ImportError:
-            logger.info(f"Couldn't load cog {cog_name}")
+            return None
+        cog = cog_class(self, cog_config)
+        self.add_cog(cog)
+        if self._connection.is_ready.is_set():
+            for callback in self._events.get("event_ready", ()):
+                if _cog_of(callback) is cog:
+                    self.loop.create_task(self._timed_event("event_ready", callback, ()))
+        return cog
+
+    async def unload_cog(self, cog_name):
+        """Remove a cog with its commands and event handlers, then close it."""
+        cog = self.cogs.get(cog_name)
+        if cog is None:
+            return False
+        self.remove_cog(cog_name)
+        # remove_cog leaves the cog's listeners registered, and cogs add
+        # handlers of their own to the bot from event_ready.
+        module = type(cog).__module__
+        for callbacks in self._events.values():
+            callbacks[:] = [
+                callback
+                for callback in callbacks
+                if _cog_of(callback) is not cog and getattr(callback, "__module__", None) != module
+            ]
+        for callback in [callback for callback in self._event_metrics if _cog_of(callback) is cog]:
+            del self._event_metrics[callback]
+        close = getattr(cog, "close", None)
+        if close is not None:
+            await close()
+        return True
+
+    async def join_channels(self, channels):
+        """Join channels over as many connections as they need; see bots.shards."""
+        await self.shards.join(channels)
+
+    async def part_channels(self, channels):
+        """Leave channels; twitchio only knows how to join them."""
+        parted = {channel.lstrip("#").lower() for channel in channels}
+        await self.shards.part(parted)
+        self.channels = [channel for channel in self.channels if channel.lstrip("#").lower() not in parted]
+
+    def get_channel(self, name):
+        """The joined channel name, bound to the connection that carries it, else None."""
+        name = name.lstrip("#").lower()
+        connection = self.shards.connection_for(name)
+        if name in connection._cache:
+            return Channel(name=name, websocket=connection)
+        return None
+
+    @property
+    def connected_channels(self):
+        """Every joined channel, over all of the bot's connections."""
+        return self.shards.channels()
+
+    @property
+    def router(self):
+        """The command router, compiled on first use after commands change."""
+        if self._router is None:
+            self._router = CommandRouter(
+                self.prefix, self._commands, self._command_aliases, self.case_insensitive
+            )
+        return self._router
+
+    def add_command(self, command):
+        self._router = None
+        super().add_command(command)
+
+    def remove_command(self, name):
+        self._router = None
+        super().remove_command(name)
+
+    async def get_context(self, message, *, cls=None):
+        """Same contract as commands.Bot.get_context, looked up through the router."""
+        cls = cls or Context
+        prefix = self.router.prefix_of(message.content)
+        if prefix is None:
+            return cls(message=message, prefix=None, valid=False, bot=self)
+        return self._routed_context(message, prefix, cls)
+
+    def _routed_context(self, message, prefix, cls=Context):
+        name, command, view = self.router.resolve(message.content, prefix)
+        if command is None:
+            context = cls(message=message, bot=self, prefix=prefix, command=None, valid=False, view=view)
+            self.run_event("command_error", context, commands.CommandNotFound(f'No command "{name}" was found.'))
+            return context
+        return cls(message=message, bot=self, prefix=prefix, command=command, valid=True, view=view)
+
+    async def handle_commands(self, message):
+        # Plain chat is rejected before any Context is built for it.
+        prefix = self.router.prefix_of(message.content)
+        if prefix is None:
+            return
+        await self.invoke(self._routed_context(message, prefix))
+
+    def _command_children(self, command):
+        children = self._command_metrics.get(command)
+        if children is None:
+            labels = (self.name, command.cog.name if command.cog else "bot", command.full_name)
+            children = self._command_metrics[command] = (
+                metrics.COMMAND_SECONDS.labels(*labels),
+                metrics.COMMAND_ERRORS.labels(*labels),
+            )
+        return children
+
+    async def invoke(self, context):
+        if not context.prefix or not context.is_valid:
+            return
+        self.run_event("command_invoke", context)
+        seconds, _ = self._command_children(context.command)
+        start = time.perf_counter()
+        try:
+            await context.command(context)
+        finally:
+            seconds.observe(time.perf_counter() - start)
+
+    def run_event(self, event_name, *args):
+        """Same as twitchio's run_event, with every handler timed per cog.
+
+        Chat, PubSub and EventSub events are also published to the event bus,
+        see bots.eventbus, when anyone subscribes to them.
+        """
+        name = f"event_{event_name}"
+        record_type = RECORDS.get(event_name)
+        if record_type is not None and self.bus.wants(record_type, self.name):
+            try:
+                record = record_type.of(self.name, *args)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                logger.warning(f"{self.name}: no {record_type.__name__} from {event_name}: {e!r}")
+                record = None
+            if record is not None:
+                self.bus.publish(record)
+        if event_name == "command_error" and args and args[0].command is not None:
+            # Failed commands, checks and cooldowns all end up here.
+            self._command_children(args[0].command)[1].inc()
+
+        inner_cb = getattr(self, name, None)
+        if inner_cb is not None:
+            if inspect.iscoroutinefunction(inner_cb):
+                self.loop.create_task(self._timed_event(name, inner_cb, args))
+            else:
+                warnings.warn(f"event '{name}' callback is not a coroutine", category=RuntimeWarning)
+
+        for callback in self._events.get(name, ()):
+            self.loop.create_task(self._timed_event(name, callback, args))
+
+        for e, check, future in list(self._waiting):
+            if e == event_name:
+                if check(*args):
+                    future.set_result(args)
+            if future.done():
+                self._waiting.remove((e, check, future))
+
+    async def _timed_event(self, name, callback, args):
+        children = self._event_metrics.get(callback)
+        if children is None:
+            labels = (self.name, _owner(callback), name[len("event_"):])
+            children = self._event_metrics[callback] = (
+                metrics.EVENT_SECONDS.labels(*labels),
+                metrics.EVENT_ERRORS.labels(*labels),
+            )
+        start = time.perf_counter()
+        try:
+            await callback(*args)
+        except Exception as e:
+            children[1].inc()
+            if name == "event_error":
+                # don't enter a dispatch loop!
+                raise
+            self.run_event("error", e)
+        finally:
+            children[0].observe(time.perf_counter() - start)
+
+    def collect_metrics(self):
+        """Refresh this bot's queue depth gauges; runs at every metrics scrape."""
+        depth = metrics.QUEUE_DEPTH
+        depth.labels(self.name, "outbound").set(sum(c.depth for c in self.outbound.channels.values()))
+        for cog in self.cogs.values():
+            for queue, value in getattr(cog, "queue_depths", dict)().items():
+                depth.labels(self.name, f"{cog.name}.{queue}").set(value)
 
     async def __aenter__(self):
         await self.connect()
@@ -54,24 +316,68 @@ class Bot(commands.Bot):
     async def __aexit__(self, exc_type, exc, tb):
         await self.close()
 
+    async def close(self):
+        """Disconnect this bot only.
+
+        twitchio's close also closes the HTTP session and stops the event loop,
+        which would take down every other bot hosted in the process.
+        """
+        await self.outbound.close()
+        await self.shards.close()
+        metrics.registry.remove_collector(self.collect_metrics)
+        if self.transport:
+            self.transport.detach(self)
+        connection = self._connection
+        if connection._keeper:
+            connection._keeper.cancel()
+        connection.is_ready.clear()
+        for fut in connection._fetch_futures():
+            fut.cancel()
+        if connection._websocket:
+            await connection._websocket.close()
+        if self._http.session:
+            await self._http.session.close()
+
+    async def event_command_error(self, context, error):
+        """Cooldowns are expected under load and only counted; anything else is printed."""
+        if isinstance(error, commands.CommandOnCooldown):
+            logger.debug(f"{self.name}: {error}")
+            return
+        await super().event_command_error(context, error)
+
     async def event_ready(self):
         """event_ready."""
         # Notify us when everything is ready!
         # We are logged in and ready to chat and use commands...
         logger.info(f"Logged in as | {self.nick}")
 
+    async def authorize(self):
+        """Make sure the bot holds a token before it connects."""
+        if not self._app_token:
+            self.set_tokens(*await self.token_manager.generate_token())
+
+    async def event_userstate(self, user):
+        """Twitch sends our USERSTATE on join and after each message we send."""
+        self.outbound.set_mod(user.channel.name, user.is_mod)
+
+    def say(self, channel, content, lane="default"):
+        """Send to a channel through the outbound scheduler; see bots.outbound."""
+        return self.outbound.send(channel, content, lane)
+
     async def event_token_expired(self):
         """event_token_expired."""
-        self._app_token, self._refresh_token = await self.token_manager.refresh_tokens()
+        access_token, _ = await self.token_manager.refresh_tokens()
+        return access_token
+
+    def set_tokens(self, access_token, refresh_token):
+        """Swap in refreshed tokens; the next request and reconnect use them."""
+        self._app_token, self._refresh_token = access_token, refresh_token
+        self._http.token = access_token
+        self._http._refresh_token = refresh_token
+        self.shards.set_token(access_token)
 
     async def run(self):
+        await self.authorize()
         async with self:
+            await self.join_channels(self.channels)
             await asyncio.Future()  # Run forever
-
-    async def refresh_token_task(self):
-        while True:
-            await asyncio.sleep(3600)  # Wait for 1 hour
-            try:
-                self._app_token, self._refresh_token = await self.token_manager.refresh_tokens()
-            except Exception as e:
-                print(f"Failed to refresh token: {e}")
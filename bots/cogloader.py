@@ -0,0 +1,47 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Cog name to Cog class resolution, done once per process.
+
+A module is only imported once a bot enables its cog, which keeps the
+subsystems behind eventsub, pubsub and chatlog out of processes that don't
+use them. Failed imports are remembered too: Python retries a failed import
+every time, so a broken cog would otherwise be re-imported and reported once
+per bot that names it.
+"""
+
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+COG_PACKAGE = "cogs"
+
+__classes = {}
+
+
+def cog_class(name):
+    """The Cog class of cogs.<name>; raises ImportError if it can't be loaded."""
+    try:
+        found = __classes[name]
+    except KeyError:
+        found = __classes[name] = _import(name)
+    if isinstance(found, ImportError):
+        raise found
+    return found
+
+
+def _import(name):
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(f"{COG_PACKAGE}.{name}")
+        found = getattr(module, "Cog")
+    except ImportError as e:
+        logger.warning(f"Couldn't load cog {name}: {e}")
+        return e
+    except AttributeError:
+        logger.warning(f"Couldn't load cog {name}: {COG_PACKAGE}.{name} has no Cog class")
+        return ImportError(f"{COG_PACKAGE}.{name} has no Cog class")
+    logger.debug(f"imported cog {name} in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return found
+
@@ -0,0 +1,248 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""One stream of typed events for chat, PubSub and EventSub.
+
+Bot.run_event turns the events of every source into compact records,
+ChatMessage, PubSubEvent and EventSubNotification, and publishes them here.
+A subscriber gets the records of one type, of one bot or of all of them,
+through its own bounded queue drained by its own task, in order. Publishing
+never waits: when a queue is full its overflow policy decides what is lost,
+
+    drop_oldest  make room by dropping the oldest waiting record (the default)
+    drop_newest  drop the record being published
+
+so a slow subscriber only loses its own records and stalls nothing else.
+Records are only built for types someone subscribes to.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import time
+
+from bots import metrics
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW = ("drop_oldest", "drop_newest")
+QUEUE_SIZE = 1000
+
+DROPPED = metrics.registry.counter(
+    "bus_dropped_total", "Records an event bus subscriber lost to its overflow policy.", ("bot", "subscriber")
+)
+
+
+class Record:
+    """What every record has: the bot it reached, its kind and when it arrived (monotonic)."""
+
+    __slots__ = ("bot", "kind", "received_at")
+
+    def __init__(self, bot, kind):
+        self.bot = bot
+        self.kind = kind
+        self.received_at = time.monotonic()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"<{type(self).__name__} {self.bot} {self.kind}: {fields}>"
+
+
+class ChatMessage(Record):
+    """A chat line; tags are as twitchio parsed them and raw is the IRC line."""
+
+    __slots__ = ("channel", "user", "user_id", "text", "tags", "raw")
+
+    def __init__(self, bot, channel, user, user_id, text, tags, raw):
+        super().__init__(bot, "chat")
+        self.channel = channel
+        self.user = user
+        self.user_id = user_id
+        self.text = text
+        self.tags = tags
+        self.raw = raw
+
+    @classmethod
+    def of(cls, bot, message):
+        """From event_message's arguments; None for the bot's own messages."""
+        if message.echo or message.channel is None:
+            return None
+        tags = message.tags or {}
+        return cls(
+            bot, message.channel.name, message.author.name, tags.get("user-id"), message.content, tags, message.raw_data
+        )
+
+
+class PubSubEvent(Record):
+    """A PubSub message; kind is its message type, data its decoded message."""
+
+    __slots__ = ("topic", "channel_id", "data")
+
+    def __init__(self, bot, kind, topic, channel_id, data):
+        super().__init__(bot, kind)
+        self.topic = topic
+        self.channel_id = channel_id
+        self.data = data
+
+    @classmethod
+    def of(cls, bot, message):
+        """From event_pubsub_message's arguments."""
+        data = message._data
+        inner = data.get("data")
+        channel_id = inner.get("channel_id") if isinstance(inner, dict) else None
+        kind = data.get("message_type") or data.get("type") or (message.topic or "").split(".")[0]
+        return cls(bot, kind, message.topic, channel_id, data)
+
+
+class EventSubNotification(Record):
+    """An EventSub notification; kind is its subscription type, payload the body as received."""
+
+    __slots__ = ("version", "channel_id", "event", "payload")
+
+    def __init__(self, bot, kind, version, channel_id, event, payload):
+        super().__init__(bot, kind)
+        self.version = version
+        self.channel_id = channel_id
+        self.event = event
+        self.payload = payload
+
+    @classmethod
+    def of(cls, bot, subscription_type, payload):
+        """From event_eventsub_raw's arguments."""
+        body = json.loads(payload)
+        subscription = body.get("subscription", {})
+        event = body.get("event", {})
+        condition = subscription.get("condition", {})
+        channel_id = event.get("broadcaster_user_id") or next(iter(condition.values()), None)
+        return cls(bot, subscription_type, subscription.get("version"), channel_id, event, payload)
+
+
+# run_event names -> the record built from their arguments.
+RECORDS = {
+    "message": ChatMessage,
+    "pubsub_message": PubSubEvent,
+    "eventsub_raw": EventSubNotification,
+}
+
+
+class Subscription:
+    """A subscriber's queue and the task handing its records to handler, one at a time."""
+
+    def __init__(self, bus, record_type, handler, bot=None, kinds=None, maxsize=QUEUE_SIZE, overflow="drop_oldest", name=None):
+        if overflow not in OVERFLOW:
+            raise ValueError(f"unknown overflow policy {overflow}, expected one of {', '.join(OVERFLOW)}")
+        self.bus = bus
+        self.record_type = record_type
+        self.handler = handler
+        self.bot = bot
+        self.kinds = frozenset(kinds) if kinds else None
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.name = name or getattr(handler, "__qualname__", repr(handler))
+        self.queue = collections.deque()
+        self.handled = 0
+        self.failed = 0
+        self._dropped = DROPPED.labels(bot or "", self.name)
+        self._waiter = None
+        self._task = None
+
+    def __repr__(self):
+        return f"<subscription {self.name} to {self.record_type.__name__}, {len(self.queue)} waiting>"
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    @property
+    def dropped(self):
+        return self._dropped.value
+
+    def offer(self, record):
+        """Queue record for the handler, by the overflow policy when the queue is full."""
+        if self.kinds is not None and record.kind not in self.kinds:
+            return
+        if len(self.queue) >= self.maxsize:
+            self._dropped.inc()
+            if self.overflow == "drop_newest":
+                return
+            self.queue.popleft()
+        self.queue.append(record)
+        # Started on first use; subscribers may subscribe before the loop runs.
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        elif self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        queue = self.queue
+        while True:
+            while queue:
+                record = queue.popleft()
+                try:
+                    await self.handler(record)
+                    self.handled += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.exception(f"event bus subscriber {self.name} failed on {record!r}: {e!r}")
+            self._waiter = loop.create_future()
+            await self._waiter
+
+    def close(self):
+        """Stop handing out records; those waiting are dropped."""
+        self.bus.unsubscribe(self)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.queue.clear()
+
+
+class EventBus:
+    """Subscriptions by record type and bot, and publishing to them."""
+
+    def __init__(self):
+        # (record type, bot name or None for every bot) -> subscriptions
+        self._subscriptions = {}
+
+    def subscribe(self, record_type, handler, bot=None, kinds=None, maxsize=QUEUE_SIZE, overflow="drop_oldest", name=None):
+        """Have handler(record) awaited for every record_type of bot, or of every bot when None.
+
+        kinds limits it to records of those kinds. At most maxsize records wait
+        for the handler; see the module docstring for overflow.
+        """
+        subscription = Subscription(self, record_type, handler, bot, kinds, maxsize, overflow, name)
+        self._subscriptions.setdefault((record_type, bot), []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        key = (subscription.record_type, subscription.bot)
+        subscriptions = self._subscriptions.get(key, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+        if not subscriptions:
+            self._subscriptions.pop(key, None)
+
+    def wants(self, record_type, bot):
+        """Whether anyone subscribes to record_type of bot; records aren't built otherwise."""
+        return (record_type, bot) in self._subscriptions or (record_type, None) in self._subscriptions
+
+    def publish(self, record):
+        """Queue record for its subscribers, never waiting."""
+        record_type = type(record)
+        for key in ((record_type, record.bot), (record_type, None)):
+            for subscription in self._subscriptions.get(key, ()):
+                subscription.offer(record)
+
+    def subscriptions(self):
+        return [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+
+
+__event_bus = None
+
+
+def get_event_bus():
+    """The process-wide EventBus, created on first use."""
+    global __event_bus
+    if __event_bus is None:
+        __event_bus = EventBus()
+    return __event_bus
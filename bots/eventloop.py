@@ -0,0 +1,56 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The one event loop all bots of a process run on."""
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOOPS = ("asyncio", "uvloop")
+
+
+def create_loop(kind="asyncio"):
+    """A new event loop of the given kind, made current for this thread.
+
+    twitchio's Client looks the loop up when a bot is constructed, so it must
+    be current before the bots are built.
+    """
+    if kind == "uvloop":
+        try:
+            import uvloop
+        except ImportError:
+            raise RuntimeError("the uvloop loop needs the uvloop package, which does not support Windows")
+        loop = uvloop.new_event_loop()
+    elif kind == "asyncio":
+        loop = asyncio.new_event_loop()
+    else:
+        raise ValueError(f"unknown event loop {kind}, expected one of {', '.join(LOOPS)}")
+    asyncio.set_event_loop(loop)
+    logger.info(f"running on the {kind} event loop")
+    return loop
+
+
+def _cancel_all_tasks(loop):
+    tasks = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            loop.call_exception_handler(
+                {"message": "unhandled exception during shutdown", "exception": task.exception(), "task": task}
+            )
+
+
+def run(loop, main):
+    """Run the main coroutine on loop, then clean up and close it like asyncio.run does."""
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            _cancel_all_tasks(loop)
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
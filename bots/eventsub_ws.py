@@ -0,0 +1,168 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""EventSub over a WebSocket session instead of webhooks.
+
+Twitch sends the notifications of a session down one websocket the bot opens
+itself, so no public TLS endpoint is needed. A session starts with a welcome
+carrying its id, which subscriptions are created against and die with. Twitch
+then sends a keepalive whenever nothing else was sent for the keepalive
+timeout; silence beyond it means the connection is gone. Before maintenance
+it sends a reconnect URL: connecting there keeps the session and its
+subscriptions, and the old connection closes once the new one is welcomed.
+
+Messages reach deliver() with headers shaped like a webhook delivery's, so
+both transports share the same handlers.
+"""
+
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+EVENTSUB_WS_URL = "wss://eventsub.wss.twitch.tv/ws"
+# Twitch accepts 10 to 600 seconds.
+KEEPALIVE_TIMEOUT = 30
+# Allowed on top of the keepalive timeout before the connection counts as dead.
+KEEPALIVE_GRACE = 5
+# Twitch welcomes within seconds and closes sessions not subscribed to within 10.
+WELCOME_TIMEOUT = 10
+RECONNECT_BACKOFF_MIN = 1
+RECONNECT_BACKOFF_MAX = 60
+
+
+def webhook_headers(metadata):
+    """The webhook headers matching a websocket message's metadata; there is nothing to sign."""
+    return {
+        "Twitch-Eventsub-Message-Id": metadata["message_id"],
+        "Twitch-Eventsub-Message-Retry": "0",
+        "Twitch-Eventsub-Message-Type": metadata["message_type"],
+        "Twitch-Eventsub-Message-Signature": "",
+        "Twitch-Eventsub-Message-Timestamp": metadata["message_timestamp"],
+        "Twitch-Eventsub-Subscription-Type": metadata.get("subscription_type", ""),
+        "Twitch-Eventsub-Subscription-Version": metadata.get("subscription_version", ""),
+    }
+
+
+class EventSubSession:
+    """One EventSub WebSocket session, kept alive and carried across Twitch's reconnects.
+
+    deliver(typ, headers, payload) is awaited for every notification and
+    revocation, in order. on_session(session_id) is started for every new
+    session, which has no subscriptions yet.
+    """
+
+    def __init__(self, bot, deliver, on_session, url=None, keepalive=KEEPALIVE_TIMEOUT):
+        self.bot = bot
+        self.deliver = deliver
+        self.on_session = on_session
+        self.url = url or EVENTSUB_WS_URL
+        self.keepalive = keepalive
+        self.session_id = None
+        self.reconnects = 0
+        self._http = None
+
+    @property
+    def http(self):
+        """The bot's HTTP session, or one of our own before it has one."""
+        if self.bot._http.session is not None and not self.bot._http.session.closed:
+            return self.bot._http.session
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession()
+        return self._http
+
+    async def _connect(self, url):
+        """Open url and wait for its welcome; returns the websocket."""
+        ws = await self.http.ws_connect(url)
+        try:
+            msg = await asyncio.wait_for(ws.receive(), WELCOME_TIMEOUT)
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                raise ConnectionError(f"eventsub websocket closed before its welcome: {msg.type!r}")
+            message = json.loads(msg.data)
+            if message["metadata"]["message_type"] != "session_welcome":
+                raise ConnectionError(f"eventsub websocket sent {message['metadata']['message_type']} before its welcome")
+        except BaseException:
+            await ws.close()
+            raise
+        session = message["payload"]["session"]
+        self.keepalive = session.get("keepalive_timeout_seconds") or self.keepalive
+        if session["id"] != self.session_id:
+            self.session_id = session["id"]
+            logger.info(f"{self.bot.name} eventsub session {self.session_id} started")
+            asyncio.ensure_future(self.on_session(self.session_id))
+        return ws
+
+    async def _handle(self, message):
+        """Deliver a message; returns the reconnect URL when Twitch asks to move."""
+        metadata = message["metadata"]
+        typ = metadata["message_type"]
+        if typ in ("notification", "revocation"):
+            payload = message["payload"]
+            # twitchio's Subscription model expects a webhook's callback.
+            payload["subscription"]["transport"].setdefault("callback", None)
+            await self.deliver(typ, webhook_headers(metadata), json.dumps(payload))
+        elif typ == "session_reconnect":
+            return message["payload"]["session"]["reconnect_url"]
+        elif typ != "session_keepalive":
+            logger.warning(f"unexpected eventsub websocket message {typ}")
+        return None
+
+    async def _receive(self, ws):
+        """Handle messages until the session's connection is closed or goes quiet."""
+        try:
+            while True:
+                try:
+                    msg = await asyncio.wait_for(ws.receive(), self.keepalive + KEEPALIVE_GRACE)
+                except asyncio.TimeoutError:
+                    logger.warning(f"{self.bot.name} eventsub session {self.session_id} missed its keepalive")
+                    return
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    logger.info(f"{self.bot.name} eventsub session {self.session_id} closed: {ws.close_code}")
+                    return
+                reconnect_url = await self._handle(json.loads(msg.data))
+                if reconnect_url:
+                    ws = await self._migrate(ws, reconnect_url)
+        finally:
+            await ws.close()
+
+    async def _migrate(self, old, url):
+        """Move to url, handling what the old connection still sends before it closes."""
+        new = await self._connect(url)
+        self.reconnects += 1
+        try:
+            await asyncio.wait_for(self._drain(old), WELCOME_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        await old.close()
+        logger.info(f"{self.bot.name} eventsub session {self.session_id} reconnected")
+        return new
+
+    async def _drain(self, ws):
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                await self._handle(json.loads(msg.data))
+
+    async def run(self):
+        """Keep a session open until cancelled, starting a new one whenever it is lost."""
+        backoff = RECONNECT_BACKOFF_MIN
+        url = f"{self.url}?keepalive_timeout_seconds={self.keepalive}"
+        try:
+            while True:
+                try:
+                    ws = await self._connect(url)
+                    backoff = RECONNECT_BACKOFF_MIN
+                    await self._receive(ws)
+                except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                    logger.warning(f"{self.bot.name} eventsub websocket failed: {e!r}")
+                # Subscriptions die with their session; the next one starts empty.
+                self.session_id = None
+                logger.info(f"{self.bot.name} eventsub websocket reconnecting in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+        finally:
+            self.session_id = None
+            if self._http is not None:
+                await self._http.close()
+                self._http = None
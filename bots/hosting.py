@@ -0,0 +1,71 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Shared transports for hosting many bot identities in one process."""
+
+import logging
+import weakref
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# IRC capabilities requested by lean identities. Without "membership" Twitch
+# stops sending JOIN/PART/NAMES for every chatter, which is what fills the
+# per-connection chatter cache of an otherwise idle bot.
+LEAN_MODES = ("commands", "tags")
+
+
+class SharedTransport:
+    """One aiohttp session, and so one keep-alive pool, for every hosted bot.
+
+    Helix calls, token validation and the IRC websocket handshakes of all
+    attached bots go through the same connector and DNS cache instead of one
+    ClientSession per bot. Each bot still has its own twitchio client and IRC
+    connection, so an idle bot costs hundreds of KiB, not a few; see the README
+    for measurements.
+
+    The pool is unbounded by default: every IRC shard and EventSub websocket
+    holds one of its connections for as long as its bot runs, so with a limit
+    the websocket past it, and every request queued behind it, waits forever.
+    """
+
+    def __init__(self, limit=0, limit_per_host=0, keepalive_timeout=30):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.bots = weakref.WeakSet()
+        self._session = None
+
+    @property
+    def session(self):
+        """The process-wide session, created on first use inside the running loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def attach(self, bot):
+        """Point the bot's HTTP client at the shared session."""
+        bot._http.session = self.session
+        bot.transport = self
+        if not bot.membership:
+            bot._connection.modes = LEAN_MODES
+        self.bots.add(bot)
+
+    def detach(self, bot):
+        """Forget the bot so closing it leaves the shared session open."""
+        if bot._http.session is self._session:
+            bot._http.session = None
+        bot.transport = None
+        self.bots.discard(bot)
+
+    async def close(self):
+        """close."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,139 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Decoupling event delivery from event handling."""
+
+import asyncio
+import collections
+import logging
+import time
+
+from bots import metrics
+
+logger = logging.getLogger(__name__)
+
+DROPPED = metrics.registry.counter(
+    "ingest_dropped_total",
+    "Items an ingest queue dropped, as duplicates or for want of room.",
+    ("bot", "ingest", "reason"),
+)
+
+
+class DedupeCache:
+    """Remembers recently seen ids, bounded both in size and in age."""
+
+    def __init__(self, maxsize=10000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._seen = collections.OrderedDict()
+
+    def seen(self, key):
+        """Whether key was seen within the ttl; records it if not."""
+        now = time.monotonic()
+        while self._seen:
+            oldest, stamp = next(iter(self._seen.items()))
+            if now - stamp < self.ttl:
+                break
+            del self._seen[oldest]
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        if len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+        return False
+
+    def forget(self, key):
+        self._seen.pop(key, None)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class EventIngest:
+    """A bounded queue drained by a pool of worker tasks.
+
+    Producers call offer() and return immediately; handler(item) runs later
+    on one of the workers, so a slow handler never delays the producer.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, name="ingest", bot=None):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.name = name
+        self.queue = None
+        self._tasks = []
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self._overflow = DROPPED.labels(bot or "", name, "overflow")
+        self._duplicates = DROPPED.labels(bot or "", name, "duplicate")
+        self.max_depth = 0
+
+    @property
+    def dropped_overflow(self):
+        return self._overflow.value
+
+    @property
+    def dropped_duplicates(self):
+        return self._duplicates.value
+
+    def drop_duplicate(self):
+        """Count an item the producer dropped as already seen."""
+        self._duplicates.inc()
+
+    def start(self):
+        """start."""
+        self.queue = asyncio.Queue(self.maxsize)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """stop."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def offer(self, item):
+        """Queue item for the workers; False when the queue is full."""
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._overflow.inc()
+            return False
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    async def put(self, item):
+        """Queue item, waiting for room; for producers that can't have it sent again later."""
+        await self.queue.put(item)
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"{self.name} handler failed: {e!r}")
+            finally:
+                self.queue.task_done()
+
+    @property
+    def depth(self):
+        return self.queue.qsize() if self.queue else 0
+
+    def stats(self):
+        """stats."""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped_overflow": self.dropped_overflow,
+            "dropped_duplicates": self.dropped_duplicates,
+        }
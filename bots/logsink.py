@@ -0,0 +1,214 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Logging that never blocks the event loop.
+
+Records are sampled and rate capped where they are logged, handed to a
+queue without being formatted, and written as JSON lines in batches by a
+background thread.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 2000
+FLUSH_INTERVAL = 0.5
+
+
+def _rule(rules, name):
+    """The rule of the most specific logger prefix of name, like logging's own hierarchy."""
+    while name:
+        if name in rules:
+            return rules[name]
+        name = name.rpartition(".")[0]
+    return rules.get("", None)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of records and at most a number per second, per logger.
+
+    `sample` and `rate_limit` map logger names to a fraction in [0, 1] and to
+    records per second. A rule applies to the logger and its children.
+    Warnings and above always pass.
+    """
+
+    def __init__(self, sample=None, rate_limit=None):
+        super().__init__()
+        self.sample = dict(sample or {})
+        self.rate_limit = dict(rate_limit or {})
+        self.dropped = {}
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        name = record.name
+        fraction = _rule(self.sample, name)
+        if fraction is not None and random.random() >= fraction:
+            return self._drop(name)
+        limit = _rule(self.rate_limit, name)
+        if limit is not None:
+            second = int(time.monotonic())
+            window, count = self._windows.get(name, (second, 0))
+            if window != second:
+                window, count = second, 0
+            if count >= limit:
+                return self._drop(name)
+            self._windows[name] = (window, count + 1)
+        return True
+
+    def _drop(self, name):
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+        return False
+
+    def take_dropped(self):
+        """Return and reset the per-logger drop counts."""
+        dropped, self.dropped = self.dropped, {}
+        return dropped
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.processName != "MainProcess":
+            entry["process"] = record.processName
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the writer and drops on overflow."""
+
+    def __init__(self, sink):
+        super().__init__(sink.queue)
+        self.sink = sink
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.sink.overflowed += 1
+
+
+class LogSink:
+    """A bounded queue of records and the thread that writes them out."""
+
+    def __init__(
+        self,
+        stream=None,
+        sample=None,
+        rate_limit=None,
+        queue_size=QUEUE_SIZE,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        self.stream = stream or sys.stderr
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.formatter = JsonFormatter()
+        self.filter = SamplingFilter(sample, rate_limit)
+        self.handler = _EnqueueHandler(self)
+        self.handler.addFilter(self.filter)
+        self.overflowed = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _batch(self):
+        """Block for one record, then let more pile up for the flush interval.
+
+        Waking up once per interval instead of once per record keeps the
+        writer from contending with the event loop thread for the GIL.
+        """
+        records = [self.queue.get()]
+        self._stopping.wait(self.flush_interval)
+        while len(records) < self.batch_size:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                lines.append(
+                    json.dumps({"level": "ERROR", "logger": __name__, "msg": f"unformattable record {record.msg!r}"})
+                )
+        lines.extend(self._drop_report())
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+    def _drop_report(self):
+        dropped = self.filter.take_dropped()
+        if self.overflowed:
+            dropped["<queue overflow>"], self.overflowed = self.overflowed, 0
+        if not dropped:
+            return []
+        return [json.dumps({"ts": round(time.time(), 3), "level": "INFO", "logger": __name__, "dropped": dropped})]
+
+    def _run(self):
+        while True:
+            records = self._batch()
+            stop = any(record is None for record in records)
+            if stop:
+                records = [record for record in records if record is not None]
+            if records:
+                try:
+                    self._write(records)
+                except Exception:
+                    pass  # nowhere left to report it
+            if stop:
+                return
+
+    def start(self):
+        """start."""
+        self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Write out what is queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self.queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+
+def install_log_sink(level=logging.INFO, **kwargs):
+    """Route the root logger through a started LogSink, flushed at exit."""
+    sink = LogSink(**kwargs)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(sink.handler)
+    root.setLevel(level)
+    sink.start()
+    atexit.register(sink.stop)
+    return sink
@@ -0,0 +1,303 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Counters, gauges and latency histograms served in the Prometheus text format.
+
+Every label combination gets its own child the first time it is used, with
+its histogram buckets allocated up front, and hot paths keep a reference to
+the child. Recording a value is then a couple of additions and one bisect,
+cheap enough to leave on in production.
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; handlers are expected to take well under a millisecond.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5
+METRICS_PORT = 9102
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bound plus +Inf, made cumulative only when scraped.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # Prometheus buckets are upper bounds inclusive, hence bisect_left.
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values; keep it rather than calling this per event."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(values, None)
+
+    def clear(self):
+        self._children.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="' + _format_value(float(bound)) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """A set of metrics plus callbacks that refresh gauges right before a scrape."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback):
+        """Call callback() at every scrape, e.g. to set queue depth gauges."""
+        self.collectors.append(callback)
+
+    def remove_collector(self, callback):
+        if callback in self.collectors:
+            self.collectors.remove(callback)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        for callback in list(self.collectors):
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"metrics collector {callback!r} failed: {e!r}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+COMMAND_SECONDS = registry.histogram(
+    "bot_command_seconds", "Time spent running a command.", ("bot", "cog", "command")
+)
+COMMAND_ERRORS = registry.counter(
+    "bot_command_errors_total", "Commands that failed, were rejected by a check or were on cooldown.",
+    ("bot", "cog", "command"),
+)
+EVENT_SECONDS = registry.histogram(
+    "bot_event_seconds", "Time spent in one event handler.", ("bot", "cog", "event")
+)
+EVENT_ERRORS = registry.counter(
+    "bot_event_errors_total", "Event handlers that raised.", ("bot", "cog", "event")
+)
+SEND_SECONDS = registry.histogram(
+    "bot_send_seconds", "Time spent writing a chat message; path is ctx or outbound.", ("bot", "path")
+)
+SEND_ERRORS = registry.counter("bot_send_errors_total", "Chat messages that could not be written.", ("bot", "path"))
+OUTBOUND_WAIT_SECONDS = registry.histogram(
+    "bot_outbound_wait_seconds", "Time a message waited in the outbound queue before it was sent.",
+    ("bot", "lane"), buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 30.0),
+)
+OUTBOUND_DROPPED = registry.counter(
+    "bot_outbound_dropped_total",
+    "Messages not sent on their own: coalesced with one waiting, expired past their deadline or evicted from a full queue.",
+    ("bot", "channel", "reason"),
+)
+TOKEN_REFRESH_SECONDS = registry.histogram(
+    "bot_token_refresh_seconds", "Time taken to refresh and revalidate a token.", ("bot",)
+)
+TOKEN_REFRESH_ERRORS = registry.counter("bot_token_refresh_errors_total", "Token refreshes that failed.", ("bot",))
+QUEUE_DEPTH = registry.gauge(
+    "bot_queue_depth", "Items waiting in a queue; bot is empty for process-wide queues.", ("bot", "queue")
+)
+LOOP_LAG_SECONDS = registry.histogram("event_loop_lag_seconds", "How late the event loop woke up a sleeping task.")
+STALLS = registry.counter(
+    "event_loop_stalls_total", "Times the event loop was blocked past the watchdog threshold, by culprit.",
+    ("bot", "cog", "handler"),
+)
+STALL_SECONDS = registry.histogram(
+    "event_loop_stall_seconds", "How long each stall past the watchdog threshold lasted.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class LoopLagMonitor:
+    """Sleeps for a fixed interval and records how much later than asked it woke up."""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, histogram=LOOP_LAG_SECONDS):
+        self.interval = interval
+        self.child = histogram.labels()
+        # When the current sleep should end, on the time.monotonic() clock.
+        self.due = None
+        self._task = None
+
+    async def run(self):
+        """run."""
+        while True:
+            self.due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.observe(max(time.monotonic() - self.due, 0.0))
+
+    def observe(self, lag):
+        self.child.observe(lag)
+
+    def start(self):
+        """start."""
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """stop."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+class MetricsServer:
+    """Serves a registry at http://host:port/metrics."""
+
+    def __init__(self, host="127.0.0.1", port=METRICS_PORT, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def _metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        """start."""
+        # aiohttp.web costs more to import than the rest of the bot's dependencies, and only a
+        # process that serves metrics needs it.
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """stop."""
+        if self._runner:
+            await self._runner.cleanup()
+        self._runner = None
@@ -0,0 +1,218 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Paced, prioritized chat messages for one bot."""
+
+import asyncio
+import collections
+import logging
+import time
+
+from bots import metrics
+from bots.ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# https://dev.twitch.tv/docs/irc#rate-limits
+# PRIVMSGs in any 30 seconds for the account, across every channel it talks
+# in: every message counts against both, the first only stops messages to
+# channels the account doesn't moderate. Exceeding them gets the account
+# silently dropped for a while.
+IRC_LIMIT = (20, 30)
+MOD_LIMIT = (100, 30)
+# Outside of channels it moderates, a user may only talk once per second.
+CHANNEL_LIMIT = (1, 1)
+
+# Highest priority first.
+LANES = ("moderation", "default", "fun")
+DEADLINE = 10
+MAX_DEPTH = 50
+
+
+class _Outgoing:
+    __slots__ = ("content", "lane", "queued", "deadline", "future")
+
+    def __init__(self, content, lane, queued, deadline, future):
+        self.content = content
+        self.lane = lane
+        self.queued = queued
+        self.deadline = deadline
+        self.future = future
+
+
+class _Channel:
+    """Pending messages of one channel, one deque per lane."""
+
+    def __init__(self, name, bot_name):
+        self.name = name
+        self.mod = False
+        self.lanes = {lane: collections.deque() for lane in LANES}
+        self.pending = {}
+        self.limiter = RateLimiter(*CHANNEL_LIMIT)
+        self.task = None
+        self.sent = 0
+        self._coalesced = metrics.OUTBOUND_DROPPED.labels(bot_name, name, "coalesced")
+        self._shed = metrics.OUTBOUND_DROPPED.labels(bot_name, name, "expired")
+        self._dropped = metrics.OUTBOUND_DROPPED.labels(bot_name, name, "full")
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    @property
+    def coalesced(self):
+        return self._coalesced.value
+
+    @property
+    def shed(self):
+        return self._shed.value
+
+    @property
+    def dropped(self):
+        return self._dropped.value
+
+    def pop(self):
+        for lane in LANES:
+            queue = self.lanes[lane]
+            if queue:
+                item = queue.popleft()
+                del self.pending[item.content]
+                return item
+        return None
+
+    def evict_below(self, lane):
+        """Drop the oldest message of a lane less important than lane."""
+        for lower in reversed(LANES[LANES.index(lane) + 1:]):
+            queue = self.lanes[lower]
+            if queue:
+                item = queue.popleft()
+                del self.pending[item.content]
+                return item
+        return None
+
+
+class OutboundScheduler:
+    """Sends a bot's chat messages no faster than Twitch accepts them.
+
+    Messages wait in per-channel lanes and go out highest lane first. Every
+    message is charged to both of the account's sliding windows; in channels
+    where the bot is a moderator it only waits for the larger moderator one,
+    and elsewhere for both plus the one-per-second channel limit.
+    A message identical to one still waiting in the same channel is merged
+    with it, and a message still waiting after its deadline is dropped.
+    """
+
+    def __init__(self, bot, limit=IRC_LIMIT, mod_limit=MOD_LIMIT, deadline=DEADLINE, max_depth=MAX_DEPTH):
+        self.bot = bot
+        self.deadline = deadline
+        self.max_depth = max_depth
+        self.limiter = RateLimiter(*limit)
+        self.mod_limiter = RateLimiter(*mod_limit)
+        self.channels = {}
+        self._send_seconds = metrics.SEND_SECONDS.labels(bot.name, "outbound")
+        self._send_errors = metrics.SEND_ERRORS.labels(bot.name, "outbound")
+        self._wait_seconds = {lane: metrics.OUTBOUND_WAIT_SECONDS.labels(bot.name, lane) for lane in LANES}
+
+    def _channel(self, name):
+        name = name.lower().lstrip("#")
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = self.channels[name] = _Channel(name, self.bot.name)
+        return channel
+
+    def set_mod(self, channel, is_mod):
+        """Record whether the bot moderates channel, e.g. from its USERSTATE."""
+        self._channel(channel).mod = bool(is_mod)
+
+    def send(self, channel, content, lane="default", deadline=None):
+        """Queue content for channel.
+
+        Returns a future resolved with True once sent, or False when the
+        message was dropped. It does not need to be awaited.
+        """
+        if lane not in LANES:
+            raise ValueError(f"unknown lane {lane}, expected one of {', '.join(LANES)}")
+        channel = self._channel(channel)
+        waiting = channel.pending.get(content)
+        if waiting is not None:
+            channel._coalesced.inc()
+            return waiting.future
+        future = asyncio.get_running_loop().create_future()
+        if channel.depth >= self.max_depth:
+            evicted = channel.evict_below(lane)
+            if evicted is None:
+                channel._dropped.inc()
+                future.set_result(False)
+                return future
+            channel._dropped.inc()
+            evicted.future.set_result(False)
+        now = time.monotonic()
+        expires = now + (self.deadline if deadline is None else deadline)
+        item = _Outgoing(content, lane, now, expires, future)
+        channel.lanes[lane].append(item)
+        channel.pending[content] = item
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.ensure_future(self._drain(channel))
+        return future
+
+    def _delay(self, channel):
+        if channel.mod:
+            return self.mod_limiter.delay()
+        return max(self.limiter.delay(), self.mod_limiter.delay(), channel.limiter.delay())
+
+    async def _drain(self, channel):
+        """Send the channel's messages until none are left, then exit."""
+        while channel.pending:
+            delay = self._delay(channel)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            item = channel.pop()
+            while item is not None and time.monotonic() > item.deadline:
+                channel._shed.inc()
+                item.future.set_result(False)
+                item = channel.pop()
+            if item is None:
+                return
+            self.mod_limiter.take()
+            self.limiter.take()
+            if not channel.mod:
+                channel.limiter.take()
+            start = time.perf_counter()
+            self._wait_seconds[item.lane].observe(time.monotonic() - item.queued)
+            try:
+                await self.bot.shards.connection_for(channel.name).send(f"PRIVMSG #{channel.name} :{item.content}\r\n")
+            except Exception as e:
+                self._send_errors.inc()
+                logger.warning(f"{self.bot.name} could not send to #{channel.name}: {e!r}")
+                item.future.set_result(False)
+                continue
+            finally:
+                self._send_seconds.observe(time.perf_counter() - start)
+            channel.sent += 1
+            item.future.set_result(True)
+
+    def stats(self):
+        """Queue depth and counters per channel."""
+        return {
+            name: {
+                "depth": channel.depth,
+                "mod": channel.mod,
+                "sent": channel.sent,
+                "coalesced": channel.coalesced,
+                "shed": channel.shed,
+                "dropped": channel.dropped,
+            }
+            for name, channel in self.channels.items()
+        }
+
+    async def close(self):
+        """Stop sending; whatever is still queued resolves as dropped."""
+        tasks = [channel.task for channel in self.channels.values() if channel.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for channel in self.channels.values():
+            item = channel.pop()
+            while item is not None:
+                item.future.set_result(False)
+                item = channel.pop()
@@ -0,0 +1,153 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Rate limiting helpers shared by the bots."""
+
+import asyncio
+import collections
+import itertools
+import time
+
+
+class RateLimiter:
+    """Sliding window limiter allowing `limit` acquisitions every `period` seconds."""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._stamps = collections.deque()
+
+    def _expire(self, now):
+        while self._stamps and now - self._stamps[0] >= self.period:
+            self._stamps.popleft()
+
+    def try_acquire(self):
+        """Take a slot if one is free right now; never waits."""
+        now = time.monotonic()
+        self._expire(now)
+        if len(self._stamps) < self.limit:
+            self._stamps.append(now)
+            return True
+        return False
+
+    def delay(self):
+        """Seconds until a slot is free, 0 if one is now."""
+        now = time.monotonic()
+        self._expire(now)
+        if len(self._stamps) < self.limit:
+            return 0
+        # Slots taken past the limit push the wait back by as many stamps.
+        return self.period - (now - self._stamps[-self.limit])
+
+    def take(self):
+        """Take a slot even if none is free, for uses that waited on another limit."""
+        self._stamps.append(time.monotonic())
+
+    async def acquire(self):
+        """Wait for a free slot and take it. Returns the seconds spent waiting."""
+        started = time.monotonic()
+        while not self.try_acquire():
+            await asyncio.sleep(self.period - (time.monotonic() - self._stamps[0]))
+        return time.monotonic() - started
+
+
+class RateLimiterGroup:
+    """Lazily created limiters sharing the same limits, one per key."""
+
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self._limiters = {}
+
+    def __getitem__(self, key):
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = self._limiters[key] = RateLimiter(self.limit, self.period)
+        return limiter
+
+
+# Keys kept per BucketTable at most, and timing wheel resolution.
+MAX_KEYS = 10000
+WHEEL_SLOTS = 64
+
+
+class BucketTable:
+    """Token buckets of `rate` uses per `per` seconds, one per key, in bounded memory.
+
+    Each bucket is stored as a single float, the time it will be full again
+    (the generic cell rate algorithm). A full bucket behaves exactly like a
+    missing one, so a key is dropped once that time passes. A timing wheel of
+    `slots` ticks spanning `per` seconds finds those keys without scanning,
+    which keeps the table to the keys used within the last `per` seconds.
+    Past `max_keys`, the keys closest to full are dropped early.
+    """
+
+    def __init__(self, rate, per, max_keys=MAX_KEYS, slots=WHEEL_SLOTS):
+        self.rate = rate
+        self.per = per
+        self.max_keys = max_keys
+        self.interval = per / rate
+        self.tick = per / slots
+        # One more slot than the span, so a key never lands in the slot being read.
+        self._slots = [[] for _ in range(slots + 1)]
+        self._full_at = {}
+        self._cursor = self._index(time.monotonic())
+        self._evict_at = self._cursor
+
+    def __len__(self):
+        return len(self._full_at)
+
+    def _index(self, when):
+        return int(when / self.tick) + 1
+
+    def _advance(self, now):
+        target = self._index(now) - 1
+        slots = self._slots
+        # After a long idle every slot is due; visiting each once is enough.
+        start = max(self._cursor, target - len(slots))
+        for index in range(start + 1, target + 1):
+            self._expire(slots[index % len(slots)], index)
+        self._cursor = target
+
+    def _expire(self, slot, index, limit=None):
+        full_at = self._full_at
+        while slot:
+            key = slot.pop()
+            # Keys are filed again whenever they move to a later slot.
+            when = full_at.get(key)
+            if when is not None and self._index(when) <= index:
+                del full_at[key]
+                if limit is not None:
+                    return True
+        return False
+
+    def _evict(self):
+        slots = self._slots
+        first, last = self._cursor + 1, self._cursor + len(slots)
+        # Resume where the last eviction found a key instead of rescanning empty slots.
+        resume = min(max(self._evict_at, first), last)
+        for index in itertools.chain(range(resume, last), range(first, resume)):
+            slot = slots[index % len(slots)]
+            if slot and self._expire(slot, index, limit=1):
+                self._evict_at = index
+                return
+
+    def delay(self, key, now=None):
+        """Seconds until key may take a token, 0 if it may now."""
+        now = time.monotonic() if now is None else now
+        full_at = self._full_at.get(key)
+        if full_at is None:
+            return 0
+        return max(0, full_at + self.interval - now - self.per)
+
+    def take(self, key, now=None):
+        """Use a token of key's bucket; check delay() first."""
+        now = time.monotonic() if now is None else now
+        self._advance(now)
+        previous = self._full_at.get(key)
+        if previous is None and len(self._full_at) >= self.max_keys:
+            self._evict()
+        start = now if previous is None else max(previous, now)
+        full_at = self._full_at[key] = start + self.interval
+        index = self._index(full_at)
+        if previous is None or index != self._index(previous):
+            self._slots[index % len(self._slots)].append(key)
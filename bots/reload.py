@@ -0,0 +1,212 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Apply bots.yaml changes to the bots of a running process.
+
+Each bot's new config is compared with the one it was built from. Changed
+channels are joined or parted and changed cogs reloaded on the live
+connection; any other change to a bot restarts only that bot. Bots that were
+added or removed are started or stopped, and every other bot is left alone.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import yaml
+from dotenv import dotenv_values
+
+from bots.bot import Bot, cog_configs
+
+logger = logging.getLogger(__name__)
+
+RELOAD_INTERVAL = 2.0
+# Keys a running bot can take new values of without reconnecting.
+LIVE_KEYS = ("channels", "cogs")
+
+
+def _channel(name):
+    return name.lstrip("#").lower()
+
+
+def _restart_needed(old, new):
+    return {k: v for k, v in old.items() if k not in LIVE_KEYS} != {
+        k: v for k, v in new.items() if k not in LIVE_KEYS
+    }
+
+
+class RunningBots:
+    """The bots of this process by name, kept in step with bots.yaml."""
+
+    def __init__(self, env_config, scheduler, tokens, loop=None):
+        self.env_config = env_config
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.loop = loop
+        self.bots = {}
+
+    async def start_all(self, bots):
+        """Start bots built ahead of time; those that fail are retried by the next reload."""
+        for bot in bots:
+            self.tokens.register(bot.token_manager, bot)
+        started = await self.scheduler.start_all(bots)
+        for bot in bots:
+            if bot in started:
+                self.bots[bot.name] = bot
+            else:
+                self.tokens.unregister(bot.token_manager, bot)
+        return started
+
+    async def start(self, name, bot_config):
+        """Build and start one bot."""
+        bot = Bot(name, self.env_config, bot_config, loop=self.loop)
+        self.tokens.register(bot.token_manager, bot)
+        try:
+            await self.scheduler.start(bot, time.monotonic())
+        except Exception:
+            self.tokens.unregister(bot.token_manager, bot)
+            await bot.close()
+            raise
+        self.bots[name] = bot
+        logger.info(f"started {self.scheduler.timelines[name]}")
+
+    async def stop(self, name):
+        """Unload one bot's cogs and disconnect it."""
+        bot = self.bots.pop(name)
+        self.tokens.unregister(bot.token_manager, bot)
+        for cog_name in list(bot.cogs):
+            await bot.unload_cog(cog_name)
+        await bot.close()
+        logger.info(f"stopped {name}")
+
+    async def close_all(self):
+        """Disconnect every bot at shutdown, leaving cogs and subscriptions as they are."""
+        bots, self.bots = list(self.bots.values()), {}
+        await asyncio.gather(*(bot.close() for bot in bots), return_exceptions=True)
+
+    async def update(self, bot, bot_config):
+        """Join, part and reload cogs so the running bot matches bot_config."""
+        old_channels = [_channel(c) for c in bot.config["channels"]]
+        new_channels = [_channel(c) for c in bot_config["channels"]]
+        parted = [c for c in old_channels if c not in new_channels]
+        joined = [c for c in new_channels if c not in old_channels]
+        old_cogs, new_cogs = cog_configs(bot.config), cog_configs(bot_config)
+        dropped = [name for name in old_cogs if name not in new_cogs or new_cogs[name] != old_cogs[name]]
+        loaded = [name for name in new_cogs if name not in old_cogs or new_cogs[name] != old_cogs[name]]
+
+        if parted:
+            await bot.part_channels(parted)
+        for name in dropped:
+            await bot.unload_cog(name)
+        if joined:
+            await self.scheduler.join(bot, joined)
+        bot.channels = list(bot_config["channels"])
+        bot.config = bot_config
+        if parted:
+            # Shards that parting left half empty are merged once the joins have found room.
+            await bot.shards.rebalance()
+        if parted or joined:
+            for cog in list(bot.cogs.values()):
+                changed = getattr(cog, "channels_changed", None)
+                if changed is not None:
+                    await changed()
+        for name in loaded:
+            bot.load_cog(name, new_cogs[name])
+
+        changes = [f"+#{c}" for c in joined] + [f"-#{c}" for c in parted]
+        changes += [f"-{name}" for name in dropped if name not in loaded]
+        changes += [f"~{name}" if name in dropped else f"+{name}" for name in loaded]
+        if changes:
+            logger.info(f"updated {bot.name}: {' '.join(changes)}")
+
+    async def _apply_one(self, name, bot_config):
+        bot = self.bots.get(name)
+        if bot_config is None:
+            await self.stop(name)
+        elif bot is None:
+            await self.start(name, bot_config)
+        elif _restart_needed(bot.config, bot_config):
+            logger.info(f"restarting {name} for its new config")
+            await self.stop(name)
+            await self.start(name, bot_config)
+        elif bot.config != bot_config:
+            await self.update(bot, bot_config)
+
+    async def apply(self, bots_config):
+        """Start, stop, restart or update every bot whose config differs from bots_config."""
+        names = [name for name in self.bots if name not in bots_config] + list(bots_config)
+        results = await asyncio.gather(
+            *(self._apply_one(name, bots_config.get(name)) for name in names), return_exceptions=True
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"reloading {name} failed: {result!r}")
+
+
+class ConfigWatcher:
+    """Polls bots.yaml and applies each change to the running bots.
+
+    Only the `bots` section is reloaded. owns, if given, limits the watcher to
+    the bot names it accepts, as each --workers process runs a fixed share.
+    """
+
+    def __init__(self, path, running, env_path=".env", interval=RELOAD_INTERVAL, owns=None):
+        self.path = path
+        self.running = running
+        self.env_path = env_path
+        self.interval = interval
+        self.owns = owns
+        self._seen = None
+        self._task = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self):
+        with open(self.path, "r") as file:
+            config = yaml.safe_load(file)
+        return config["bots"] or {}
+
+    async def reload(self):
+        """Read the file and apply it; a file that doesn't parse changes nothing."""
+        try:
+            bots_config = self._read()
+            if not isinstance(bots_config, dict):
+                raise TypeError("bots must be a mapping of bot names to configs")
+        except (OSError, yaml.YAMLError, KeyError, TypeError) as e:
+            logger.warning(f"not reloading {self.path}: {e!r}")
+            return
+        if self.owns is not None:
+            bots_config = {name: config for name, config in bots_config.items() if self.owns(name)}
+        # New bots need their client id and secret.
+        self.running.env_config.update(dotenv_values(self.env_path))
+        await self.running.apply(bots_config)
+
+    async def run(self):
+        """Reload once, in case the file changed since it was read, then on every change."""
+        self._seen = self._stat()
+        await self.reload()
+        while True:
+            await asyncio.sleep(self.interval)
+            seen = self._stat()
+            if seen is None or seen == self._seen:
+                continue
+            self._seen = seen
+            logger.info(f"{self.path} changed, reloading")
+            await self.reload()
+
+    def start(self):
+        """start."""
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """stop."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,121 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Login to user id resolution shared by every bot and cog in the process."""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+USER_ID_CACHE_PATH = os.getenv("USER_ID_CACHE_PATH", "user_ids.json")
+# Ids never change for a login, but logins can be renamed and reused.
+USER_ID_TTL = 7 * 24 * 3600
+# https://dev.twitch.tv/docs/api/reference/#get-users
+HELIX_USERS_BATCH = 100
+
+
+class UserIdResolver:
+    """Caches login -> id with a ttl, persisted to a JSON file.
+
+    Lookups missing from the cache are batched into Get Users requests of up
+    to 100 logins, and concurrent lookups of the same login share one request.
+    """
+
+    def __init__(self, file_path=USER_ID_CACHE_PATH, ttl=USER_ID_TTL):
+        self.file_path = file_path
+        self.ttl = ttl
+        self._ids = None
+        self._pending = {}
+
+    def load(self):
+        """Read the persisted cache, once."""
+        if self._ids is None:
+            self._ids = self._read()
+        return self._ids
+
+    def _read(self):
+        try:
+            with open(self.file_path, "r") as file:
+                return {login: tuple(entry) for login, entry in json.load(file).items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError) as e:
+            logger.warning(f"ignoring unreadable user id cache {self.file_path}: {e!r}")
+            return {}
+
+    def save(self):
+        """Merge with what other processes wrote, then replace the file atomically."""
+        merged = self._read()
+        for login, entry in self.load().items():
+            if login not in merged or merged[login][1] < entry[1]:
+                merged[login] = entry
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".user_ids-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(merged, file)
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def cached(self, login):
+        """The cached id for login, or None when unknown or expired."""
+        entry = self.load().get(login.lower())
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    async def resolve(self, bot, logins):
+        """Map each login to its user id, omitting logins Twitch does not know."""
+        logins = list(dict.fromkeys(login.lower() for login in logins))
+        missing = [login for login in logins if self.cached(login) is None and login not in self._pending]
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {login: loop.create_future() for login in missing}
+            self._pending.update(futures)
+            try:
+                await self._fetch(bot, missing)
+            finally:
+                for login in missing:
+                    future = self._pending.pop(login)
+                    if not future.done():
+                        future.set_result(None)
+        waiting = [self._pending[login] for login in logins if login in self._pending]
+        if waiting:
+            await asyncio.gather(*waiting)
+        ids = {}
+        for login in logins:
+            user_id = self.cached(login)
+            if user_id is not None:
+                ids[login] = user_id
+        return ids
+
+    async def _fetch(self, bot, logins):
+        now = time.time()
+        ids = self.load()
+        for i in range(0, len(logins), HELIX_USERS_BATCH):
+            for user in await bot.fetch_users(names=logins[i:i + HELIX_USERS_BATCH]):
+                ids[user.name.lower()] = (user.id, now)
+        unknown = [login for login in logins if login not in ids or ids[login][1] != now]
+        if unknown:
+            logger.warning(f"no twitch user for {', '.join(unknown)}")
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"could not persist user ids to {self.file_path}: {e!r}")
+
+
+__resolver = None
+
+
+def get_resolver(file_path=None):
+    """The process-wide resolver. The first call may choose where it persists."""
+    global __resolver
+    if __resolver is None:
+        __resolver = UserIdResolver(file_path or USER_ID_CACHE_PATH)
+    return __resolver
@@ -0,0 +1,45 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Command lookup compiled once from a bot's prefixes and commands."""
+
+from twitchio.ext.commands.stringparser import StringParser
+
+
+class CommandRouter:
+    """Resolves chat messages to commands.
+
+    Most chat lines are not commands, so the prefix test is a single
+    str.startswith over every prefix at once. Names and aliases share one
+    index, lowercased up front when the bot is case insensitive.
+    """
+
+    __slots__ = ("prefixes", "case_insensitive", "index")
+
+    def __init__(self, prefixes, commands, aliases, case_insensitive=False):
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        # Longest first so "!!" wins over "!" when both are configured.
+        self.prefixes = tuple(sorted(set(prefixes), key=len, reverse=True))
+        self.case_insensitive = case_insensitive
+        fold = str.lower if case_insensitive else str
+        index = {fold(name): command for name, command in commands.items()}
+        for alias, name in aliases.items():
+            if name in commands:
+                index.setdefault(fold(alias), commands[name])
+        self.index = index
+
+    def prefix_of(self, content):
+        """The prefix content starts with, or None when it is not a command."""
+        if not content.startswith(self.prefixes):
+            return None
+        for prefix in self.prefixes:
+            if content.startswith(prefix):
+                return prefix
+
+    def resolve(self, content, prefix):
+        """Split a prefixed message into (name, command or None, view)."""
+        view = StringParser()
+        parsed = view.process_string(content[len(prefix):].lstrip())
+        name = parsed.pop(0, "")
+        key = name.lower() if self.case_insensitive else name
+        return name, self.index.get(key), view
@@ -0,0 +1,361 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""One scheduler for every timed job in the process.
+
+Jobs sit in a single heap ordered by when they are next due, and one task
+sleeps until the earliest of them, so a thousand per-channel reminders cost a
+heap entry each rather than a sleeping task each. Every job's next run is
+written to a JSON file, so a restart resumes the schedule instead of starting
+it over, and runs missed while the process was down are handled by the job's
+catch-up policy:
+
+    skip   drop missed runs and wait for the next one
+    once   run once for however many were missed (the default)
+    all    run once per missed run, up to MAX_CATCH_UP
+
+Schedules are 5-field cron specs in local time, "minute hour day month
+weekday", or a fixed interval in seconds.
+"""
+
+import asyncio
+import datetime
+import heapq
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+ROUTINES_STATE_PATH = os.getenv("ROUTINES_STATE_PATH", "routines.json")
+CATCH_UP = ("skip", "once", "all")
+MAX_CATCH_UP = 100
+# A run that starts later than this after its time was missed rather than late.
+GRACE = 60
+# Sleep no longer than this, so clock changes are noticed.
+MAX_SLEEP = 60
+# Write next runs at most this often; a crash repeats runs since the last write, once.
+SAVE_INTERVAL = 1.0
+
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+# (low, high, names) of minute, hour, day of month, month, day of week.
+FIELDS = (
+    (0, 59, ()),
+    (0, 23, ()),
+    (1, 31, ()),
+    (1, 12, ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")),
+    (0, 7, ("sun", "mon", "tue", "wed", "thu", "fri", "sat")),
+)
+
+
+def _value(text, low, names):
+    if text.lower() in names:
+        return names.index(text.lower()) + low
+    return int(text)
+
+
+def _field(text, low, high, names):
+    values = set()
+    for part in text.split(","):
+        span, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if span == "*":
+            first, last = low, high
+        elif "-" in span:
+            first, last = (_value(v, low, names) for v in span.split("-", 1))
+        else:
+            first = _value(span, low, names)
+            last = high if step > 1 else first
+        if not low <= first <= last <= high or step < 1:
+            raise ValueError(f"{part!r} is outside {low}-{high}")
+        values.update(range(first, last + 1, step))
+    return frozenset(values)
+
+
+class Cron:
+    """A cron spec, matched against local time to the minute."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        fields = MACROS.get(spec.strip(), spec).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron spec {spec!r} needs 5 fields, minute hour day month weekday")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _field(text, *limits) for text, limits in zip(fields, FIELDS)
+        )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        # As in cron, a restricted day of month and day of week match either one.
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+        self.next(time.time())
+
+    def __str__(self):
+        return f"cron {self.spec}"
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next(self, after):
+        """The first matching minute after the timestamp after."""
+        dt = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0)
+        dt += datetime.timedelta(minutes=1)
+        # Each step skips a whole month, day, hour or minute; 5 years of them is plenty.
+        for _ in range(5 * 366 * 2):
+            if dt.month not in self.months:
+                dt = (dt.replace(day=28) + datetime.timedelta(days=4)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = (dt + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + datetime.timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes or dt.timestamp() <= after:
+                # The second test steps over the repeated hour when clocks go back.
+                dt += datetime.timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"cron spec {self.spec!r} never matches")
+
+
+class Every:
+    """A fixed interval in seconds."""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError(f"interval must be positive, got {seconds}")
+        self.seconds = seconds
+
+    def __str__(self):
+        return f"every {self.seconds}"
+
+    def next(self, after):
+        """after plus one interval."""
+        return after + self.seconds
+
+
+def schedule(config):
+    """A Cron or Every from a job's `cron` or `every` setting."""
+    if "cron" in config:
+        return Cron(str(config["cron"]))
+    if "every" in config:
+        return Every(float(config["every"]))
+    raise ValueError("a job needs a cron spec or an every interval")
+
+
+class Job:
+    """A callback run on a schedule; next_run is its nominal time, due adds jitter."""
+
+    __slots__ = ("key", "schedule", "callback", "jitter", "catch_up", "next_run", "due")
+
+    def __init__(self, key, schedule, callback, jitter=0, catch_up="once"):
+        if catch_up not in CATCH_UP:
+            raise ValueError(f"unknown catch_up {catch_up}, expected one of {', '.join(CATCH_UP)}")
+        self.key = key
+        self.schedule = schedule
+        self.callback = callback
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.next_run = None
+        self.due = None
+
+    def plan(self, next_run):
+        """Set the nominal next run and pick its jittered due time."""
+        self.next_run = next_run
+        self.due = next_run + random.uniform(0, self.jitter) if self.jitter else next_run
+
+    def runs_due(self, now):
+        """How many runs to make at now by the catch-up policy, and the next run after them."""
+        on_time = missed = 0
+        next_run = self.next_run
+        while next_run <= now and on_time + missed < MAX_CATCH_UP:
+            if now - next_run > GRACE + self.jitter:
+                missed += 1
+            else:
+                on_time += 1
+            next_run = self.schedule.next(next_run)
+        if next_run <= now:
+            next_run = self.schedule.next(now)
+        if self.catch_up == "skip":
+            return min(on_time, 1), next_run
+        if self.catch_up == "once":
+            return min(on_time + missed, 1), next_run
+        return on_time + missed, next_run
+
+
+class Scheduler:
+    """Runs every Job of the process from one heap and one task."""
+
+    def __init__(self, file_path=ROUTINES_STATE_PATH):
+        self.file_path = file_path
+        self.jobs = {}
+        self._heap = []
+        self._count = 0
+        self._state = None
+        # Keys this process scheduled; the rest of the file belongs to other processes.
+        self._owned = set()
+        self._dirty = False
+        self._saved_at = 0.0
+        self._waiter = None
+        self._task = None
+
+    def _read(self):
+        try:
+            with open(self.file_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (ValueError, TypeError) as e:
+            logger.warning(f"ignoring unreadable routine state {self.file_path}: {e!r}")
+            return {}
+
+    def load(self):
+        """Read the persisted next runs, once."""
+        if self._state is None:
+            self._state = self._read()
+        return self._state
+
+    def save(self):
+        """Write the next runs of this process's jobs over the file's, then replace it atomically.
+
+        Entries of other processes are kept as they are in the file, which is
+        newer than what was read from it at startup.
+        """
+        state = self.load()
+        merged = self._read()
+        for key in self._owned:
+            merged[key] = state[key]
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".routines-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                # dumps, unlike dump, encodes in C.
+                file.write(json.dumps(merged))
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._state = merged
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def flush(self):
+        """save, if anything changed, logging rather than raising when the disk refuses."""
+        if not self._dirty:
+            return
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"couldn't save routine state to {self.file_path}: {e!r}")
+
+    def _push(self, job, next_run):
+        job.plan(next_run)
+        self.load()[job.key] = {"schedule": str(job.schedule), "next_run": next_run}
+        self._owned.add(job.key)
+        self._dirty = True
+        self._count += 1
+        heapq.heappush(self._heap, (job.due, self._count, job))
+
+    def add(self, job):
+        """Schedule job, resuming from its persisted next run if its schedule is unchanged.
+
+        A job added under the key of another replaces it.
+        """
+        saved = self.load().get(job.key)
+        if saved and saved.get("schedule") == str(job.schedule):
+            next_run = saved["next_run"]
+        else:
+            next_run = job.schedule.next(time.time())
+        self.jobs[job.key] = job
+        self._push(job, next_run)
+        self.start()
+        if self._heap[0][2] is job:
+            self._wakeup()
+
+    def remove(self, key):
+        """Stop running the job under key; its persisted next run is kept for when it returns."""
+        self.jobs.pop(key, None)
+        # Entries of removed jobs are dropped as they surface; rebuild once they are most of the heap.
+        if len(self._heap) > 2 * len(self.jobs) + 64:
+            self._heap = [entry for entry in self._heap if self.jobs.get(entry[2].key) is entry[2]]
+            heapq.heapify(self._heap)
+
+    def _wakeup(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _run(self, job, times):
+        for _ in range(times):
+            try:
+                await job.callback()
+            except Exception as e:
+                logger.exception(f"routine {job.key} failed: {e!r}")
+
+    def run_due(self, now):
+        """Start every job due by now and schedule its next run."""
+        while self._heap and self._heap[0][0] <= now:
+            due, _, job = heapq.heappop(self._heap)
+            # Entries of removed, replaced or rescheduled jobs are dropped as they surface.
+            if self.jobs.get(job.key) is not job or job.due != due:
+                continue
+            times, next_run = job.runs_due(now)
+            if times:
+                asyncio.ensure_future(self._run(job, times))
+            elif job.next_run < now - GRACE:
+                logger.info(f"routine {job.key} skipped runs missed since {time.ctime(job.next_run)}")
+            self._push(job, next_run)
+
+    async def run(self):
+        """Sleep until the earliest due job, run what is due, repeat."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.time()
+            self.run_due(now)
+            timeout = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else MAX_SLEEP
+            if self._dirty:
+                wait = SAVE_INTERVAL - (time.monotonic() - self._saved_at)
+                if wait <= 0:
+                    self.flush()
+                else:
+                    timeout = min(timeout, wait)
+            self._waiter = loop.create_future()
+            timer = loop.call_later(max(timeout, 0), self._wakeup)
+            try:
+                await self._waiter
+            finally:
+                timer.cancel()
+
+    def start(self):
+        """start, if not already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """stop."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.flush()
+
+
+__scheduler = None
+
+
+def get_scheduler(file_path=None):
+    """The process-wide Scheduler, created on first use."""
+    global __scheduler
+    if __scheduler is None:
+        __scheduler = Scheduler(file_path or ROUTINES_STATE_PATH)
+    return __scheduler
@@ -0,0 +1,235 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Append-only, segmented, compressed record files.
+
+A segment starts with MAGIC and is followed by blocks. A block is a
+BLOCK header (compressed size, raw size, crc32 of the compressed bytes)
+and a zlib-compressed run of records, each a RECORD header (timestamp in
+milliseconds, kind, channel length, payload length) followed by the
+channel name and the payload. A torn block at the end of a segment, as
+left by a crash, fails its size or crc check and ends the read there.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TCSEG\x01"
+BLOCK = struct.Struct("<III")
+RECORD = struct.Struct("<QBHI")
+SUFFIX = ".seg"
+OPEN_SUFFIX = ".seg.open"
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_SECONDS = 3600
+FLUSH_INTERVAL = 1.0
+COMPRESS_LEVEL = 1
+
+
+def encode_records(records):
+    """Pack (timestamp_ms, kind, channel, payload) tuples into one raw block."""
+    parts = []
+    pack = RECORD.pack
+    for timestamp, kind, channel, payload in records:
+        channel = channel.encode("utf-8")
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        parts.append(pack(timestamp, kind, len(channel), len(payload)))
+        parts.append(channel)
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def decode_records(raw):
+    """Yield (timestamp_ms, kind, channel, payload bytes) from a raw block."""
+    offset = 0
+    end = len(raw)
+    unpack = RECORD.unpack_from
+    size = RECORD.size
+    while offset < end:
+        timestamp, kind, channel_len, payload_len = unpack(raw, offset)
+        offset += size
+        channel = raw[offset:offset + channel_len].decode("utf-8")
+        offset += channel_len
+        yield timestamp, kind, channel, raw[offset:offset + payload_len]
+        offset += payload_len
+
+
+class SegmentWriter:
+    """Buffers records in memory and writes them out from a background thread.
+
+    append() only takes a lock and extends a list, so it is safe to call from
+    the event loop at any rate. Every flush interval the writer thread
+    compresses what accumulated into one block, writes it, fsyncs once and
+    rotates to a new segment once the current one is too big or too old.
+    """
+
+    def __init__(
+        self,
+        directory,
+        prefix="chat",
+        segment_bytes=SEGMENT_BYTES,
+        segment_seconds=SEGMENT_SECONDS,
+        flush_interval=FLUSH_INTERVAL,
+        level=COMPRESS_LEVEL,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.level = level
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._file = None
+        self._path = None
+        self._opened_at = 0
+        self.appended = 0
+        self.written = 0
+        self.fsyncs = 0
+        self.segments = 0
+
+    def append(self, kind, channel, payload, timestamp=None):
+        """Queue one record; timestamp defaults to now, in milliseconds."""
+        if timestamp is None:
+            timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._buffer.append((timestamp, kind, channel, payload))
+        self.appended += 1
+
+    def _open(self):
+        self._opened_at = time.time()
+        name = f"{self.prefix}-{int(self._opened_at * 1000):013d}"
+        self._path = os.path.join(self.directory, name + OPEN_SUFFIX)
+        self._file = open(self._path, "ab")
+        self._file.write(MAGIC)
+        self.segments += 1
+
+    def _seal(self):
+        """Close the current segment and give it its final name."""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._path, self._path[: -len(OPEN_SUFFIX)] + SUFFIX)
+        self._file = None
+
+    def flush(self):
+        """Write whatever is buffered as one block and fsync it."""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        if self._file is not None and (
+            self._file.tell() >= self.segment_bytes
+            or time.time() - self._opened_at >= self.segment_seconds
+        ):
+            self._seal()
+        if self._file is None:
+            self._open()
+        raw = encode_records(records)
+        data = zlib.compress(raw, self.level)
+        self._file.write(BLOCK.pack(len(data), len(raw), zlib.crc32(data)) + data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+        self.written += len(records)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"could not write {self.prefix} segment: {e!r}")
+        self.flush()
+        self._seal()
+
+    def start(self):
+        """start."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Segments left open by a crash are complete up to their last good block.
+        for path in list_segments(self.directory, self.prefix, include_open=True):
+            if path.endswith(OPEN_SUFFIX):
+                os.replace(path, path[: -len(OPEN_SUFFIX)] + SUFFIX)
+        self._thread = threading.Thread(target=self._run, name=f"segments-{self.prefix}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Write out the buffer, seal the open segment and stop the thread."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        """stats."""
+        return {
+            "appended": self.appended,
+            "written": self.written,
+            "buffered": len(self._buffer),
+            "fsyncs": self.fsyncs,
+            "segments": self.segments,
+        }
+
+
+def list_segments(directory, prefix="chat", include_open=False):
+    """Segment paths in write order, optionally with the one being written."""
+    suffixes = (SUFFIX, OPEN_SUFFIX) if include_open else (SUFFIX,)
+    # Compared whole: the segments of bot "a" must not take in those of bot "a-b".
+    names = [
+        name for name in os.listdir(directory) if name.rsplit("-", 1)[0] == prefix and name.endswith(suffixes)
+    ]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def read_segment(path):
+    """Yield the records of one segment through a read-only memory map."""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a segment file")
+            offset = len(MAGIC)
+            end = len(view)
+            while offset + BLOCK.size <= end:
+                size, raw_size, crc = BLOCK.unpack_from(view, offset)
+                offset += BLOCK.size
+                data = view[offset:offset + size]
+                if len(data) < size or zlib.crc32(data) != crc:
+                    logger.warning(f"{path}: torn block at offset {offset - BLOCK.size}, stopping")
+                    return
+                offset += size
+                raw = zlib.decompress(data)
+                if len(raw) != raw_size:
+                    logger.warning(f"{path}: bad block at offset {offset - size - BLOCK.size}, stopping")
+                    return
+                yield from decode_records(raw)
+
+
+def read_segments(directory, prefix="chat", since=None, include_open=False):
+    """Yield every record of every segment, skipping segments started before since (ms)."""
+    paths = list_segments(directory, prefix, include_open)
+    for index, path in enumerate(paths):
+        if since is not None and index + 1 < len(paths):
+            # A segment only holds records up to the start of the next one.
+            if _started_at(paths[index + 1]) < since:
+                continue
+        for record in read_segment(path):
+            if since is None or record[0] >= since:
+                yield record
+
+
+def _started_at(path):
+    name = os.path.basename(path).split(".", 1)[0]
+    return int(name.rsplit("-", 1)[1])
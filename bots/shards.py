@@ -0,0 +1,249 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""A bot's channels spread over several IRC connections.
+
+twitchio joins every channel of a bot over one websocket, so a bot in
+thousands of channels reads them all from one socket and loses them all when
+it drops. A ShardPool caps the channels per connection and opens another
+connection when every open one is full. Each shard reconnects and re-joins
+its own channels on its own.
+
+The bot's own twitchio connection is always shard 0 and carries event_ready.
+A shard only dispatches events of the channels it owns, so a channel moved to
+another shard by rebalance() is heard from once, not twice, while both are
+in it.
+"""
+
+import asyncio
+import logging
+import time
+
+from twitchio.channel import Channel
+from twitchio.websocket import WSConnection
+
+logger = logging.getLogger(__name__)
+
+# Channels per connection; `channels_per_connection` in bots.yaml overrides it.
+SHARD_CAPACITY = 100
+READY_TIMEOUT = 30
+# twitchio's own JOIN pacing per connection, used where nothing paces by account.
+JOIN_BUCKET = (20, 10)
+
+
+def _channel(name):
+    return name.lstrip("#").lower()
+
+
+def _discard(channels, channel):
+    # twitchio drops channels it failed to join from _initial_channels itself.
+    if channel in channels:
+        channels.remove(channel)
+
+
+def _channel_of(args):
+    """The name of the channel an event is about, else None."""
+    for arg in args:
+        channel = arg if isinstance(arg, Channel) else getattr(arg, "channel", None)
+        if isinstance(channel, Channel):
+            return channel.name
+    return None
+
+
+class Connection(WSConnection):
+    """twitchio's IRC connection, fixed to keep its channels across reconnects."""
+
+    async def _connect(self):
+        # twitchio skips logging in again when its last PING was recent, which
+        # leaves a connection that dropped early unauthenticated for good.
+        if self._websocket is not None:
+            self._reconnect_requested = True
+        return await super()._connect()
+
+    async def join_channels(self, *channels):
+        """Join channels at twitchio's pace; its own version drops the channel it has to wait on."""
+        limit, period = JOIN_BUCKET
+        async with self._join_lock:
+            for channel in channels:
+                if self._join_handle < time.time():
+                    self._join_tick = limit
+                    self._join_handle = time.time() + period
+                if self._join_tick == 0:
+                    await asyncio.sleep(self._join_handle - time.time())
+                    self._join_tick = limit
+                    self._join_handle = time.time() + period
+                asyncio.create_task(self._join_channel(channel))
+                self._join_tick -= 1
+
+
+class ShardConnection(Connection):
+    """A connection of the bot besides its own, carrying some of its channels."""
+
+    def __init__(self, pool, index):
+        primary = pool.bot._connection
+        super().__init__(
+            loop=pool.bot.loop,
+            heartbeat=primary._heartbeat,
+            client=pool.bot,
+            token=primary._token,
+            modes=primary.modes,
+        )
+        self.pool = pool
+        self.index = index
+        self.nick = pool.bot.nick
+        self.user_id = pool.bot.user_id
+        self.connected = None
+        self._closed = False
+
+    def __repr__(self):
+        return f"<shard {self.index} of {self.pool.bot.name}, {len(self._initial_channels)} channels>"
+
+    def dispatch(self, event, *args, **kwargs):
+        # The bot is ready when its own connection is; a channel being moved
+        # away is heard from on its new shard only.
+        if event == "ready":
+            return
+        channel = _channel_of(args)
+        if channel is not None and self.pool.owner.get(channel) is not self:
+            return
+        super().dispatch(event, *args, **kwargs)
+
+    async def _connect(self):
+        if self._closed:
+            return
+        return await super()._connect()
+
+    async def _close(self):
+        # twitchio closes the bot's HTTP session and stops the loop on a failed
+        # login; a shard only takes itself down.
+        logger.error(f"{self.pool.bot.name} shard {self.index} failed to log in")
+        await self.close()
+
+    async def close(self):
+        """Disconnect for good, leaving the channels of this shard."""
+        self._closed = True
+        if self._keeper:
+            self._keeper.cancel()
+        self.is_ready.clear()
+        for future in self._join_pending.values():
+            future.cancel()
+        if self._websocket:
+            await self._websocket.close()
+
+
+class ShardPool:
+    """The IRC connections of a bot and which of its channels each one carries."""
+
+    def __init__(self, bot, capacity=SHARD_CAPACITY):
+        self.bot = bot
+        self.capacity = capacity
+        self.shards = [bot._connection]
+        self.owner = {}
+        self._count = 0
+        self._join_limiter = None
+        self._connect_limiter = None
+        self._lock = asyncio.Lock()
+
+    def pace(self, join_limiter, connect_limiter):
+        """Pace JOINs and new connections by the account's and client id's limits; see bots.startup."""
+        self._join_limiter = join_limiter
+        self._connect_limiter = connect_limiter
+
+    def connection_for(self, channel):
+        """The connection that carries channel, the bot's own if none does."""
+        return self.owner.get(_channel(channel), self.bot._connection)
+
+    def sizes(self):
+        """Channels per shard, in shard order."""
+        return [len(shard._initial_channels) for shard in self.shards]
+
+    def _place(self, exclude=None):
+        """The least loaded shard with room, opening a new one when all are full."""
+        open_shards = [s for s in self.shards if s is not exclude and len(s._initial_channels) < self.capacity]
+        if open_shards:
+            return min(open_shards, key=lambda s: len(s._initial_channels))
+        self._count += 1
+        shard = ShardConnection(self, self._count)
+        self.shards.append(shard)
+        logger.info(f"{self.bot.name} opening shard {shard.index}, {len(self.shards)} connections")
+        return shard
+
+    async def _connect(self, shard):
+        if self._connect_limiter:
+            await self._connect_limiter.acquire()
+        await shard._connect()
+        try:
+            await asyncio.wait_for(shard.is_ready.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Its channels are joined when its own reconnect logs in.
+            logger.warning(f"{self.bot.name} shard {shard.index} was not ready after {READY_TIMEOUT}s")
+
+    async def _join(self, shard, channel):
+        if shard is not self.bot._connection:
+            if shard.connected is None:
+                shard.connected = asyncio.ensure_future(self._connect(shard))
+            await shard.connected
+        if self._join_limiter:
+            await self._join_limiter.acquire()
+        previous = self.owner.get(channel)
+        self.owner[channel] = shard
+        shard._initial_channels.append(channel)
+        if previous is not None:
+            _discard(previous._initial_channels, channel)
+        # A shard that is down joins its channels as it logs back in.
+        if not shard.is_alive:
+            return
+        if self._join_limiter:
+            # Already paced by account, which is what Twitch limits.
+            await shard._join_channel(channel)
+        else:
+            await shard.join_channels(channel)
+
+    async def join(self, channels):
+        """Join channels not joined yet, each on the least loaded shard with room."""
+        async with self._lock:
+            for channel in dict.fromkeys(_channel(c) for c in channels):
+                if channel not in self.owner:
+                    await self._join(self._place(), channel)
+
+    async def part(self, channels):
+        """Leave channels, closing the shards left without any."""
+        async with self._lock:
+            for channel in dict.fromkeys(_channel(c) for c in channels):
+                shard = self.owner.pop(channel, None)
+                if shard is None:
+                    continue
+                _discard(shard._initial_channels, channel)
+                shard._cache.pop(channel, None)
+                if shard.is_alive:
+                    await shard.send(f"PART #{channel}\r\n")
+            for shard in [s for s in self.shards[1:] if not s._initial_channels]:
+                await self._close(shard)
+
+    async def rebalance(self):
+        """Empty and close the least loaded shards while the others have room for their channels."""
+        async with self._lock:
+            while len(self.shards) > 1 and self.capacity * (len(self.shards) - 1) >= len(self.owner):
+                drained = min(self.shards[1:], key=lambda s: len(s._initial_channels))
+                for channel in list(drained._initial_channels):
+                    await self._join(self._place(exclude=drained), channel)
+                await self._close(drained)
+
+    async def _close(self, shard):
+        self.shards.remove(shard)
+        await shard.close()
+        logger.info(f"{self.bot.name} closed shard {shard.index}, {len(self.shards)} connections")
+
+    def set_token(self, token):
+        """Log in with token on every later (re)connect."""
+        for shard in self.shards:
+            shard._token = token
+
+    def channels(self):
+        """Every joined channel, bound to the connection that carries it."""
+        return [Channel(name=channel, websocket=shard) for channel, shard in self.owner.items() if channel in shard._cache]
+
+    async def close(self):
+        """Disconnect every shard but the bot's own, which Bot.close takes care of."""
+        for shard in self.shards[1:]:
+            await shard.close()
+        self.shards = self.shards[:1]
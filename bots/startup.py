@@ -0,0 +1,94 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Concurrent bot startup, throttled only where Twitch enforces limits."""
+
+import asyncio
+import logging
+import time
+
+from bots.ratelimit import RateLimiterGroup
+
+logger = logging.getLogger(__name__)
+
+# https://dev.twitch.tv/docs/irc#rate-limits
+# Authentication attempts are limited per client id, JOINs per account.
+CONNECT_LIMIT = (20, 10)
+JOIN_LIMIT = (20, 10)
+VERIFIED_JOIN_LIMIT = (2000, 10)
+READY_TIMEOUT = 30
+
+
+class StartupTimeline:
+    """Records when each startup phase of a bot finished."""
+
+    def __init__(self, name, origin):
+        self.name = name
+        self.origin = origin
+        self.phases = []
+
+    def mark(self, phase):
+        self.phases.append((phase, time.monotonic() - self.origin))
+
+    def __str__(self):
+        steps = " ".join(f"{phase}={offset:.2f}s" for phase, offset in self.phases)
+        return f"{self.name}: {steps}"
+
+
+class StartupScheduler:
+    """Connects every bot at once, pacing connects per client id and JOINs per account."""
+
+    def __init__(self, connect_limit=CONNECT_LIMIT, join_limit=JOIN_LIMIT, transport=None):
+        self.transport = transport
+        self._connects = RateLimiterGroup(*connect_limit)
+        self._joins = RateLimiterGroup(*join_limit)
+        self._verified_joins = RateLimiterGroup(*VERIFIED_JOIN_LIMIT)
+        self.timelines = {}
+
+    def join_limiter(self, bot):
+        """The JOIN limiter for the account the bot logs in as."""
+        limiters = self._verified_joins if bot.verified else self._joins
+        return limiters[bot.nick or bot.name]
+
+    async def join(self, bot, channels, timeline=None):
+        """Join channels through the bot's shards, which pace the JOINs by the limiter given in start()."""
+        await bot.join_channels(channels)
+        if timeline:
+            timeline.mark("joined")
+
+    async def start(self, bot, origin):
+        """start."""
+        timeline = self.timelines[bot.name] = StartupTimeline(bot.name, origin)
+        timeline.mark("queued")
+        # Extra connections of the bot are paced the same as its first; see bots.shards.
+        bot.shards.pace(self.join_limiter(bot), self._connects[bot.client_id])
+        if self.transport:
+            self.transport.attach(bot)
+        await bot.authorize()
+        timeline.mark("authorized")
+        await self._connects[bot.client_id].acquire()
+        timeline.mark("connect_slot")
+        await bot.connect()
+        timeline.mark("connected")
+        await self.join(bot, bot.channels, timeline)
+        try:
+            await asyncio.wait_for(bot.wait_for_ready(), READY_TIMEOUT)
+            timeline.mark("ready")
+        except asyncio.TimeoutError:
+            logger.warning(f"{bot.name} was not ready after {READY_TIMEOUT}s")
+
+    async def start_all(self, bots):
+        """Start every bot concurrently and log the per-bot startup timeline."""
+        origin = time.monotonic()
+        results = await asyncio.gather(
+            *(self.start(bot, origin) for bot in bots), return_exceptions=True
+        )
+        for bot, result in zip(bots, results):
+            if isinstance(result, Exception):
+                logger.error(f"{bot.name} failed to start: {result!r}")
+        self.report()
+        return [bot for bot, result in zip(bots, results) if not isinstance(result, Exception)]
+
+    def report(self):
+        """Log one line per bot describing where its startup time went."""
+        for timeline in sorted(self.timelines.values(), key=lambda t: t.phases[-1][1]):
+            logger.info(f"startup {timeline}")
@@ -0,0 +1,197 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Run the bots of one bots.yaml across several worker processes."""
+
+import logging
+import logging.handlers
+import multiprocessing
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF_MIN = 1
+RESTART_BACKOFF_MAX = 60
+# A worker that stayed up this long is considered healthy again.
+STABLE_AFTER = 60
+
+__worker_index = None
+__workers = None
+
+
+def worker_index():
+    """The index of the worker this process is, None outside of --workers."""
+    return __worker_index
+
+
+def shard_for(bot_name, workers):
+    """Stable worker index for a bot name, identical across runs and hosts."""
+    return zlib.crc32(bot_name.encode("utf-8")) % workers
+
+
+def owns_bot(bot_name):
+    """Whether this process runs the named bot; always, outside of --workers."""
+    return __worker_index is None or shard_for(bot_name, __workers) == __worker_index
+
+
+def split_bots(bots_config, workers, keep_empty=False):
+    """Split the bots mapping into (shard index, mapping) pairs, dropping empty
+    shards unless keep_empty."""
+    shards = [{} for _ in range(workers)]
+    for bot_name, bot_config in (bots_config or {}).items():
+        shards[shard_for(bot_name, workers)][bot_name] = bot_config
+    return [(index, shard) for index, shard in enumerate(shards) if shard or keep_empty]
+
+
+class _WorkerTag(logging.Filter):
+    def __init__(self, index):
+        super().__init__()
+        self.prefix = f"[worker {index}] "
+
+    def filter(self, record):
+        record.msg = self.prefix + record.getMessage()
+        record.args = None
+        return True
+
+
+def _worker_entry(target, index, workers, log_queue, log_level, log_filter, args):
+    """Forward this worker's logging to the supervisor, then run the target."""
+    global __worker_index, __workers
+    __worker_index = index
+    __workers = workers
+    handler = logging.handlers.QueueHandler(log_queue)
+    if log_filter is not None:
+        # Drop sampled out records before they are pickled to the supervisor.
+        handler.addFilter(log_filter)
+    handler.addFilter(_WorkerTag(index))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(log_level)
+    target(*args)
+
+
+class Worker:
+    """One supervised process and its restart state."""
+
+    def __init__(self, index, bots_config):
+        self.index = index
+        self.bots_config = bots_config
+        self.process = None
+        self.started_at = None
+        self.restart_at = None
+        self.backoff = RESTART_BACKOFF_MIN
+        self.restarts = 0
+
+
+class Supervisor:
+    """Starts one process per shard, restarts crashed ones with backoff and
+    collects their logs and exit statuses in this process.
+
+    `target(bots_config, *args)` runs inside each worker with its share of the
+    bots; it must be importable by the worker, i.e. defined at module level.
+    Each worker is numbered by its shard, so owns_bot() places bots added to
+    bots.yaml later on the same worker. keep_empty also starts the workers
+    that have no bots yet, for them to pick such bots up.
+
+    log_filter runs in each worker before its records are sent here. They are
+    then emitted by log_handler as they are, since the filter must not run
+    twice, or handled by their logger when there is no log_handler.
+    """
+
+    def __init__(self, target, bots_config, workers, args=(), log_filter=None, log_handler=None, keep_empty=False):
+        self.target = target
+        self.args = args
+        self.log_filter = log_filter
+        self.log_handler = log_handler
+        self.shards = workers
+        self.context = multiprocessing.get_context("spawn")
+        self.log_queue = self.context.Queue()
+        self.workers = [Worker(index, shard) for index, shard in split_bots(bots_config, workers, keep_empty)]
+        self.exits = []
+        self._log_thread = None
+
+    def _drain_logs(self):
+        while True:
+            record = self.log_queue.get()
+            if record is None:
+                return
+            if self.log_handler is not None:
+                self.log_handler.emit(record)
+            else:
+                logging.getLogger(record.name).handle(record)
+
+    def _spawn(self, worker):
+        worker.process = self.context.Process(
+            target=_worker_entry,
+            args=(
+                self.target,
+                worker.index,
+                self.shards,
+                self.log_queue,
+                logging.getLogger().level,
+                self.log_filter,
+                (worker.bots_config,) + tuple(self.args),
+            ),
+            name=f"bots-worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logger.info(
+            f"worker {worker.index} started (pid {worker.process.pid}): {', '.join(worker.bots_config) or 'no bots yet'}"
+        )
+
+    def _reap(self, worker):
+        """Record a worker exit and schedule its restart when it crashed."""
+        uptime = time.monotonic() - worker.started_at
+        exitcode = worker.process.exitcode
+        self.exits.append((worker.index, exitcode, uptime))
+        worker.process = None
+        if exitcode == 0:
+            logger.info(f"worker {worker.index} exited cleanly after {uptime:.0f}s")
+            return
+        if uptime >= STABLE_AFTER:
+            worker.backoff = RESTART_BACKOFF_MIN
+        logger.error(
+            f"worker {worker.index} exited with status {exitcode} after {uptime:.0f}s, "
+            f"restarting in {worker.backoff}s"
+        )
+        worker.restart_at = time.monotonic() + worker.backoff
+        worker.backoff = min(worker.backoff * 2, RESTART_BACKOFF_MAX)
+        worker.restarts += 1
+
+    def run(self, poll_interval=0.5):
+        """Block until every worker has exited cleanly or we are interrupted."""
+        self._log_thread = threading.Thread(target=self._drain_logs, daemon=True)
+        self._log_thread.start()
+        for worker in self.workers:
+            self._spawn(worker)
+        try:
+            while any(w.process or w.restart_at for w in self.workers):
+                time.sleep(poll_interval)
+                for worker in self.workers:
+                    if worker.process and not worker.process.is_alive():
+                        self._reap(worker)
+                    elif worker.restart_at and time.monotonic() >= worker.restart_at:
+                        self._spawn(worker)
+        except KeyboardInterrupt:
+            logger.info("stopping workers")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        """Terminate remaining workers and log a summary of every exit."""
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(timeout)
+                self._reap(worker)
+                worker.restart_at = None
+        for index, exitcode, uptime in self.exits:
+            logger.info(f"worker {index}: exit status {exitcode} after {uptime:.0f}s")
+        self.log_queue.put(None)
+        if self._log_thread:
+            self._log_thread.join(timeout)
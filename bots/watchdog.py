@@ -0,0 +1,147 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Find out what blocked the event loop every bot shares.
+
+A heartbeat task on the loop notes when its next wake-up is due. A thread
+polls that time, and once the loop is late by more than the threshold it
+grabs the loop thread's stack while the blocking call is still running.
+The bot, cog and handler are read from the Bot._timed_event or Bot.invoke
+frame on that stack, so nothing is added to the handlers themselves.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from bots import metrics
+from bots.bot import Bot, _owner
+
+logger = logging.getLogger(__name__)
+
+STALL_THRESHOLD = 0.25
+HEARTBEAT_INTERVAL = 0.1
+# At most one logged report per culprit this often; metrics count every stall.
+REPORT_INTERVAL = 60
+STACK_LIMIT = 20
+
+_EVENT_CODE = Bot._timed_event.__code__
+_COMMAND_CODE = Bot.invoke.__code__
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _callable_name(callback):
+    func = getattr(callback, "func", callback)  # unwrap the partials cogs register
+    return getattr(func, "__qualname__", repr(func))
+
+
+def attribute(frame):
+    """(bot, cog, handler) responsible for the stack ending at frame."""
+    innermost = None
+    while frame is not None:
+        code = frame.f_code
+        if code is _EVENT_CODE:
+            f_locals = frame.f_locals
+            callback = f_locals["callback"]
+            return f_locals["self"].name, _owner(callback), _callable_name(callback)
+        if code is _COMMAND_CODE:
+            f_locals = frame.f_locals
+            command = f_locals["context"].command
+            cog = command.cog.name if command.cog else "bot"
+            return f_locals["self"].name, cog, _callable_name(command._callback)
+        if innermost is None and code.co_filename.startswith(_ROOT):
+            innermost = f"{os.path.relpath(code.co_filename, _ROOT)}:{code.co_name}"
+        frame = frame.f_back
+    return "", "", innermost or "unknown"
+
+
+class StallWatchdog(metrics.LoopLagMonitor):
+    """LoopLagMonitor whose heartbeats are also watched from another thread."""
+
+    def __init__(
+        self,
+        threshold=STALL_THRESHOLD,
+        interval=HEARTBEAT_INTERVAL,
+        report_interval=REPORT_INTERVAL,
+        stack_limit=STACK_LIMIT,
+    ):
+        super().__init__(interval)
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.stack_limit = stack_limit
+        self.stall_seconds = metrics.STALL_SECONDS.labels()
+        self._loop_thread = None
+        self._captured = None
+        self._reported = {}
+        self._suppressed = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    async def run(self):
+        """run."""
+        self._loop_thread = threading.get_ident()
+        await super().run()
+
+    def observe(self, lag):
+        super().observe(lag)
+        if lag > self.threshold:
+            self.stall_seconds.observe(lag)
+            if self._captured is not None and self._captured[1]:
+                culprit = self._captured[0]
+                logger.info(f"event loop resumed after {lag:.2f}s stall in {'/'.join(filter(None, culprit))}")
+        self._captured = None
+
+    def _watch(self):
+        while not self._stopping.wait(self.threshold / 2):
+            due = self.due
+            if due is None or self._captured is not None or self._loop_thread is None:
+                continue
+            late = time.monotonic() - due
+            if late > self.threshold:
+                self._capture(due, late)
+
+    def _capture(self, due, late):
+        frame = sys._current_frames().get(self._loop_thread)
+        # The heartbeat may have run while the frames were being collected.
+        if frame is None or self.due != due:
+            return
+        culprit = attribute(frame)
+        stack = traceback.format_list(traceback.extract_stack(frame)[-self.stack_limit:])
+        del frame
+        metrics.STALLS.labels(*culprit).inc()
+        self._captured = (culprit, self._report(culprit, late, stack))
+
+    def _report(self, culprit, late, stack):
+        """Log the stall unless this culprit was reported recently; True if logged."""
+        now = time.monotonic()
+        if now - self._reported.get(culprit, -self.report_interval) < self.report_interval:
+            self._suppressed[culprit] = self._suppressed.get(culprit, 0) + 1
+            return False
+        self._reported[culprit] = now
+        suppressed = self._suppressed.pop(culprit, 0)
+        bot, cog, handler = culprit
+        logger.warning(
+            f"event loop blocked for {late:.2f}s so far by bot={bot or '-'} cog={cog or '-'} handler={handler}"
+            + (f" ({suppressed} more stalls since the last report)" if suppressed else "")
+            + "\n"
+            + "".join(stack).rstrip()
+        )
+        return True
+
+    def start(self):
+        """start."""
+        task = super().start()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        return task
+
+    async def stop(self):
+        """stop."""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+        await super().stop()
@@ -1,9 +1,50 @@
 from twitchio.ext import commands
 
+from bots.ratelimit import BucketTable
+
+# What a cooldown counts uses per: the user in that channel, the channel, or the whole bot.
+SCOPES = {
+    "user": lambda ctx: (ctx.channel.name if ctx.channel else "", ctx.author.name),
+    "channel": lambda ctx: ctx.channel.name if ctx.channel else "",
+    "global": lambda ctx: None,
+}
+
+
+def _check_cooldowns(ctx):
+    # Commands are shared by every bot's instance of a cog; find this bot's.
+    cog = ctx.bot.cogs.get(ctx.command.cog.name) if ctx.command.cog else None
+    if not isinstance(cog, BaseCog):
+        return True
+    return cog.check_cooldowns(ctx)
+
+
+def cooldown(rate, per, scope="user"):
+    """Allow a command `rate` times per `per` seconds for each user, channel or globally.
+
+    Goes below @commands.command(). Stacked cooldowns all apply, and a use is
+    only counted when every one of them allows it.
+    """
+    if scope not in SCOPES:
+        raise ValueError(f"unknown cooldown scope {scope}, expected one of {', '.join(SCOPES)}")
+
+    def decorator(func):
+        if not hasattr(func, "__cog_cooldowns__"):
+            func.__cog_cooldowns__ = []
+            func.__checks__ = getattr(func, "__checks__", []) + [_check_cooldowns]
+        func.__cog_cooldowns__.append((rate, per, scope))
+        return func
+
+    return decorator
+
+
 class BaseCog(commands.Cog):
     def __init__(self, bot, name, **kwargs):
         self.bot = bot
-        self.name = name
+        # commands.Cog.name is a read-only property backed by __cogname__
+        self.__cogname__ = name
+        self.data = kwargs
+        # (BucketTable, scope) pairs per command name, made on first use.
+        self._cooldowns = {}
         # Initialize cog with specific kwargs
         for key, value in kwargs.items():
             setattr(self, key, value)
@@ -12,3 +53,32 @@ class BaseCog(commands.Cog):
 
     def load_config(self):
         pass # to be overridden by each cog as necessary
+
+    def check_cooldowns(self, ctx):
+        """True if every cooldown of the command allows this use, which is then counted."""
+        command = ctx.command
+        limits = self._cooldowns.get(command.name)
+        if limits is None:
+            limits = self._cooldowns[command.name] = [
+                (BucketTable(rate, per), SCOPES[scope])
+                for rate, per, scope in command._callback.__cog_cooldowns__
+            ]
+        keys = [scope(ctx) for _, scope in limits]
+        retry_after = max(table.delay(key) for (table, _), key in zip(limits, keys))
+        if retry_after:
+            raise commands.CommandOnCooldown(command, retry_after)
+        for (table, _), key in zip(limits, keys):
+            table.take(key)
+        return True
+
+    def queue_depths(self):
+        """Items waiting in the cog's own queues by name, exported as metrics."""
+        return {}
+
+    async def channels_changed(self):
+        """Called after the running bot joined or parted channels; see bots.reload."""
+        pass
+
+    async def close(self):
+        """Release what the cog started; called when it is unloaded from a running bot."""
+        pass
@@ -0,0 +1,79 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The chatlog cog keeps every chat message and PubSub/EventSub payload."""
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+from bots.bot import Bot
+from bots.eventbus import ChatMessage, EventSubNotification, PubSubEvent, get_event_bus
+from bots.segments import SegmentWriter
+from twitchio.ext import commands
+from .base import BaseCog
+
+logger = logging.getLogger(__name__)
+
+# Record kinds; see bots.segments for the file format.
+CHAT = 1
+PUBSUB = 2
+EVENTSUB = 3
+
+
+class Cog(BaseCog):
+
+    def __init__(self, bot: Bot, data={}):
+        super().__init__(bot, 'chatlog', **data)
+        self.writer = SegmentWriter(
+            self.data.get("directory", "chatlog"),
+            prefix=self.bot.name,
+            segment_bytes=self.data.get("segment_mb", 64) * 1024 * 1024,
+            segment_seconds=self.data.get("segment_minutes", 60) * 60,
+            flush_interval=self.data.get("flush_interval", 1.0),
+        )
+        self.writer.start()
+        atexit.register(self.writer.stop)
+        # drop_newest by default: a log that falls behind keeps what it has
+        # in order and loses the newest records, not ones in the middle.
+        bus = get_event_bus()
+        options = {
+            "bot": self.bot.name,
+            "maxsize": self.data.get("queue_size", 10000),
+            "overflow": self.data.get("overflow", "drop_newest"),
+        }
+        self.bus_subscriptions = [
+            bus.subscribe(ChatMessage, self.log_chat, name=f"{self.bot.name}.chatlog.chat", **options),
+            bus.subscribe(PubSubEvent, self.log_pubsub, name=f"{self.bot.name}.chatlog.pubsub", **options),
+            bus.subscribe(EventSubNotification, self.log_eventsub, name=f"{self.bot.name}.chatlog.eventsub", **options),
+        ]
+
+    async def close(self):
+        for subscription in self.bus_subscriptions:
+            subscription.close()
+        atexit.unregister(self.writer.stop)
+        # Stopping joins the writer thread through its last flush and fsync.
+        await asyncio.get_running_loop().run_in_executor(None, self.writer.stop)
+
+    def queue_depths(self):
+        depths = {"buffered": len(self.writer._buffer)}
+        for subscription in self.bus_subscriptions:
+            depths[subscription.record_type.__name__] = subscription.depth
+        return depths
+
+    async def log_chat(self, record):
+        """Keep the raw IRC line, tags included."""
+        self.writer.append(CHAT, record.channel, record.raw)
+
+    async def log_pubsub(self, record):
+        """log_pubsub."""
+        self.writer.append(PUBSUB, record.topic or "", json.dumps(record.data))
+
+    async def log_eventsub(self, record):
+        """log_eventsub."""
+        self.writer.append(EVENTSUB, record.kind, record.payload)
+
+    @commands.Cog.event("event_ready")
+    async def is_ready(self):
+        """is_ready."""
+        logger.info(f"chatlog cog is writing to {os.path.abspath(self.writer.directory)}")
@@ -3,7 +3,7 @@
 
 from bots.bot import Bot
 from twitchio.ext import commands
-from .base import BaseCog
+from .base import BaseCog, cooldown
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,9 +14,10 @@ class Cog(BaseCog):
         super().__init__(bot, 'echo_console', **data)
 
     @commands.command()
+    @cooldown(1, 10, "user")
     async def hello(self, ctx: commands.Context):
         """hello."""
-        await ctx.send(f"Hello from {self.bot.name}, {ctx.author.name}!")
+        self.bot.say(ctx.channel.name, f"Hello from {self.bot.name}, {ctx.author.name}!", lane="fun")
 
     @commands.Cog.event()
     async def event_message(self, message):
@@ -9,195 +9,394 @@
 # Note:
 # Twitch requires EventSub targets to have TLS/SSL enabled (https). TwitchIO does not support this, as such you should use a reverse proxy such as nginx to handle TLS/SSL.
 
+# With `transport: websocket` the cog opens an EventSub WebSocket session itself instead, see bots/eventsub_ws.py,
+# and none of the above is needed. Its subscriptions are made with the bot's own user token.
+
 """Cog composes bot features."""
 
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
 import logging
+from aiohttp import web
 from bots.bot import Bot
+from bots.eventbus import EventSubNotification, get_event_bus
+from bots.eventsub_ws import KEEPALIVE_TIMEOUT, EventSubSession
+from bots.ingest import DedupeCache, EventIngest
+from bots.resolver import get_resolver
+from oauth.user import get_app_token_async
 from twitchio.ext import commands, eventsub
-from .base_cog import BaseCog
+from twitchio.ext.eventsub import models
+from twitchio.http import Route
+from .base import BaseCog
 
 logger = logging.getLogger(__name__)
 
+Types = eventsub.SubscriptionTypes
+
+# events in bots.yaml -> (subscription type, condition field holding the channel's user id)
+SUBSCRIPTIONS = {
+    "user_updated": (Types.user_update, "user_id"),
+    "channel_raid": (Types.raid, "from_broadcaster_user_id"),
+    "channel_ban": (Types.ban, "broadcaster_user_id"),
+    "channel_unban": (Types.unban, "broadcaster_user_id"),
+    "channel_subscription": (Types.subscription, "broadcaster_user_id"),
+    "channel_cheers": (Types.cheer, "broadcaster_user_id"),
+    "channel_update": (Types.channel_update, "broadcaster_user_id"),
+    "channel_follow": (Types.follow, "broadcaster_user_id"),
+    "channel_moderators_add": (Types.channel_moderator_add, "broadcaster_user_id"),
+    "channel_moderators_remove": (Types.channel_moderator_remove, "broadcaster_user_id"),
+    "channel_hypetrain_begin": (Types.hypetrain_begin, "broadcaster_user_id"),
+    "channel_hypetrain_progress": (Types.hypetrain_progress, "broadcaster_user_id"),
+    "channel_hypetrain_end": (Types.hypetrain_end, "broadcaster_user_id"),
+    "channel_stream_start": (Types.stream_start, "broadcaster_user_id"),
+    "channel_stream_end": (Types.stream_end, "broadcaster_user_id"),
+    "channel_points_reward_added": (Types.channel_reward_add, "broadcaster_user_id"),
+    "channel_points_reward_updated": (Types.channel_reward_update, "broadcaster_user_id"),
+    "channel_points_reward_removed": (Types.channel_reward_remove, "broadcaster_user_id"),
+    "channel_points_redeemed": (Types.channel_reward_redeem, "broadcaster_user_id"),
+    "channel_points_redeem_updated": (Types.channel_reward_redeem_updated, "broadcaster_user_id"),
+}
+
+# Subscriptions in these states never deliver again and still count against the cost limit.
+FAILED_STATUSES = {
+    "webhook_callback_verification_failed",
+    "notification_failures_exceeded",
+    "authorization_revoked",
+    "user_removed",
+    "websocket_disconnected",
+    "websocket_failed_ping_pong",
+    "websocket_received_inbound_traffic",
+    "websocket_connection_unused",
+    "websocket_internal_error",
+    "websocket_network_timeout",
+    "websocket_network_error",
+}
+TRANSPORTS = ("webhook", "websocket")
+MAX_CONCURRENCY = 10
+# App tokens are renewed this many seconds before they expire.
+APP_TOKEN_MARGIN = 60
+# Twitch asks to reject messages older than this to prevent replays.
+MAX_MESSAGE_AGE = datetime.timedelta(minutes=10)
+
+
+def _key(typ, condition):
+    return typ, tuple(sorted((k, v) for k, v in condition.items() if v))
+
+
+class SubscriptionManager:
+    """Makes the live EventSub subscriptions match the wanted ones.
+
+    Existing subscriptions are listed first; only missing ones are created and
+    only orphaned or failed ones deleted, a bounded number at a time. Given an
+    EventSubSession, subscriptions go to its websocket session instead of the
+    client's webhook.
+
+    Twitch only lists, creates and deletes webhook subscriptions for an app
+    access token and websocket ones for a user token. twitchio sends the bot's
+    user token unless no app token was generated yet, so every request here
+    carries its token explicitly.
+    """
+
+    def __init__(self, eventsub_client, max_concurrency=MAX_CONCURRENCY, session=None):
+        self.client = eventsub_client
+        self.http = eventsub_client._http
+        self.max_concurrency = max_concurrency
+        self.session = session
+        self._lock = asyncio.Lock()
+        self._app_token = None
+        self._app_token_expires = 0
+
+    async def token(self):
+        """The token for this manager's transport: an app token for webhooks, else the bot's."""
+        if self.session is not None:
+            return self.http._http.token
+        loop = asyncio.get_running_loop()
+        if self._app_token is None or loop.time() >= self._app_token_expires:
+            http = self.http._http
+            self._app_token, expires_in = await get_app_token_async(http.client_id, http.client_secret)
+            self._app_token_expires = loop.time() + max(expires_in - APP_TOKEN_MARGIN, 0)
+        return self._app_token
+
+    async def request(self, method, query=None, body=None, full_body=False):
+        """Send method to eventsub/subscriptions with this manager's token."""
+        route = Route(method, "eventsub/subscriptions", body=body, query=query, token=await self.token())
+        return await self.http._http.request(route, paginate=False, full_body=full_body)
+
+    def wanted(self, events, user_ids):
+        """Map subscription keys to (subscription type, condition) for every channel and event."""
+        wanted = {}
+        for event in events:
+            if event not in SUBSCRIPTIONS:
+                logger.warning(f"unknown eventsub event {event}")
+                continue
+            typ, field = SUBSCRIPTIONS[event]
+            for user_id in user_ids:
+                condition = {field: str(user_id)}
+                wanted[_key(typ[0], condition)] = (typ, condition)
+        return wanted
+
+    def owns(self, subscription):
+        """Whether a listed subscription was created by this client's transport."""
+        transport = subscription["transport"]
+        if self.session is None:
+            return transport["method"] == "webhook" and transport.get("callback") == self.client.route
+        # Those of ended sessions are left failed; they are this client's to clean up too.
+        return transport["method"] == "websocket" and (
+            transport.get("session_id") == self.session.session_id or subscription["status"] in FAILED_STATUSES
+        )
+
+    async def create(self, typ, condition):
+        """Subscribe to typ for condition on this manager's transport."""
+        if self.session is None:
+            transport = {"method": "webhook", "callback": self.client.route, "secret": self.client.secret}
+        else:
+            transport = {"method": "websocket", "session_id": self.session.session_id}
+        payload = {"type": typ[0], "version": str(typ[1]), "condition": condition, "transport": transport}
+        return await self.request("POST", body=payload)
+
+    async def delete(self, subscription_id):
+        return await self.request("DELETE", query=[("id", subscription_id)])
+
+    async def existing(self):
+        """All subscriptions of this client, following pagination."""
+        subscriptions, cursor = [], None
+        while True:
+            query = [("after", cursor)] if cursor else None
+            body = await self.request("GET", query=query, full_body=True)
+            subscriptions.extend(s for s in body["data"] if self.owns(s))
+            cursor = body.get("pagination", {}).get("cursor")
+            if not cursor:
+                return subscriptions
+
+    async def sync(self, events, user_ids):
+        """Create the missing subscriptions and delete the unwanted or failed ones."""
+        # A sync started meanwhile would create what this one is creating.
+        async with self._lock:
+            return await self._sync(events, user_ids)
+
+    async def _sync(self, events, user_ids):
+        wanted = self.wanted(events, user_ids)
+        to_delete = []
+        for subscription in await self.existing():
+            key = _key(subscription["type"], subscription["condition"])
+            if subscription["status"] in FAILED_STATUSES or key not in wanted:
+                to_delete.append(subscription["id"])
+            else:
+                # Keep it; both enabled and still-verifying subscriptions count.
+                wanted.pop(key, None)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        deleted = await asyncio.gather(
+            *(bounded(self.delete(sid)) for sid in to_delete),
+            return_exceptions=True,
+        )
+        created = await asyncio.gather(
+            *(bounded(self.create(typ, condition)) for typ, condition in wanted.values()),
+            return_exceptions=True,
+        )
+        failures = [r for r in deleted + created if isinstance(r, Exception)]
+        for failure in failures:
+            logger.warning(f"eventsub subscription change failed: {failure!r}")
+        logger.info(
+            f"eventsub subscriptions: {len(created)} created, {len(deleted)} deleted, "
+            f"{len(failures)} failed"
+        )
+        return failures
+
+
+class _Delivery:
+    """Stands in for the aiohttp request the twitchio event models read headers from."""
+
+    __slots__ = ("headers",)
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class IngestEventSubClient(eventsub.EventSubClient):
+    """EventSubClient that acknowledges deliveries before handling them.
+
+    The signature is checked and duplicates (Twitch redelivers until it gets a
+    2xx) are dropped by Twitch-Eventsub-Message-Id inside the request; parsing
+    and dispatch happen on the ingest worker pool. Messages of a websocket
+    session take the same path from receive().
+    """
+
+    def __init__(self, client, webhook_secret, callback_route, workers=4, queue_size=1000):
+        # Set before web.Application.__init__, which warns about later attributes.
+        self.dedupe = DedupeCache()
+        self.ingest = EventIngest(
+            self._dispatch, workers=workers, maxsize=queue_size, name="eventsub", bot=client.name
+        )
+        super().__init__(client, webhook_secret, callback_route)
+
+    async def listen(self, **kwargs):
+        self.ingest.start()
+        try:
+            await super().listen(**kwargs)
+        finally:
+            await self.ingest.stop()
+
+    async def listen_websocket(self, session):
+        """Receive over an EventSubSession instead of webhooks, until stop()."""
+        self._closing.clear()
+        self.ingest.start()
+        task = asyncio.ensure_future(session.run())
+        try:
+            await self._closing.wait()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await self.ingest.stop()
+
+    async def receive(self, typ, headers, payload):
+        """Queue a message of a websocket session, dropping the ones already seen."""
+        if self.dedupe.seen(headers["Twitch-Eventsub-Message-Id"]):
+            self.ingest.drop_duplicate()
+            return
+        # Nothing is sent again over a websocket, so wait for room rather than drop it.
+        await self.ingest.put((typ, _Delivery(headers), payload))
+
+    def _signed(self, headers, payload):
+        message = headers.get("Twitch-Eventsub-Message-Id", "") + headers.get(
+            "Twitch-Eventsub-Message-Timestamp", ""
+        ) + payload
+        digest = hmac.new(self.secret.encode("utf-8"), message.encode("utf-8"), hashlib.sha256).hexdigest()
+        return hmac.compare_digest("sha256=" + digest, headers.get("Twitch-Eventsub-Message-Signature", ""))
+
+    async def _callback(self, request: web.Request) -> web.Response:
+        payload = await request.text()
+        headers = request.headers
+        typ = headers.get("Twitch-Eventsub-Message-Type", "")
+        if not typ:
+            return web.Response(status=404)
+        if not self._signed(headers, payload):
+            logger.warning("eventsub message with an invalid signature, discarding")
+            return web.Response(status=403)
+        try:
+            sent_at = models._parse_datetime(headers["Twitch-Eventsub-Message-Timestamp"])
+            if datetime.datetime.now(datetime.timezone.utc) - sent_at > MAX_MESSAGE_AGE:
+                return web.Response(status=403)
+        except (KeyError, ValueError):
+            return web.Response(status=400)
+
+        if typ == "webhook_callback_verification":
+            return web.Response(status=200, text=json.loads(payload)["challenge"])
+        if typ not in ("notification", "revocation", "revokation"):
+            logger.warning(f"Unexpected message type: {typ}")
+            return web.Response(status=400)
+
+        message_id = headers["Twitch-Eventsub-Message-Id"]
+        if self.dedupe.seen(message_id):
+            self.ingest.drop_duplicate()
+            return web.Response(status=200)
+        if not self.ingest.offer((typ, _Delivery(headers.copy()), payload)):
+            # Let Twitch redeliver it later instead of losing it.
+            self.dedupe.forget(message_id)
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def _dispatch(self, item):
+        typ, delivery, payload = item
+        if typ == "notification":
+            # The untouched payload, for cogs that store or forward it.
+            self.client.run_event(
+                "eventsub_raw", delivery.headers.get("Twitch-Eventsub-Subscription-Type", ""), payload
+            )
+            event = models.NotificationEvent(self, payload, delivery)
+            name = models.SubscriptionTypes._name_map[event.subscription.type]
+            self.client.run_event(f"eventsub_notification_{name}", event)
+        else:
+            event = models.RevokationEvent(self, payload, delivery)
+            self.client.run_event("eventsub_revokation", event)
+
+
 class Cog(BaseCog):
 
     def __init__(self, bot: Bot, data={}):
         super().__init__(bot, 'eventsub', **data)
-        self.eventsub_client = eventsub.EventSubClient(
+        self.eventsub_client = IngestEventSubClient(
             self.bot,
             self.EVENTSUB_SECRET_WORD,
             self.EVENTSUB_CALLBACK,
+            workers=self.data.get("workers", 4),
+            queue_size=self.data.get("queue_size", 1000),
+        )
+        self.session = None
+        if self.transport == "websocket":
+            self.session = EventSubSession(
+                self.bot,
+                self.eventsub_client.receive,
+                self.session_started,
+                keepalive=self.data.get("keepalive_timeout", KEEPALIVE_TIMEOUT),
+            )
+        self.subscriptions = SubscriptionManager(
+            self.eventsub_client, self.data.get("max_concurrency", MAX_CONCURRENCY), self.session
+        )
+        self.listener = None
+        self.bus_subscription = get_event_bus().subscribe(
+            EventSubNotification, self.log_event, bot=self.bot.name, name=f"{self.bot.name}.eventsub"
         )
 
+    def queue_depths(self):
+        return {"ingest": self.eventsub_client.ingest.depth, "bus": self.bus_subscription.depth}
+
+    async def log_event(self, record):
+        """Log every EventSub notification of the bot."""
+        logger.info("%s in %s: %s", record.kind, record.channel_id, record.event)
+
+    async def sync_subscriptions(self):
+        """Subscribe the configured events for every channel the bot is in."""
+        if self.session is not None and self.session.session_id is None:
+            # Done once the session starts.
+            return
+        user_ids = await get_resolver().resolve(self.bot, self.bot.channels)
+        await self.subscriptions.sync(self.data.get("events", []), list(user_ids.values()))
+
+    async def session_started(self, session_id):
+        """Subscribe again on a new websocket session, which starts with none."""
+        try:
+            await self.sync_subscriptions()
+        except Exception as e:
+            logger.exception(f"eventsub session {session_id} not subscribed: {e!r}")
+
+    async def channels_changed(self):
+        await self.sync_subscriptions()
+
+    async def close(self):
+        # Subscriptions are left in place, so a reloaded cog finds them
+        # already there; ones that fail meanwhile are deleted by its sync.
+        self.bus_subscription.close()
+        self.eventsub_client.stop()
+        if self.listener:
+            await asyncio.gather(self.listener, return_exceptions=True)
+        self.listener = None
+
     def load_config(self):
         self.EVENTSUB_SECRET_WORD = self.data.get('EVENTSUB_SECRET_WORD', 'some_secret_string')
         self.EVENTSUB_CALLBACK = self.data.get('EVENTSUB_CALLBACK', '/callback')
+        self.transport = self.data.get('transport', 'webhook')
+        if self.transport not in TRANSPORTS:
+            raise ValueError(f"unknown eventsub transport {self.transport}, expected one of {', '.join(TRANSPORTS)}")
 
     @commands.Cog.event("event_ready")
     async def is_ready(self):
         logging.info("eventsub cog is ready!")
-        bot = self.bot
-        for channel in bot.channels:
-            for event in self.data.get("events", []):
-                # for user in self.data.get("user_updated_users", []):
-                #    await self.eventsub_client.subscribe_user_updated(user)
-                if event == "channel_raid":
-                    await self.eventsub_client.subscribe_channel_raid(channel)
-                elif event == "channel_ban":
-                    await self.eventsub_client.subscribe_channel_bans(channel)
-                elif event == "channel_unban":
-                    await self.eventsub_client.subscribe_channel_unbans(channel)
-                elif event == "channel_subscription":
-                    await self.eventsub_client.subscribe_channel_subscriptions(channel)
-                elif event == "channel_cheers":
-                    await self.eventsub_client.subscribe_channel_cheers(channel)
-                elif event == "channel_update":
-                    await self.eventsub_client.subscribe_channel_update(channel)
-                elif event == "channel_follow":
-                    await self.eventsub_client.subscribe_channel_follows(channel)
-                elif event == "channel_moderators_add":
-                    await self.eventsub_client.subscribe_channel_moderators_add(channel)
-                elif event == "channel_moderators_remove":
-                    await self.eventsub_client.subscribe_channel_moderators_remove(
-                        channel
-                    )
-                elif event == "channel_hypetrain_begin":
-                    await self.eventsub_client.subscribe_channel_hypetrain_begin(
-                        channel
-                    )
-                elif event == "channel_hypetrain_progress":
-                    await self.eventsub_client.subscribe_channel_hypetrain_progress(
-                        channel
-                    )
-                elif event == "channel_hypetrain_end":
-                    await self.eventsub_client.subscribe_channel_hypetrain_end(channel)
-                elif event == "channel_stream_start":
-                    await self.eventsub_client.subscribe_channel_stream_start(channel)
-                elif event == "channel_stream_end":
-                    await self.eventsub_client.subscribe_channel_stream_end(channel)
-                elif event == "channel_points_reward_added":
-                    await self.eventsub_client.subscribe_channel_points_reward_added(
-                        channel
-                    )
-                elif event == "channel_points_reward_updated":
-                    await self.eventsub_client.subscribe_channel_points_reward_updated(
-                        channel
-                    )
-                elif event == "channel_points_reward_removed":
-                    await self.eventsub_client.subscribe_channel_points_reward_removed(
-                        channel
-                    )
-                elif event == "channel_points_redeemed":
-                    await self.eventsub_client.subscribe_channel_points_redeemed(
-                        channel
-                    )
-                elif event == "channel_points_redeem_updated":
-                    await self.eventsub_client.subscribe_channel_points_redeem_updated(
-                        channel
-                    )
-        port = self.data.get("port", "15543")
-        logging.info(f"eventsub listening on port {port}")
-        self.bot.loop.create_task(self.eventsub_client.listen(port=port))
-
-        @bot.event()
-        async def eventsub_notification_user_update(payload: eventsub.UserUpdateData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_raid(payload: eventsub.ChannelRaidData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_bans(payload: eventsub.ChannelBanData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_unbans(payload: eventsub.ChannelUnbanData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_subscription(
-            payload: eventsub.ChannelSubscribeData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_cheer(payload: eventsub.ChannelCheerData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_update(payload: eventsub.ChannelUpdateData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_follow(payload: eventsub.ChannelFollowData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_moderator_add(
-            payload: eventsub.ChannelModeratorAddRemoveData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_moderator_remove(
-            payload: eventsub.ChannelModeratorAddRemoveData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_hypetrain_begin(
-            payload: eventsub.HypeTrainBeginProgressData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_hypetrain_progress(
-            payload: eventsub.HypeTrainBeginProgressData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_hypetrain_end(
-            payload: eventsub.HypeTrainEndData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_stream_start(
-            payload: eventsub.StreamOnlineData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_stream_end(payload: eventsub.StreamOfflineData):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_channel_reward_add(
-            payload: eventsub.CustomRewardAddUpdateRemoveData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_channel_reward_update(
-            payload: eventsub.CustomRewardAddUpdateRemoveData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_channel_reward_remove(
-            payload: eventsub.CustomRewardAddUpdateRemoveData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_channel_reward_redeem(
-            payload: eventsub.CustomRewardRedemptionAddUpdateData,
-        ):
-            pass
-
-        @bot.event()
-        async def eventsub_notification_channel_reward_redeem_updated(
-            payload: eventsub.CustomRewardRedemptionAddUpdateData,
-        ):
-            pass
+        if self.listener is None or self.listener.done():
+            if self.session is not None:
+                logging.info("eventsub connecting to its websocket session")
+                self.listener = self.bot.loop.create_task(self.eventsub_client.listen_websocket(self.session))
+            else:
+                # Listen first: Twitch verifies each new webhook subscription right away.
+                port = self.data.get("port", "15543")
+                logging.info(f"eventsub listening on port {port}")
+                self.listener = self.bot.loop.create_task(self.eventsub_client.listen(port=port))
+        await self.sync_subscriptions()
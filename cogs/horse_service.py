@@ -4,7 +4,7 @@
 
 from bots.bot import Bot
 from twitchio.ext import commands
-from .base import BaseCog
+from .base import BaseCog, cooldown
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,10 +14,13 @@ class Cog(BaseCog):
     def __init__(self, bot: Bot, data={}):
         super().__init__(bot, 'horse_service', **data)
 
+    # Raids would otherwise have the bot replying to every viewer at once.
     @commands.command()
+    @cooldown(1, 30, "user")
+    @cooldown(5, 30, "channel")
     async def horse(self, ctx: commands.Context):
         """horse."""
-        await ctx.send(f"{ctx.author.name}.horse")
+        self.bot.say(ctx.channel.name, f"{ctx.author.name}.horse", lane="fun")
 
     @commands.Cog.event("event_ready")
     async def is_ready(self):
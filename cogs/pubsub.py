@@ -2,88 +2,123 @@
 
 """The PubSub cog example."""
 
+import json
 import os
 import logging
+from bots.bot import Bot
+from bots.eventbus import PubSubEvent, get_event_bus
+from bots.resolver import get_resolver
+from twitchio import PartialUser
 from twitchio.ext import commands, pubsub
-from .base import Cog
+from twitchio.ext.pubsub import models
+from .base import BaseCog
 
 logger = logging.getLogger(__name__)
 
+class PubSubBitsMessage(models.PubSubBitsMessage):
+    """twitchio's bits message, read from a bits v2 message as Twitch sends it.
+
+    twitchio 2.1.5 looks for the fields on the frame instead of its message,
+    reads the badge entitlement's previous version under another name and
+    takes the message id, a UUID, for a number.
+    """
+
+    def __init__(self, client, topic, data):
+        models.PubSubMessage.__init__(self, client, topic, data)
+        message = data["message"]
+        bits = message["data"]
+        self.message = models.PubSubChatMessage.__new__(models.PubSubChatMessage)
+        self.message.content = bits.get("chat_message")
+        self.message.id = message["message_id"]
+        self.message.type = message["message_type"]
+        badge = bits.get("badge_entitlement")
+        self.badge_entitlement = (
+            models.PubSubBadgeEntitlement(badge["new_version"], badge["previous_version"]) if badge else None
+        )
+        self.bits_used = bits["bits_used"]
+        self.channel_id = int(bits["channel_id"])
+        self.context = bits.get("context")
+        self.anonymous = bits.get("is_anonymous", False)
+        self.user = PartialUser(client._http, bits["user_id"], bits["user_name"]) if bits.get("user_id") else None
+        self.version = message["version"]
+
+
+class PubSubBitsBadgeMessage(models.PubSubBitsBadgeMessage):
+    """twitchio's bits badge message, whose fields it looks for on the frame instead of its message."""
+
+    def __init__(self, client, topic, data):
+        super().__init__(client, topic, {**data, **data["message"]})
+
+
+# Topics whose twitchio 2.1.5 models can't read what Twitch sends.
+MODELS = {
+    "channel-bits-events-v2": PubSubBitsMessage,
+    "channel-bits-badge-unlocks": PubSubBitsBadgeMessage,
+}
+
+
+class PubSubWebsocket(pubsub.PubSubWebsocket):
+    """PubSubWebsocket that builds the typed events from messages as Twitch sends them.
+
+    twitchio 2.1.5 fails on every bits and bits badge message, and on topics
+    it has no model for (subscriptions, whispers), in a task nobody awaits.
+    The latter get the generic pubsub_message event only.
+    """
+
+    async def handle_message(self, message):
+        data = message["data"]
+        data["message"] = json.loads(data["message"])
+        self.client.run_event("pubsub_message", models.PubSubMessage(self.client, data["topic"], data["message"]))
+        topic = data["topic"].split(".")[0]
+        event, model = models._mapping.get(topic, (None, None))
+        model = MODELS.get(topic, model)
+        if model is not None:
+            self.client.run_event(event, model(self.client, topic, data))
+
+
+class PubSubPool(pubsub.PubSubPool):
+    """PubSubPool connecting with the PubSubWebsocket above."""
+
+    async def subscribe_topics(self, topics):
+        node = self._find_node(topics)
+        if node is None:
+            node = PubSubWebsocket(self.client, max_topics=self._max_connection_topics)
+            await node.connect()
+        await node.subscribe_topics(topics)
+        self._topics.update({t: node for t in topics})
+
 
 class Cog(BaseCog):
 
     def __init__(self, bot: Bot, data={}):
         super().__init__(bot, 'pubsub', **data)
-        self.bot.pubsub = pubsub.PubSubPool(self.bot)
+        self.bot.pubsub = PubSubPool(self.bot)
+        # Survives reconnects, so event_ready only subscribes what is new.
+        self.subscribed = set()
+        self.bus_subscription = get_event_bus().subscribe(
+            PubSubEvent, self.log_event, bot=self.bot.name, name=f"{self.bot.name}.pubsub"
+        )
 
-    @commands.Cog.event("event_ready")
-    async def is_ready(self):
-        logging.info("pubsub cog is ready!")
-        bot = self.bot
-
-        @bot.event()
-        async def event_pubsub_bits(event: pubsub.PubSubBitsMessage):
-            logging.info(
-                f"{event.user.name} donated {event.bits_used} bits - "
-                f'"{event.message}" and received {event.badge_entitlement}'
-            )
-
-        @bot.event()
-        async def event_pubsub_bits_badge(event: pubsub.PubSubBitsBadgeMessage):
-            logging.info(
-                f"{event.user.name} received badge level - "
-                f"{event.badge_tier} in {event.channel.name}"
-            )
-
-        @bot.event()
-        async def event_pubsub_channel_points(event: pubsub.PubSubChannelPointsMessage):
-            logging.info(
-                f"{event.user.name} redeemed {event.reward.title}"
-                f"args({event.input}) "
-                f"in {event.channel_id} using channel points"
-                f"(id:{event.id})"
-            )
-
-        @bot.event()
-        async def event_pubsub_moderation_user_action(event):
-            if type(event) == pubsub.PubSubModerationActionBanRequest:
-                logging.info(
-                    f"{event.created_by.name} targeted {event.target.name} "
-                    f"with {event.action}({event.args})"
-                )
-            elif type(event) == pubsub.PubSubModerationActionChannelTerms:
-                logging.info(
-                    f"{event.requester.name} requested channel terms update of"
-                    f" type {event.type} to {event.id}:{event.text} "
-                    f"in {event.channel_id}"
-                )
-            elif type(event) == pubsub.PubSubModerationActionModeratorAdd:
-                logging.info(
-                    f"{event.created_by.name} targeted {event.target.name} "
-                    f"with {event.moderation_action} in {event.channel_id}"
-                )
-            elif type(event) == pubsub.PubSubModerationAction:
-                logging.info(
-                    f"{event.created_by.name} targeted {event.target.name} "
-                    f"with {event.action}({event.args}): "
-                    f"message({event.message_id}), "
-                    f"automod({event.from_automod})"
-                )
-
-        # The following two events are mentioned in docs but not supported
-        @bot.event()
-        async def event_pubsub_channel_subscriptions(event):
-            logging.info("channel subscription: {event}")
-
-        @bot.event()
-        async def event_pubsub_whispers(event):
-            logging.info("whispers: {event}")
-
-        for channel in self.bot.channels:
+    def queue_depths(self):
+        return {"bus": self.bus_subscription.depth}
+
+    async def log_event(self, record):
+        """Log every PubSub message of the bot."""
+        # Arguments are passed separately so that records dropped by the
+        # log sink's sampling are never formatted.
+        logger.info("%s in %s: %s", record.kind, record.channel_id, record.data.get("data"))
+
+    def build_topics(self, channel_ids):
+        """The distinct topics to subscribe to for every resolved channel.
+
+        Not named topics: BaseCog sets the configured `topics` list as an attribute.
+        """
+        topics = []
+        moderators = [
+            int(mod_id) for mod_id in os.environ.get("MODERATORS", "").strip().split(",") if mod_id
+        ]
+        for channel, channel_id in channel_ids.items():
             token = os.environ.get(f"{channel.upper()}_PUBSUB_TOKEN", "")
-            channel_details = await self.bot.fetch_channel(channel)
-            channel_id = channel_details.user.id
-            topics = []
             for topic in self.data.get("topics", []):
                 if topic == "channel_points":
                     topics.append(pubsub.channel_points(token)[channel_id])
@@ -96,11 +131,53 @@ class Cog(BaseCog):
                     topics.append(
                         pubsub.channel_subscriptions(self.bot.access_token)[channel_id]
                     )
-                elif topic == "whispers":
-                    topics.append(pubsub.whispers(self.bot.access_token))
-                for mod_id in os.environ.get("MODERATORS", "").strip().split(","):
-                    if mod_id:
-                        topics.append(
-                            pubsub.moderation_user_action(token)[channel_id][mod_id]
-                        )
-        self.bot.loop.create_task(self.bot.pubsub.subscribe_topics(topics))
+                elif topic == "whispers" and self.bot.user_id:
+                    topics.append(pubsub.whispers(self.bot.access_token)[int(self.bot.user_id)])
+            for mod_id in moderators:
+                topics.append(pubsub.moderation_user_action(token)[channel_id][mod_id])
+        # Topics hash by their topic string; keep the first of each.
+        return list(dict.fromkeys(topics))
+
+    @commands.Cog.event("event_ready")
+    async def is_ready(self):
+        logger.info("pubsub cog is ready!")
+        await self.sync_topics()
+
+    async def sync_topics(self):
+        """Subscribe the topics of new channels and unsubscribe those of parted ones."""
+        channel_ids = await get_resolver().resolve(self.bot, self.bot.channels)
+        wanted = self.build_topics(channel_ids)
+        stale = list(self.subscribed.difference(wanted))
+        if stale:
+            await self.unsubscribe(stale)
+        topics = [topic for topic in wanted if topic not in self.subscribed]
+        if topics:
+            await self.bot.pubsub.subscribe_topics(topics)
+            self.subscribed.update(topics)
+
+    async def channels_changed(self):
+        await self.sync_topics()
+
+    async def unsubscribe(self, topics):
+        """UNLISTEN topics and close connections left with none.
+
+        PubSubPool.unsubscribe_topics can't be used: in twitchio 2.1.5 it sends
+        an empty UNLISTEN and fails on connections it never added to its pool.
+        """
+        pool = self.bot.pubsub
+        nodes = {}
+        for topic in topics:
+            nodes.setdefault(pool._topics.pop(topic), []).append(topic)
+        for node, node_topics in nodes.items():
+            await node.unsubscribe_topic(node_topics)
+            if not node.topics:
+                node._closing = True  # or its poll task reconnects
+                await node.disconnect()
+                if node.session:
+                    await node.session.close()
+        self.subscribed.difference_update(topics)
+
+    async def close(self):
+        self.bus_subscription.close()
+        if self.subscribed:
+            await self.unsubscribe(list(self.subscribed))
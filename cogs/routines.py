@@ -1,67 +1,80 @@
 # Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
 
-"""An example of routines."""
+"""Messages said on a schedule, configured in bots.yaml.
 
-import datetime
-import logging
-from twitchio.ext import commands, routines
-from .base import Cog
+    cogs:
+      routines:
+        jobs:
+          hydrate:
+            every: 1800            # seconds
+            say: "Remember to drink some water!"
+          happy_birthday:
+            cron: "30 8 5 5 *"     # minute hour day month weekday, local time
+            jitter: 60             # seconds of random delay, spreads out bots on one schedule
+            catch_up: all          # skip, once (default) or all runs missed while down
+            channels: [AnonymousUser]  # defaults to every channel of the bot
+            say: "Happy birthday!"
 
-logger = logging.getLogger(__name__)
+Every job of every bot runs from the one scheduler of the process, see
+bots/scheduler.py, which also remembers when each job is next due across
+restarts.
+"""
 
-# This is intended as an example of how one could implement routines in a Cog.
-# Let it serve as a repository of shared routines, important dates too.
+import logging
+import time
 
-# I do not recommend adding this cog directly, but making a copy and modifying
-# it, or borrowing from it whatever routines you want.
+from twitchio.ext import commands
 
-class Cog(BaseCog):
+from bots.scheduler import Job, get_scheduler, schedule
 
-    def __init__(self, bot, data={}):
-        super().__init__(bot, 'routines', **data)
-        self.hello.start()
-        self.happy_birthday.start()
+from .base import BaseCog
 
-    @routines.routine(minutes=10)
-    async def hello(arg: str):
-        """hello."""
-        logger.info("This is routines_bot!")
-        raise RuntimeWarning("I enjoy attention")
+logger = logging.getLogger(__name__)
 
-    # This function will run prior to !hello
-    @hello.before_routine
-    async def hello_before(arg: str):
-        """pre-hello."""
-        logger.info("I am run before !hello")
 
-    # This will only run following errors raised by !hello
-    @hello.error
-    async def hello_on_error(error: Exception):
-        """on-error in hello."""
-        logger.info(f"Hello routine raised: {error}.")
+class Cog(BaseCog):
+    def __init__(self, bot, data={}):
+        super().__init__(bot, 'routines', **data)
+        self.jobs = self.data.get("jobs") or {}
+        self.scheduler = get_scheduler()
+        self.scheduled = []
+        for name, config in self.jobs.items():
+            try:
+                if "say" not in config:
+                    raise ValueError("a job needs a say message")
+                job = Job(
+                    f"{bot.name}.{name}",
+                    schedule(config),
+                    self.runner(name, config),
+                    jitter=float(config.get("jitter", 0)),
+                    catch_up=config.get("catch_up", "once"),
+                )
+            except (ValueError, TypeError) as e:
+                logger.error(f"{bot.name}: routine {name} not scheduled: {e}")
+                continue
+            self.scheduled.append(job)
 
-    # https://twitchio.readthedocs.io/en/latest/exts/routines.html
-    # This routine will run at the same time everyday. If a naive datetime is
-    # provided, your system local time is used.
+    @commands.Cog.event("event_ready")
+    async def is_ready(self):
+        """Schedule the jobs on the first ready; reconnects leave them be."""
+        for job in self.scheduled:
+            if self.scheduler.jobs.get(job.key) is not job:
+                self.scheduler.add(job)
+                logger.info(f"routine {job.key}, {job.schedule}, next at {time.ctime(job.due)}")
 
-    # The below example shows a routine which will first be ran on the 1st,
-    # June 2021 at 9:30am system local time. It will then be ran every 24 hours
-    # after the initial date, until stopped.
+    def runner(self, name, config):
+        """The callback of job name, saying its message in its channels."""
 
-    # If the date has already passed, the routine will run at the next
-    # specified time. For example: If today was the 2nd, June 2021 8:30am and
-    # your datetime was scheduled to run on the 1st, June 2021 at 9:30am, you
-    # routine will first run on 2nd, June 2021 at 9:30am.
+        async def run():
+            channels = config.get("channels") or self.bot.channels
+            for channel in channels:
+                self.bot.say(channel.lstrip("#").lower(), config["say"], lane="fun")
+            logger.debug(f"{self.bot.name}: routine {name} said in {len(channels)} channels")
 
-    # In simpler terms, datetimes in the past only care about the time, not the
-    # date. This can be useful when scheduling routines that don’t need to be
-    # started on a specific date.
-    @routines.routine(
-        time=datetime.datetime(year=2021, month=5, day=5, hour=8, minute=30)
-    )
-    async def happy_birthday(arg: str):
-        """happy_birthday."""
-        logger.info(f"Hello {arg}!")
+        return run
 
-    # Shout out your discord or other social media
-    # @routines.routine(hours=1)
+    async def close(self):
+        """Stop this bot's jobs; they resume from their saved next run if loaded again."""
+        for job in self.scheduled:
+            if self.scheduler.jobs.get(job.key) is job:
+                self.scheduler.remove(job.key)
@@ -0,0 +1,191 @@
+"""
+Shared OAuth callback server
+----------------------------
+
+One aiohttp application, running on the caller's event loop, that receives the OAuth redirects of every
+:class:`~oauth.user.UserAuthenticator` in the process. Each pending authorization registers its :code:`state`
+parameter and gets a future that is resolved with the authorization code when Twitch redirects the user back.
+
+Configured with :meth:`CallbackServer.configure`, every bot uses the same redirect URL, which is registered as
+the "OAuth Redirect URL" of each app, and the server listens on its one port. Otherwise each bot's redirect is
+:code:`http://localhost:<auth_port>` and the server listens on all of those ports, but all sites share the same
+application and pending table.
+"""
+import asyncio
+import urllib.parse
+from logging import getLogger
+from typing import Dict, Tuple, Union
+
+from oauth.user import TwitchAuthorizationException
+
+
+class CallbackServer:
+    """Routes OAuth redirects to per-authorization futures by their :code:`state`
+
+    :param str host: the host the webserver will bind to. |default| :code:`0.0.0.0`
+    :param str path: the path of the redirect URL. |default| :code:`/`
+    """
+
+    document: str = """<!DOCTYPE html>
+ <html lang="en">
+ <head>
+     <meta charset="UTF-8">
+     <title>Twitch-Creamery OAuth</title>
+ </head>
+ <body>
+     <h1>Thanks for Authenticating!</h1>
+ You may now close this page.
+ </body>
+ </html>"""
+
+    def __init__(self, host: str = "0.0.0.0", path: str = "/"):
+        self.host = host
+        self.path = path
+        self.redirect_uri: Union[str, None] = None
+        self.port: Union[int, None] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._sites: Dict[int, "web.TCPSite"] = {}
+        self._runner: Union["web.AppRunner", None] = None
+        self._lock: Union[asyncio.Lock, None] = None
+        self._logger = getLogger("twitchAPI.oauth")
+
+    def configure(self, redirect_uri: str, port: Union[int, str, None] = None):
+        """Use one redirect URL for every authorization instead of one port per bot
+
+        Call before any authorization starts; the path of the URL is served from then on.
+
+        :param str redirect_uri: the "OAuth Redirect URL" registered with every bot's app
+        :param port: the port to listen on, when it differs from the URL's, e.g. behind a reverse proxy.
+                    |default| the port of :code:`redirect_uri`
+        :rtype: None
+        """
+        url = urllib.parse.urlsplit(redirect_uri)
+        self.redirect_uri = redirect_uri
+        self.port = int(port or url.port or (443 if url.scheme == "https" else 80))
+        self.path = url.path or "/"
+
+    def redirect(self, auth_port: Union[int, str, None] = None) -> Tuple[str, int]:
+        """The redirect URL of an authorization and the port it is received on
+
+        :param auth_port: the bot's own port, used when no redirect URL is configured
+        :raises ValueError: if there is neither
+        :rtype: (str, int)
+        """
+        if self.redirect_uri:
+            return self.redirect_uri, self.port
+        if auth_port is None:
+            raise ValueError("no OAuth redirect: set oauth.redirect_uri in bots.yaml, or the bot's auth_port")
+        return f"http://localhost:{auth_port}", int(auth_port)
+
+    @property
+    def pending(self) -> int:
+        """Number of authorizations still waiting for their redirect"""
+        return len(self._pending)
+
+    async def listen(self, port: Union[int, str]):
+        """Make sure the server accepts redirects on the given port
+
+        The server stops by itself once no authorization is pending, so register the flow with
+        :meth:`expect` before calling this.
+
+        :param port: the port of the redirect URL
+        :rtype: None
+        """
+        from aiohttp import web
+
+        port = int(port)
+        async with self._get_lock():
+            if port in self._sites:
+                return
+            if self._runner is None:
+                app = web.Application()
+                app.add_routes([web.get(self.path, self._handle_callback)])
+                self._runner = web.AppRunner(app)
+                await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, port)
+            await site.start()
+            self._sites[port] = site
+        self._logger.info(f"oauth callback server listening on port {port}")
+
+    async def stop(self):
+        """Stop listening and fail every pending authorization
+
+        :rtype: None
+        """
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+        await self._stop_if_idle()
+
+    async def _stop_if_idle(self):
+        async with self._get_lock():
+            if self._pending or self._runner is None:
+                return
+            self._sites.clear()
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def expect(self, state: str) -> asyncio.Future:
+        """Register an authorization and return the future resolved with its code
+
+        :param str state: the :code:`state` sent in the authorization URL
+        :rtype: :class:`~asyncio.Future`
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending[state] = future
+        return future
+
+    async def wait_for_code(self, state: str, timeout: Union[float, None] = None) -> str:
+        """Wait for the redirect of the authorization registered with :meth:`expect`
+
+        :param str state: the :code:`state` sent in the authorization URL
+        :param float timeout: seconds to wait for the user, forever if :code:`None`
+        :raises ~oauth.user.TwitchAuthorizationException: if the user declined the authorization
+        :rtype: str
+        """
+        future = self._pending.get(state) or self.expect(state)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(state, None)
+            await self._stop_if_idle()
+
+    async def _handle_callback(self, request: "web.Request"):
+        from aiohttp import web
+
+        state = request.rel_url.query.get("state")
+        self._logger.debug(f"got callback with state {state}")
+        future = self._pending.get(state)
+        # invalid or unknown state!
+        if future is None or future.done():
+            return web.Response(status=401)
+        error = request.rel_url.query.get("error")
+        if error is not None:
+            description = request.rel_url.query.get("error_description", error)
+            future.set_exception(TwitchAuthorizationException(description))
+            return web.Response(status=400, text=description)
+        code = request.rel_url.query.get("code")
+        if code is None:
+            # must provide code
+            return web.Response(status=400)
+        future.set_result(code)
+        return web.Response(text=self.document, content_type="text/html")
+
+
+__callback_server: Union[CallbackServer, None] = None
+
+
+def get_callback_server() -> CallbackServer:
+    """Returns the process-wide callback server
+
+    :rtype: :class:`CallbackServer`"""
+    global __callback_server
+    if __callback_server is None:
+        __callback_server = CallbackServer()
+    return __callback_server
@@ -57,11 +57,10 @@ import uuid
 from typing import List, Union
 from enum import Enum
 import webbrowser
-from aiohttp import web
 import asyncio
-from threading import Thread
+from threading import Event, Thread
 from time import sleep
-import requests
+import httpx
 from concurrent.futures._base import CancelledError
 from logging import getLogger, Logger
 import urllib.parse
@@ -69,6 +68,15 @@ import urllib.parse
 
 TWITCH_AUTH_BASE_URL = "https://id.twitch.tv/"
 
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+HTTP_RETRIES = 3
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+
+__sync_client: Union[httpx.Client, None] = None
+__async_client: Union[httpx.AsyncClient, None] = None
+__async_client_loop: Union["asyncio.AbstractEventLoop", None] = None
+
 
 class TwitchAPIException(Exception):
     """Base Twitch API Exception"""
@@ -153,27 +161,89 @@ def get_uuid():
     return uuid.uuid4()
 
 
-def refresh_access_token(refresh_token: str, app_id: str, app_secret: str):
-    """Simple helper function for refreshing a user access token.
+def get_sync_client() -> httpx.Client:
+    """Returns the pooled keep-alive client used by the blocking helpers
 
-    :param str refresh_token: the current refresh_token
-    :param str app_id: the id of your app
-    :param str app_secret: the secret key of your app
-    :return: access_token, refresh_token
-    :raises ~twitchAPI.types.InvalidRefreshTokenException: if refresh token is invalid
-    :raises ~twitchAPI.types.UnauthorizedException: if both refresh and access token are invalid (eg if the user changes
-                their password of the app gets disconnected)
-    :rtype: (str, str)
-    """
+    :rtype: :class:`~httpx.Client`"""
+    global __sync_client
+    if __sync_client is None or __sync_client.is_closed:
+        __sync_client = httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_POOL_LIMITS)
+    return __sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the pooled keep-alive client used by the async helpers.
+
+    The client is bound to the running event loop and is replaced when called from another loop.
+
+    :rtype: :class:`~httpx.AsyncClient`"""
+    global __async_client, __async_client_loop
+    loop = asyncio.get_running_loop()
+    if __async_client is None or __async_client.is_closed or __async_client_loop is not loop:
+        __async_client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_POOL_LIMITS)
+        __async_client_loop = loop
+    return __async_client
+
+
+async def close_async_client():
+    """Closes the pooled async client, if any
+
+    :rtype: None"""
+    global __async_client, __async_client_loop
+    if __async_client is not None:
+        await __async_client.aclose()
+    __async_client = None
+    __async_client_loop = None
+
+
+def _retry_delay(attempt: int, response: Union[httpx.Response, None]) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return 0.5 * 2 ** attempt
+
+
+def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Blocking request on the pooled client, retrying transport errors and retryable statuses"""
+    for attempt in range(HTTP_RETRIES + 1):
+        response = None
+        try:
+            response = get_sync_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == HTTP_RETRIES:
+                raise
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+        sleep(_retry_delay(attempt, response))
+
+
+async def _request_async(method: str, url: str, **kwargs) -> httpx.Response:
+    """Async request on the pooled client, retrying transport errors and retryable statuses"""
+    for attempt in range(HTTP_RETRIES + 1):
+        response = None
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == HTTP_RETRIES:
+                raise
+        else:
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_RETRIES:
+                return response
+        await asyncio.sleep(_retry_delay(attempt, response))
+
+
+def _refresh_request(refresh_token: str, app_id: str, app_secret: str):
     param = {
         "refresh_token": refresh_token,
         "client_id": app_id,
         "grant_type": "refresh_token",
         "client_secret": app_secret,
     }
-    url = build_url(TWITCH_AUTH_BASE_URL + "oauth2/token", {})
-    result = requests.post(url, data=param)
-    data = result.json()
+    return build_url(TWITCH_AUTH_BASE_URL + "oauth2/token", {}), param
+
+
+def _refresh_result(data: dict):
     if data.get("status", 200) == 400:
         raise InvalidRefreshTokenException(data.get("message", ""))
     if data.get("status", 200) == 401:
@@ -181,6 +251,104 @@ def refresh_access_token(refresh_token: str, app_id: str, app_secret: str):
     return data["access_token"], data["refresh_token"]
 
 
+def _app_token_request(app_id: str, app_secret: str):
+    param = {
+        "client_id": app_id,
+        "client_secret": app_secret,
+        "grant_type": "client_credentials",
+    }
+    return build_url(TWITCH_AUTH_BASE_URL + "oauth2/token", {}), param
+
+
+def _app_token_result(data: dict):
+    if "access_token" not in data:
+        raise UnauthorizedException(data.get("message", ""))
+    return data["access_token"], data.get("expires_in", 0)
+
+
+def _validate_request(access_token: str):
+    header = {"Authorization": f"OAuth {access_token}"}
+    return build_url(TWITCH_AUTH_BASE_URL + "oauth2/validate", {}), header
+
+
+def _revoke_request(client_id: str, access_token: str):
+    return build_url(
+        TWITCH_AUTH_BASE_URL + "oauth2/revoke",
+        {"client_id": client_id, "token": access_token},
+    )
+
+
+async def refresh_access_token_async(refresh_token: str, app_id: str, app_secret: str):
+    """Async version of :func:`refresh_access_token` on the pooled keep-alive client.
+
+    :param str refresh_token: the current refresh_token
+    :param str app_id: the id of your app
+    :param str app_secret: the secret key of your app
+    :return: access_token, refresh_token
+    :raises ~twitchAPI.types.InvalidRefreshTokenException: if refresh token is invalid
+    :raises ~twitchAPI.types.UnauthorizedException: if both refresh and access token are invalid
+    :rtype: (str, str)
+    """
+    url, param = _refresh_request(refresh_token, app_id, app_secret)
+    result = await _request_async("POST", url, data=param)
+    return _refresh_result(result.json())
+
+
+async def get_app_token_async(app_id: str, app_secret: str):
+    """Get an app access token with the client credentials grant, on the pooled keep-alive client.
+
+    :param str app_id: the id of your app
+    :param str app_secret: the secret key of your app
+    :return: access_token, seconds until it expires
+    :raises ~twitchAPI.types.UnauthorizedException: if the app id or secret is invalid
+    :rtype: (str, int)
+    """
+    url, param = _app_token_request(app_id, app_secret)
+    result = await _request_async("POST", url, data=param)
+    return _app_token_result(result.json())
+
+
+async def validate_token_async(access_token: str) -> dict:
+    """Async version of :func:`validate_token` on the pooled keep-alive client.
+
+    :param str access_token: either a user or app OAuth access token
+    :return: response from the api
+    :rtype: dict
+    """
+    url, header = _validate_request(access_token)
+    result = await _request_async("GET", url, headers=header)
+    return result.json()
+
+
+async def revoke_token_async(client_id: str, access_token: str) -> bool:
+    """Async version of :func:`revoke_token` on the pooled keep-alive client.
+
+    :param str client_id: client id belonging to the access token
+    :param str access_token: user or app OAuth access token
+    :rtype: bool
+    :return: :code:`True` if revoking succeeded, otherwise :code:`False`
+    """
+    result = await _request_async("POST", _revoke_request(client_id, access_token))
+    return result.status_code == 200
+
+
+def refresh_access_token(refresh_token: str, app_id: str, app_secret: str):
+    """Simple helper function for refreshing a user access token.
+
+    :param str refresh_token: the current refresh_token
+    :param str app_id: the id of your app
+    :param str app_secret: the secret key of your app
+    :return: access_token, refresh_token
+    :raises ~twitchAPI.types.InvalidRefreshTokenException: if refresh token is invalid
+    :raises ~twitchAPI.types.UnauthorizedException: if both refresh and access token are invalid (eg if the user changes
+                their password of the app gets disconnected)
+    :rtype: (str, str)
+    """
+    url, param = _refresh_request(refresh_token, app_id, app_secret)
+    result = _request("POST", url, data=param)
+    return _refresh_result(result.json())
+
+
 def validate_token(access_token: str) -> dict:
     """Helper function for validating a user or app access token.
 
@@ -190,9 +358,8 @@ def validate_token(access_token: str) -> dict:
     :return: response from the api
     :rtype: dict
     """
-    header = {"Authorization": f"OAuth {access_token}"}
-    url = build_url(TWITCH_AUTH_BASE_URL + "oauth2/validate", {})
-    result = requests.get(url, headers=header)
+    url, header = _validate_request(access_token)
+    result = _request("GET", url, headers=header)
     return result.json()
 
 
@@ -206,11 +373,7 @@ def revoke_token(client_id: str, access_token: str) -> bool:
     :rtype: bool
     :return: :code:`True` if revoking succeeded, otherwise :code:`False`
     """
-    url = build_url(
-        TWITCH_AUTH_BASE_URL + "oauth2/revoke",
-        {"client_id": client_id, "token": access_token},
-    )
-    result = requests.post(url)
+    result = _request("POST", _revoke_request(client_id, access_token))
     return result.status_code == 200
 
 
@@ -224,6 +387,9 @@ class UserAuthenticator:
     :param str url: The reachable URL that will be opened in the browser.
                 |default| :code:`http://localhost:17563`
 
+    :param ~oauth.callback.CallbackServer callback_server: shared server receiving the redirect in
+                :meth:`authenticate_async` instead of a dedicated server thread |default| :code:`None`
+
     :var int port: The port that will be used. |default| :code:`17653`
     :var str host: the host the webserver will bind to. |default| :code:`0.0.0.0`
     """
@@ -245,7 +411,7 @@ class UserAuthenticator:
     host: str = "0.0.0.0"
     scopes: List[str] = []
     force_verify: bool = False
-    __state: str = str(get_uuid())
+    __state: str = None
     __logger: Logger = None
 
     __client_id: str = None
@@ -260,6 +426,7 @@ class UserAuthenticator:
     __user_token: Union[str, None] = None
 
     __can_close: bool = False
+    __closing: Union["asyncio.Event", None] = None
 
     def __init__(
         self,
@@ -269,6 +436,7 @@ class UserAuthenticator:
         force_verify: bool = False,
         url: str = "http://localhost:18951",
         port: str = "18951",
+        callback_server=None,
     ):
         self.__client_id = app_id
         self.__client_secret = app_secret
@@ -277,6 +445,11 @@ class UserAuthenticator:
         self.__logger = getLogger("twitchAPI.oauth")
         self.url = url
         self.port = port
+        self.callback_server = callback_server
+        # every flow needs its own state so a shared callback server can route it
+        self.__state = str(get_uuid())
+        self.__server_started = Event()
+        self.__user_token_received = Event()
 
     def __build_auth_url(self):
         params = {
@@ -290,32 +463,33 @@ class UserAuthenticator:
         return build_url(TWITCH_AUTH_BASE_URL + "oauth2/authorize", params)
 
     def __build_runner(self):
+        from aiohttp import web
+
         app = web.Application()
         app.add_routes([web.get("/", self.__handle_callback)])
         return web.AppRunner(app)
 
-    async def __run_check(self):
-        while not self.__can_close:
-            try:
-                await asyncio.sleep(1)
-            except (CancelledError, asyncio.CancelledError):
-                pass
-        for task in asyncio.all_tasks(self.__loop):
-            task.cancel()
-
     def __run(self, runner: "web.AppRunner"):
+        from aiohttp import web
+
         self.__runner = runner
         self.__loop = asyncio.new_event_loop()
         asyncio.set_event_loop(self.__loop)
+        self.__closing = asyncio.Event()
         self.__loop.run_until_complete(runner.setup())
         site = web.TCPSite(runner, self.host, self.port)
         self.__loop.run_until_complete(site.start())
         self.__server_running = True
+        self.__server_started.set()
         self.__logger.info("running oauth Webserver")
         try:
-            self.__loop.run_until_complete(self.__run_check())
+            if not self.__can_close:
+                self.__loop.run_until_complete(self.__closing.wait())
+            self.__loop.run_until_complete(runner.cleanup())
         except (CancelledError, asyncio.CancelledError):
             pass
+        finally:
+            self.__loop.close()
 
     def __start(self):
         self.__thread = Thread(target=self.__run, args=(self.__build_runner(),))
@@ -327,8 +501,12 @@ class UserAuthenticator:
         :rtype: None
         """
         self.__can_close = True
+        if self.__loop is not None and self.__closing is not None and not self.__loop.is_closed():
+            self.__loop.call_soon_threadsafe(self.__closing.set)
 
     async def __handle_callback(self, request: "web.Request"):
+        from aiohttp import web
+
         val = request.rel_url.query.get("state")
         self.__logger.debug(f"got callback with state {val}")
         # invalid state!
@@ -338,6 +516,7 @@ class UserAuthenticator:
         if self.__user_token is None:
             # must provide code
             return web.Response(status=400)
+        self.__user_token_received.set()
         if self.__callback_func is not None:
             self.__callback_func(self.__user_token)
         return web.Response(text=self.__document, content_type="text/html")
@@ -360,18 +539,54 @@ class UserAuthenticator:
         self.__callback_func = callback_func
 
         if user_token is None:
-            self.__start()
-            # wait for the server to start up
-            while not self.__server_running:
-                sleep(0.01)
-            # open in browser
-            webbrowser.open(self.__build_auth_url(), new=2)
-            while self.__user_token is None:
-                sleep(0.01)
-            # now we need to actually get the correct token
+            self.__wait_for_user_token()
         else:
             self.__user_token = user_token
 
+        url = self.__build_token_url()
+        data: dict = _request("POST", url).json()
+        return self.__finish(data, callback_func, user_token)
+
+    async def authenticate_async(self, callback_func=None, user_token=None):
+        """Async version of :meth:`authenticate`.
+
+        The token exchange runs on the pooled async client, so waiting for the user and talking to Twitch
+        never blocks the calling event loop. With a :code:`callback_server` the redirect is received by that
+        shared server on this loop, letting any number of flows run at once without server threads.
+
+        :param callback_func: Function to call once the authentication finished.
+        :param str user_token: Code obtained from twitch to request the access and refresh token.
+        :return: None if callback_func is set, otherwise access_token and refresh_token
+        :raises ~twitchAPI.types.TwitchAPIException: if authentication fails
+        :rtype: None or (str, str)
+        """
+        self.__callback_func = callback_func
+
+        if user_token is None and self.callback_server is not None:
+            self.callback_server.expect(self.__state)
+            await self.callback_server.listen(self.port)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, webbrowser.open, self.__build_auth_url(), 2)
+            self.__user_token = await self.callback_server.wait_for_code(self.__state)
+        elif user_token is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.__wait_for_user_token)
+        else:
+            self.__user_token = user_token
+
+        url = self.__build_token_url()
+        data: dict = (await _request_async("POST", url)).json()
+        return self.__finish(data, callback_func, user_token)
+
+    def __wait_for_user_token(self):
+        self.__start()
+        # wait for the server to start up
+        self.__server_started.wait()
+        # open in browser
+        webbrowser.open(self.__build_auth_url(), new=2)
+        self.__user_token_received.wait()
+        # now we need to actually get the correct token
+
+    def __build_token_url(self):
         param = {
             "client_id": self.__client_id,
             "client_secret": self.__client_secret,
@@ -379,9 +594,9 @@ class UserAuthenticator:
             "grant_type": "authorization_code",
             "redirect_uri": self.url,
         }
-        url = build_url(TWITCH_AUTH_BASE_URL + "oauth2/token", param)
-        response = requests.post(url)
-        data: dict = response.json()
+        return build_url(TWITCH_AUTH_BASE_URL + "oauth2/token", param)
+
+    def __finish(self, data: dict, callback_func, user_token):
         if callback_func is None:
             self.stop()
             if data.get("access_token") is None:
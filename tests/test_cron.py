@@ -0,0 +1,155 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Cron spec parsing and next runs, in local time."""
+
+import datetime
+import time
+
+import pytest
+
+from bots.scheduler import Cron, Every, schedule
+
+
+@pytest.fixture
+def new_york(monkeypatch):
+    """Local time with daylight saving: clocks go forward on 2024-03-10 and back on 2024-11-03, at 2:00."""
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def local(*args, fold=0):
+    return datetime.datetime(*args, fold=fold).timestamp()
+
+
+def runs(cron, start, count):
+    """The next count runs after start, as local datetimes."""
+    found = []
+    after = start
+    for _ in range(count):
+        after = cron.next(after)
+        found.append(datetime.datetime.fromtimestamp(after))
+    return found
+
+
+def test_fields():
+    cron = Cron("*/15 9-17 1,15 jan-mar mon-fri")
+
+    assert cron.minutes == {0, 15, 30, 45}
+    assert cron.hours == set(range(9, 18))
+    assert cron.days == {1, 15}
+    assert cron.months == {1, 2, 3}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+
+
+def test_sunday_is_0_or_7_and_steps_start_at_a_value():
+    assert Cron("0 0 * * 7").weekdays == {0}
+    assert Cron("5/20 * * * *").minutes == {5, 25, 45}
+
+
+def test_macros():
+    assert Cron("@hourly").minutes == {0}
+    assert Cron("@weekly").weekdays == {0}
+
+
+@pytest.mark.parametrize("spec", ["* * * *", "60 * * * *", "* 24 * * *", "0 0 0 * *", "0 0 * 13 *", "*/0 * * * *"])
+def test_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        Cron(spec)
+
+
+def test_never_matching_spec_is_rejected():
+    with pytest.raises(ValueError):
+        Cron("0 0 31 2 *")
+
+
+def test_next_is_strictly_after(new_york):
+    cron = Cron("30 8 * * *")
+
+    assert cron.next(local(2024, 5, 5, 8, 29, 59)) == local(2024, 5, 5, 8, 30)
+    assert cron.next(local(2024, 5, 5, 8, 30)) == local(2024, 5, 6, 8, 30)
+
+
+def test_next_crosses_months_and_years(new_york):
+    assert Cron("0 0 1 * *").next(local(2024, 1, 31, 12)) == local(2024, 2, 1)
+    assert Cron("0 0 29 2 *").next(local(2024, 3, 1)) == local(2028, 2, 29)
+    assert Cron("@yearly").next(local(2024, 12, 31, 23, 59)) == local(2025, 1, 1)
+
+
+def test_day_of_month_or_day_of_week_when_both_are_restricted(new_york):
+    # The 13th of each month and every Friday, as in cron.
+    cron = Cron("0 12 13 * 5")
+
+    days = [run.date() for run in runs(cron, local(2024, 9, 1), 6)]
+
+    assert days == [
+        datetime.date(2024, 9, 6),
+        datetime.date(2024, 9, 13),
+        datetime.date(2024, 9, 20),
+        datetime.date(2024, 9, 27),
+        datetime.date(2024, 10, 4),
+        datetime.date(2024, 10, 11),
+    ]
+    assert datetime.date(2024, 10, 13) in [run.date() for run in runs(cron, local(2024, 10, 12), 1)]
+
+
+def test_day_of_month_and_day_of_week_when_one_is_a_wildcard(new_york):
+    assert [run.date() for run in runs(Cron("0 12 * * 5"), local(2024, 9, 1), 2)] == [
+        datetime.date(2024, 9, 6),
+        datetime.date(2024, 9, 13),
+    ]
+    assert [run.date() for run in runs(Cron("0 12 13 * *"), local(2024, 9, 1), 2)] == [
+        datetime.date(2024, 9, 13),
+        datetime.date(2024, 10, 13),
+    ]
+
+
+def test_skipped_hour_when_clocks_go_forward(new_york):
+    # 2:30 does not exist on 2024-03-10; the run happens an hour later, at 3:30 EDT, once.
+    cron = Cron("30 2 * * *")
+
+    found = runs(cron, local(2024, 3, 9, 12), 3)
+
+    assert [run.date() for run in found] == [
+        datetime.date(2024, 3, 10),
+        datetime.date(2024, 3, 11),
+        datetime.date(2024, 3, 12),
+    ]
+    assert found[0].time() == datetime.time(3, 30)
+    assert found[1].time() == datetime.time(2, 30)
+
+
+def test_repeated_hour_when_clocks_go_back(new_york):
+    # 1:30 happens twice on 2024-11-03; the job runs at the first one only.
+    cron = Cron("30 1 * * *")
+
+    first = cron.next(local(2024, 11, 2, 12))
+    second = cron.next(local(2024, 11, 3, 1, 45))
+
+    assert first == local(2024, 11, 3, 1, 30, fold=0)
+    assert second == local(2024, 11, 4, 1, 30)
+    # Asked from inside the repeated hour, it doesn't run the second 1:30 either.
+    assert cron.next(local(2024, 11, 3, 1, 10, fold=1)) == local(2024, 11, 4, 1, 30)
+
+
+def test_wall_clock_times_run_once_through_transitions(new_york):
+    cron = Cron("*/20 * * * *")
+
+    forward = runs(cron, local(2024, 3, 10, 1), 4)
+    back = runs(cron, local(2024, 11, 3, 1), 4)
+
+    assert [run.strftime("%H:%M") for run in forward] == ["01:20", "01:40", "03:00", "03:20"]
+    # The repeated 1:00-2:00 is stepped over rather than run a second time.
+    assert [run.strftime("%H:%M") for run in back] == ["01:20", "01:40", "02:00", "02:20"]
+    assert back[2].timestamp() - back[1].timestamp() == 80 * 60
+
+
+def test_schedule_picks_cron_or_every():
+    assert isinstance(schedule({"cron": "@daily"}), Cron)
+    assert schedule({"every": 90}).next(10) == 100
+    with pytest.raises(ValueError):
+        schedule({})
+    with pytest.raises(ValueError):
+        Every(0)
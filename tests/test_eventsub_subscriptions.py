@@ -0,0 +1,99 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The tokens SubscriptionManager sends with its Helix requests."""
+
+import asyncio
+import types
+
+import pytest
+
+from cogs import eventsub
+
+CALLBACK = "https://bots.example.com/eventsub"
+
+
+class FakeHTTP:
+    """Records the routes twitchio's TwitchHTTP would send."""
+
+    client_id = "client"
+    client_secret = "secret"
+    token = "user-token"
+
+    def __init__(self, existing=()):
+        self.existing = list(existing)
+        self.routes = []
+
+    async def request(self, route, paginate=True, full_body=False, force_app_token=False):
+        self.routes.append(route)
+        if route.method == "GET":
+            return {"data": self.existing, "pagination": {}}
+        return {"data": []}
+
+
+def subscription(sid, transport, status="enabled", user_id="1"):
+    return {
+        "id": sid,
+        "status": status,
+        "type": "channel.follow",
+        "version": "1",
+        "condition": {"broadcaster_user_id": user_id},
+        "transport": transport,
+    }
+
+
+def manager(http, session=None):
+    client = types.SimpleNamespace(route=CALLBACK, secret="word", _http=types.SimpleNamespace(_http=http))
+    return eventsub.SubscriptionManager(client, session=session)
+
+
+@pytest.fixture
+def app_tokens(monkeypatch):
+    issued = []
+
+    async def get_app_token_async(client_id, client_secret):
+        issued.append((client_id, client_secret))
+        return f"app-token-{len(issued)}", 3600
+
+    monkeypatch.setattr(eventsub, "get_app_token_async", get_app_token_async)
+    return issued
+
+
+def test_webhook_requests_carry_the_app_token(app_tokens):
+    http = FakeHTTP([
+        subscription("stale", {"method": "webhook", "callback": CALLBACK}, user_id="2"),
+        subscription("failed", {"method": "webhook", "callback": CALLBACK}, status="notification_failures_exceeded"),
+    ])
+
+    failures = asyncio.run(manager(http).sync(["channel_follow"], ["1"]))
+
+    assert failures == []
+    assert sorted(route.method for route in http.routes) == ["DELETE", "DELETE", "GET", "POST"]
+    assert {route.headers["Authorization"] for route in http.routes} == {"Bearer app-token-1"}
+    assert app_tokens == [("client", "secret")]
+    created = next(route for route in http.routes if route.method == "POST")
+    assert '"callback": "https://bots.example.com/eventsub"' in created.body
+
+
+def test_app_token_is_renewed_when_it_expires(app_tokens, monkeypatch):
+    monkeypatch.setattr(eventsub, "APP_TOKEN_MARGIN", 3600)
+    http = FakeHTTP()
+    subscriptions = manager(http)
+
+    async def twice():
+        await subscriptions.existing()
+        await subscriptions.existing()
+
+    asyncio.run(twice())
+
+    assert [route.headers["Authorization"] for route in http.routes] == ["Bearer app-token-1", "Bearer app-token-2"]
+
+
+def test_websocket_requests_carry_the_user_token(app_tokens):
+    session = types.SimpleNamespace(session_id="session")
+    http = FakeHTTP([subscription("old", {"method": "websocket", "session_id": "gone"}, status="websocket_disconnected")])
+
+    asyncio.run(manager(http, session).sync(["channel_follow"], ["1"]))
+
+    assert sorted(route.method for route in http.routes) == ["DELETE", "GET", "POST"]
+    assert {route.headers["Authorization"] for route in http.routes} == {"Bearer user-token"}
+    assert app_tokens == []
@@ -0,0 +1,52 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The session and connection pool SharedTransport hosts bots on."""
+
+import asyncio
+
+from aiohttp import web
+
+from bots.hosting import SharedTransport
+
+
+def test_more_websockets_than_a_default_pool_holds():
+    # aiohttp's own default is 100 connections; each bot holds one for its IRC websocket.
+    async def run():
+        async def websocket(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            async for _ in ws:
+                pass
+            return ws
+
+        async def ok(request):
+            return web.Response(text="ok")
+
+        app = web.Application()
+        app.router.add_get("/", websocket)
+        app.router.add_get("/ok", ok)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        transport = SharedTransport()
+        try:
+            sockets = [
+                await asyncio.wait_for(transport.session.ws_connect(f"http://127.0.0.1:{port}/"), 5)
+                for _ in range(120)
+            ]
+            async with transport.session.get(f"http://127.0.0.1:{port}/ok") as response:
+                status = response.status
+            for ws in sockets:
+                await ws.close()
+            return len(sockets), status
+        finally:
+            await transport.close()
+            await runner.cleanup()
+
+    connected, status = asyncio.run(run())
+
+    # The plain request still gets through with every websocket open.
+    assert connected == 120
+    assert status == 200
@@ -0,0 +1,33 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""EventIngest's queue and the drops it reports."""
+
+import asyncio
+
+from bots import metrics
+from bots.ingest import EventIngest
+
+
+def test_drops_are_exported():
+    async def run():
+        handled = []
+
+        async def handler(item):
+            handled.append(item)
+
+        ingest = EventIngest(handler, workers=1, maxsize=2, name="events", bot="ingester")
+        ingest.start()
+        offered = [ingest.offer(i) for i in range(3)]
+        ingest.drop_duplicate()
+        await ingest.queue.join()
+        await ingest.stop()
+        return ingest, offered, handled
+
+    ingest, offered, handled = asyncio.run(run())
+
+    assert offered == [True, True, False]
+    assert handled == [0, 1]
+    assert ingest.stats()["dropped_overflow"] == 1
+    exposition = metrics.registry.render()
+    assert 'ingest_dropped_total{bot="ingester",ingest="events",reason="overflow"} 1' in exposition
+    assert 'ingest_dropped_total{bot="ingester",ingest="events",reason="duplicate"} 1' in exposition
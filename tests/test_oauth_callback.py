@@ -0,0 +1,71 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The shared OAuth callback server and its redirect URL."""
+
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+from oauth.callback import CallbackServer
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_configured_redirect_is_used_by_every_bot():
+    server = CallbackServer()
+    server.configure("https://bots.example.com/oauth/callback", 8080)
+
+    assert server.redirect(27563) == ("https://bots.example.com/oauth/callback", 8080)
+    assert server.redirect() == ("https://bots.example.com/oauth/callback", 8080)
+    assert server.path == "/oauth/callback"
+
+
+def test_port_defaults_to_the_redirect_urls():
+    server = CallbackServer()
+
+    server.configure("http://localhost:17563")
+    assert (server.port, server.path) == (17563, "/")
+
+    server.configure("https://bots.example.com/oauth")
+    assert server.port == 443
+
+
+def test_auth_port_is_the_fallback():
+    server = CallbackServer()
+
+    assert server.redirect(27563) == ("http://localhost:27563", 27563)
+    with pytest.raises(ValueError):
+        server.redirect()
+
+
+def test_flows_share_one_listener():
+    port = free_port()
+    server = CallbackServer(host="127.0.0.1")
+    server.configure(f"http://localhost:{port}/oauth")
+
+    async def authorize():
+        codes = {}
+
+        async def flow(bot):
+            server.expect(bot)
+            url, listen_port = server.redirect(27000 + len(codes))
+            await server.listen(listen_port)
+            codes[bot] = asyncio.ensure_future(server.wait_for_code(bot, timeout=5))
+
+        await flow("first")
+        await flow("second")
+        assert list(server._sites) == [port]
+        async with aiohttp.ClientSession() as session:
+            for bot in ("second", "first"):
+                async with session.get(f"http://127.0.0.1:{port}/oauth", params={"state": bot, "code": bot + "-code"}) as r:
+                    assert r.status == 200
+        return {bot: await code for bot, code in codes.items()}
+
+    assert asyncio.run(authorize()) == {"first": "first-code", "second": "second-code"}
+    assert server.pending == 0
@@ -0,0 +1,124 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The account-wide limits OutboundScheduler paces chat messages by."""
+
+import asyncio
+import time
+import types
+
+from bots import metrics
+from bots.outbound import OutboundScheduler
+
+
+class Connection:
+    def __init__(self):
+        self.sent = []
+        self.times = []
+
+    async def send(self, line):
+        self.sent.append(line)
+        self.times.append(time.monotonic())
+
+
+def scheduler(limit=(3, 30), mod_limit=(5, 30), name="bot", **kwargs):
+    connection = Connection()
+    shards = types.SimpleNamespace(connection_for=lambda channel: connection)
+    bot = types.SimpleNamespace(name=name, shards=shards)
+    outbound = OutboundScheduler(bot, limit=limit, mod_limit=mod_limit, **kwargs)
+    return outbound, connection
+
+
+def test_moderated_sends_count_against_the_account_limit():
+    async def run():
+        outbound, connection = scheduler()
+        outbound.set_mod("modded", True)
+        sent = [outbound.send("modded", f"mod {i}") for i in range(3)]
+        assert await asyncio.gather(*sent) == [True, True, True]
+        # The account's three messages are used up, even though only the
+        # moderator limit held the moderated channel back.
+        outbound.send("other", "hello")
+        await asyncio.sleep(0.05)
+        return outbound, connection
+
+    outbound, connection = asyncio.run(run())
+
+    assert len(connection.sent) == 3
+    assert outbound.limiter.delay() > 0
+    assert outbound.mod_limiter.delay() == 0
+
+
+def test_other_sends_count_against_the_moderator_limit():
+    async def run():
+        outbound, connection = scheduler(limit=(5, 30), mod_limit=(5, 30))
+        for i in range(3):
+            assert await outbound.send(f"channel{i}", "hi")
+        outbound.set_mod("modded", True)
+        sent = [outbound.send("modded", f"mod {i}") for i in range(3)]
+        await asyncio.sleep(0.05)
+        return outbound, connection, sent
+
+    outbound, connection, sent = asyncio.run(run())
+
+    # 3 + 2 fill the moderator limit of 5; the third moderated message waits.
+    assert len(connection.sent) == 5
+    assert [future.done() for future in sent] == [True, True, False]
+
+
+# A send is recorded a little after the limiter stamped it.
+SKEW = 0.001
+
+
+def busiest_window(times, period):
+    return max(sum(1 for other in times if start <= other < start + period - SKEW) for start in times)
+
+
+def test_no_window_holds_more_than_the_limit():
+    async def run():
+        outbound, connection = scheduler(limit=(4, 0.3), mod_limit=(6, 0.3))
+        # Every message to a channel of its own, so only the account limits apply.
+        sent = [outbound.send(f"channel{i}", "hi") for i in range(14)]
+        assert all(await asyncio.gather(*sent))
+        return connection
+
+    connection = asyncio.run(run())
+
+    # A full burst and no refill on top of it within the same window.
+    assert busiest_window(connection.times, 0.3) == 4
+
+
+def test_moderated_sends_only_exceed_the_account_limit_up_to_the_moderator_one():
+    async def run():
+        outbound, connection = scheduler(limit=(4, 0.3), mod_limit=(6, 0.3))
+        outbound.set_mod("modded", True)
+        sent = [outbound.send("modded", f"mod {i}") for i in range(10)]
+        sent += [outbound.send(f"channel{i}", "hi") for i in range(8)]
+        assert all(await asyncio.gather(*sent))
+        return connection
+
+    connection = asyncio.run(run())
+
+    assert busiest_window(connection.times, 0.3) == 6
+    plain = [t for line, t in zip(connection.sent, connection.times) if "#modded" not in line]
+    # A plain message only goes out while fewer than 4 of any kind were sent in the window before it.
+    for t in plain:
+        assert sum(1 for other in connection.times if t - 0.3 + SKEW < other < t) < 4
+
+
+def test_drops_are_exported():
+    async def run():
+        outbound, _ = scheduler(limit=(1, 30), name="dropper", max_depth=2)
+        outbound.send("chan", "first")
+        await asyncio.sleep(0)
+        outbound.send("chan", "waits")
+        outbound.send("chan", "waits")
+        outbound.send("chan", "fills the queue")
+        outbound.send("chan", "no room")
+        await outbound.close()
+        return outbound
+
+    outbound = asyncio.run(run())
+
+    assert outbound.stats()["chan"]["coalesced"] == 1
+    exposition = metrics.registry.render()
+    assert 'bot_outbound_dropped_total{bot="dropper",channel="chan",reason="coalesced"} 1' in exposition
+    assert 'bot_outbound_dropped_total{bot="dropper",channel="chan",reason="full"} 1' in exposition
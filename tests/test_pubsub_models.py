@@ -0,0 +1,82 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Typed PubSub events built from messages as Twitch sends them."""
+
+import asyncio
+import json
+import types
+
+from benchmarks.fake_twitch import FakePubSub
+from cogs import pubsub
+
+
+class Client:
+    _http = None
+    _connection = None
+
+    def __init__(self):
+        self.events = []
+
+    def run_event(self, event, *args):
+        self.events.append((event, *args))
+
+    def get_channel(self, name):
+        return None
+
+
+def handle(topic, message):
+    client = Client()
+    websocket = types.SimpleNamespace(client=client)
+    frame = {"type": "MESSAGE", "data": {"topic": topic, "message": json.dumps(message)}}
+    asyncio.run(pubsub.PubSubWebsocket.handle_message(websocket, frame))
+    return client.events
+
+
+def test_bits_message():
+    events = handle("channel-bits-events-v2.44", FakePubSub.bits_message(44, "cheerer"))
+
+    assert [event[0] for event in events] == ["pubsub_message", "pubsub_bits"]
+    bits = events[1][1]
+    assert isinstance(bits, pubsub.models.PubSubBitsMessage)
+    assert bits.bits_used == 100
+    assert bits.channel_id == 44
+    assert bits.user.name == "cheerer"
+    assert bits.message.content == "cheer100"
+    assert bits.message.type == "bits_event"
+    assert (bits.badge_entitlement.new, bits.badge_entitlement.old) == (1000, 100)
+    assert bits.anonymous is False
+
+
+def test_anonymous_bits_message():
+    message = FakePubSub.bits_message(44)
+    message["data"].update(user_id=None, user_name=None, is_anonymous=True, badge_entitlement=None)
+
+    bits = handle("channel-bits-events-v2.44", message)[1][1]
+
+    assert bits.user is None
+    assert bits.badge_entitlement is None
+    assert bits.anonymous is True
+
+
+def test_bits_badge_message():
+    message = {
+        "user_id": "232889822",
+        "user_name": "willowolf",
+        "channel_id": "44",
+        "channel_name": "channel",
+        "badge_tier": 1000,
+        "chat_message": "this should be received by the public pubsub listener",
+        "time": "2020-12-06T00:01:43.71253159Z",
+    }
+
+    events = handle("channel-bits-badge-unlocks.44", message)
+
+    assert [event[0] for event in events] == ["pubsub_message", "pubsub_bits_badge"]
+    assert events[1][1].badge_tier == 1000
+    assert events[1][1].channel.name == "channel"
+
+
+def test_topics_without_a_model_get_the_generic_event():
+    events = handle("whispers.44", {"type": "whisper_received", "data": "{}"})
+
+    assert [event[0] for event in events] == ["pubsub_message"]
@@ -0,0 +1,128 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""RateLimiter's sliding window, and BucketTable's token buckets and the timing
+wheel that forgets full ones."""
+
+import random
+import time
+
+import pytest
+
+from bots.ratelimit import BucketTable, RateLimiter
+
+
+@pytest.fixture
+def now():
+    # The wheel starts at the current monotonic time.
+    return time.monotonic()
+
+
+def test_slots_taken_past_the_limit_are_waited_out():
+    limiter = RateLimiter(2, 30)
+    for _ in range(5):
+        limiter.take()
+
+    # Free again once all but one of the five have left the window, not after one refill.
+    assert limiter.delay() == pytest.approx(30, abs=0.1)
+    assert not limiter.try_acquire()
+
+
+def use(table, key, now):
+    """take() as callers do, only when delay() allows it."""
+    if table.delay(key, now) == 0:
+        table.take(key, now)
+        return True
+    return False
+
+
+def test_burst_then_one_token_per_interval(now):
+    table = BucketTable(4, 1.0, slots=8)
+
+    assert [use(table, "a", now) for _ in range(5)] == [True, True, True, True, False]
+    assert table.delay("a", now) == pytest.approx(0.25)
+    assert not use(table, "a", now + 0.24)
+    assert use(table, "a", now + 0.25)
+    assert not use(table, "a", now + 0.25)
+
+
+def test_keys_have_their_own_buckets(now):
+    table = BucketTable(1, 1.0, slots=8)
+
+    assert use(table, "a", now)
+    assert use(table, "b", now)
+    assert not use(table, "a", now)
+    assert table.delay("b", now + 0.5) == pytest.approx(0.5)
+
+
+def test_full_buckets_are_forgotten(now):
+    table = BucketTable(2, 1.0, slots=8)
+    table.take("a", now)
+    table.take("a", now)
+    assert len(table) == 1
+
+    # Full again at now + 1; kept until the tick after that has passed.
+    table.take("b", now + 0.9)
+    assert len(table) == 2
+    table.take("b", now + 1.3)
+    assert len(table) == 1
+    assert table.delay("a", now + 1.3) == 0
+
+
+def test_bucket_spanning_the_whole_wheel_survives_the_lap(now):
+    # A bucket emptied in one go is full again a whole span later, which
+    # files it in the slot the cursor has just read.
+    table = BucketTable(4, 1.0, slots=8)
+    for _ in range(4):
+        table.take("a", now)
+
+    for step in range(1, 8):
+        table.take("other", now + step * 0.125)
+        assert table.delay("a", now + step * 0.125) == pytest.approx(max(0, 0.25 - step * 0.125))
+        assert "a" in table._full_at
+    table.take("other", now + 1.3)
+    assert "a" not in table._full_at
+
+
+def test_matches_unbounded_buckets_across_many_laps(now):
+    # The reference keeps every bucket forever; the table must agree with it
+    # while the wheel wraps around many times, and only hold recent keys.
+    rng = random.Random(3)
+    rate, per = 5, 2.0
+    table = BucketTable(rate, per, slots=16)
+    reference = {}
+    interval = per / rate
+    t = now
+    for _ in range(5000):
+        t += rng.expovariate(40)
+        key = rng.randrange(30)
+        full_at = reference.get(key)
+        expected = 0 if full_at is None else max(0, full_at + interval - t - per)
+        assert table.delay(key, t) == pytest.approx(expected)
+        if expected == 0:
+            table.take(key, t)
+            reference[key] = max(t, full_at or t) + interval
+        # Nothing lingers past the end of the tick after the one it was full in.
+        assert min(table._full_at.values()) >= t - 2 * table.tick
+    assert t - now > 20 * per
+
+
+def test_long_idle_forgets_everything(now):
+    table = BucketTable(3, 1.0, slots=8)
+    for key in range(50):
+        table.take(key, now)
+
+    table.take("late", now + 100)
+
+    assert list(table._full_at) == ["late"]
+
+
+def test_max_keys_drops_the_closest_to_full(now):
+    table = BucketTable(2, 1.0, max_keys=3, slots=8)
+    table.take("soon", now)
+    for key in ("later", "latest"):
+        table.take(key, now + 0.3)
+        table.take(key, now + 0.3)
+
+    table.take("new", now + 0.4)
+
+    assert set(table._full_at) == {"later", "latest", "new"}
@@ -0,0 +1,27 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""What bot.run_bots leaves behind when it returns."""
+
+import asyncio
+import json
+
+import bot
+from bots.scheduler import Every, Job, Scheduler
+
+
+def test_routine_state_is_saved_at_shutdown(tmp_path, monkeypatch):
+    scheduler = Scheduler(str(tmp_path / "routines.json"))
+    monkeypatch.setattr(bot, "get_scheduler", lambda: scheduler)
+
+    async def routine():
+        pass
+
+    async def run():
+        scheduler.add(Job("bot.routine", Every(3600), routine))
+        # Without bots or --reload, run_bots shuts down right away.
+        await bot.run_bots([], config={"watchdog": {"enabled": False}})
+
+    asyncio.run(run())
+
+    assert "bot.routine" in json.loads((tmp_path / "routines.json").read_text())
+    assert scheduler._task is None
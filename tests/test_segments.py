@@ -0,0 +1,167 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""The segment file format, rotation and recovery after a crash."""
+
+import os
+import struct
+import zlib
+
+import pytest
+
+from bots import segments
+from bots.segments import (
+    BLOCK,
+    MAGIC,
+    OPEN_SUFFIX,
+    SUFFIX,
+    SegmentWriter,
+    decode_records,
+    encode_records,
+    list_segments,
+    read_segment,
+    read_segments,
+)
+
+
+def write(directory, records, prefix="bot", **kwargs):
+    """Write records through a writer's flush, as its thread would, and seal the segment."""
+    writer = SegmentWriter(str(directory), prefix=prefix, **kwargs)
+    for timestamp, kind, channel, payload in records:
+        writer.append(kind, channel, payload, timestamp)
+    writer.flush()
+    writer._seal()
+    return writer
+
+
+def test_records_round_trip():
+    records = [(1, 1, "channel", b"hello"), (2, 3, "", b""), (3, 2, "käse", "ünicode".encode())]
+
+    assert list(decode_records(encode_records(records))) == records
+
+
+def test_segment_layout(tmp_path):
+    write(tmp_path, [(1000, 1, "chan", "line one"), (1001, 1, "chan", "line two")])
+
+    [path] = list_segments(str(tmp_path), "bot")
+    data = open(path, "rb").read()
+    assert data.startswith(MAGIC)
+    size, raw_size, crc = BLOCK.unpack_from(data, len(MAGIC))
+    block = data[len(MAGIC) + BLOCK.size:]
+    assert len(block) == size
+    assert zlib.crc32(block) == crc
+    raw = zlib.decompress(block)
+    assert len(raw) == raw_size
+    assert list(decode_records(raw)) == [(1000, 1, "chan", b"line one"), (1001, 1, "chan", b"line two")]
+
+
+def test_one_block_per_flush(tmp_path):
+    writer = SegmentWriter(str(tmp_path), prefix="bot")
+    for batch in range(3):
+        writer.append(1, "chan", f"batch {batch}", batch)
+        writer.flush()
+    writer.flush()  # nothing buffered: no empty block
+    writer._seal()
+
+    assert writer.fsyncs == 3
+    [path] = list_segments(str(tmp_path), "bot")
+    assert [record[3] for record in read_segment(path)] == [b"batch 0", b"batch 1", b"batch 2"]
+
+
+def test_rotation_by_size(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(segments.time, "time", lambda: next(clock))
+    writer = SegmentWriter(str(tmp_path), prefix="bot", segment_bytes=1)
+    for i in range(3):
+        writer.append(1, "chan", f"record {i}", i)
+        writer.flush()
+    writer._seal()
+
+    assert writer.segments == 3
+    assert [r[0] for r in read_segments(str(tmp_path), "bot")] == [0, 1, 2]
+
+
+def test_torn_block_ends_the_read(tmp_path, caplog):
+    write(tmp_path, [(1, 1, "chan", "kept")])
+    [path] = list_segments(str(tmp_path), "bot")
+    good = os.path.getsize(path)
+    # A crash mid-write: a header promising more bytes than made it to disk.
+    with open(path, "ab") as file:
+        data = zlib.compress(b"x" * 100)
+        file.write(BLOCK.pack(len(data), 100, zlib.crc32(data)) + data[:10])
+
+    assert list(read_segment(path)) == [(1, 1, "chan", b"kept")]
+    assert f"torn block at offset {good}" in caplog.text
+
+
+def test_corrupt_block_ends_the_read(tmp_path):
+    write(tmp_path, [(1, 1, "chan", "first")])
+    [path] = list_segments(str(tmp_path), "bot")
+    with open(path, "ab") as file:
+        data = zlib.compress(encode_records([(2, 1, "chan", b"second")]))
+        file.write(BLOCK.pack(len(data), 0, zlib.crc32(data) ^ 1) + data)
+
+    assert [record[3] for record in read_segment(path)] == [b"first"]
+
+
+def test_not_a_segment(tmp_path):
+    path = tmp_path / f"bot-0000000000001{SUFFIX}"
+    path.write_bytes(b"something else entirely")
+
+    with pytest.raises(ValueError):
+        list(read_segment(str(path)))
+
+
+def test_empty_segment_has_no_records(tmp_path):
+    path = tmp_path / f"bot-0000000000001{SUFFIX}"
+    path.write_bytes(MAGIC)
+
+    assert list(read_segment(str(path))) == []
+
+
+def test_start_recovers_segments_left_open(tmp_path):
+    write(tmp_path, [(1, 1, "chan", "before the crash")])
+    [path] = list_segments(str(tmp_path), "bot")
+    crashed = path[: -len(SUFFIX)] + OPEN_SUFFIX
+    os.replace(path, crashed)
+    with open(crashed, "ab") as file:
+        file.write(struct.pack("<I", 99))  # half a block header
+    assert list_segments(str(tmp_path), "bot") == []
+
+    writer = SegmentWriter(str(tmp_path), prefix="bot", flush_interval=60)
+    writer.start()
+    writer.append(1, "chan", "after the restart", 2)
+    writer.stop()
+
+    assert [record[3] for record in read_segments(str(tmp_path), "bot")] == [b"before the crash", b"after the restart"]
+    assert not any(name.endswith(OPEN_SUFFIX) for name in os.listdir(tmp_path))
+
+
+def test_open_segments_are_listed_on_request(tmp_path):
+    (tmp_path / f"bot-0000000000001{SUFFIX}").write_bytes(MAGIC)
+    (tmp_path / f"bot-0000000000002{OPEN_SUFFIX}").write_bytes(MAGIC)
+
+    assert len(list_segments(str(tmp_path), "bot")) == 1
+    assert len(list_segments(str(tmp_path), "bot", include_open=True)) == 2
+
+
+def test_bots_sharing_a_directory_keep_their_own_segments(tmp_path):
+    write(tmp_path, [(1, 1, "chan", "from a")], prefix="a")
+    write(tmp_path, [(2, 1, "chan", "from a-b")], prefix="a-b")
+
+    assert [record[3] for record in read_segments(str(tmp_path), "a")] == [b"from a"]
+    assert [record[3] for record in read_segments(str(tmp_path), "a-b")] == [b"from a-b"]
+
+
+def test_read_since_skips_older_segments(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(segments.time, "time", lambda: now[0])
+    writer = SegmentWriter(str(tmp_path), prefix="bot", segment_seconds=10)
+    for second in (1000, 1005, 1020, 1025):
+        now[0] = second
+        writer.append(1, "chan", str(second), second * 1000)
+        writer.flush()
+    writer._seal()
+    assert writer.segments == 2
+
+    assert [record[0] for record in read_segments(str(tmp_path), "bot", since=1021000)] == [1025000]
+    assert [record[0] for record in read_segments(str(tmp_path), "bot", since=1004000)] == [1005000, 1020000, 1025000]
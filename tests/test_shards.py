@@ -0,0 +1,154 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""ShardPool placing channels on connections and rebalancing them."""
+
+import asyncio
+import types
+
+import pytest
+
+from bots import shards
+
+
+class FakeShard:
+    """Stands in for an IRC connection; records what is sent over it in a shared log."""
+
+    def __init__(self, pool, index, log=None):
+        self.index = index
+        self.log = pool.log if pool is not None else log
+        self._initial_channels = []
+        self._cache = {}
+        self.connected = None
+        self.is_alive = True
+        self.is_ready = asyncio.Event()
+        self.closed = False
+
+    def __repr__(self):
+        return f"<shard {self.index}>"
+
+    async def _connect(self):
+        self.is_ready.set()
+
+    async def _join_channel(self, channel):
+        self.log.append(("join", self.index, channel))
+
+    async def join_channels(self, *channels):
+        for channel in channels:
+            await self._join_channel(channel)
+
+    async def send(self, line):
+        self.log.append(("send", self.index, line.strip()))
+
+    async def close(self):
+        self.closed = True
+        self.log.append(("close", self.index))
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(shards, "ShardConnection", FakeShard)
+    log = []
+    bot = types.SimpleNamespace(name="bot", _connection=FakeShard(None, 0, log))
+    pool = shards.ShardPool(bot, capacity=10)
+    pool.log = log
+    return pool
+
+
+def channels(count, start=0):
+    return [f"channel{i}" for i in range(start, start + count)]
+
+
+def check(pool):
+    """Every channel is on exactly one open shard, within capacity."""
+    carried = [channel for shard in pool.shards for channel in shard._initial_channels]
+    assert sorted(carried) == sorted(pool.owner)
+    for channel, shard in pool.owner.items():
+        assert shard in pool.shards
+        assert channel in shard._initial_channels
+    assert all(size <= pool.capacity for size in pool.sizes())
+
+
+def test_join_fills_shards_in_order(pool):
+    asyncio.run(pool.join(channels(25)))
+
+    assert pool.sizes() == [10, 10, 5]
+    assert pool.connection_for("#Channel24") is pool.shards[2]
+    check(pool)
+
+
+def test_rebalance_empties_and_closes_the_least_loaded_shards(pool):
+    async def run():
+        await pool.join(channels(50))
+        await pool.part(channels(8, 0) + channels(9, 10) + channels(9, 20) + channels(8, 30) + channels(4, 40))
+        assert pool.sizes() == [2, 1, 1, 2, 6]
+        pool.log.clear()
+        await pool.rebalance()
+
+    asyncio.run(run())
+
+    assert len(pool.shards) == 2
+    assert sum(pool.sizes()) == 12
+    check(pool)
+    closed = [entry[1] for entry in pool.log if entry[0] == "close"]
+    assert len(closed) == 3 and 0 not in closed
+
+
+def test_channels_are_joined_on_the_new_shard_before_the_old_one_closes(pool):
+    async def run():
+        await pool.join(channels(15))
+        await pool.part(channels(7))
+        pool.log.clear()
+        await pool.rebalance()
+
+    asyncio.run(run())
+
+    # shard 1 held channel10-14 and the bot's own connection has room for them.
+    assert pool.log == [("join", 0, f"channel{i}") for i in range(10, 15)] + [("close", 1)]
+    assert pool.sizes() == [8]
+    # Moving a channel is a JOIN elsewhere; the closing shard never sends PART.
+    assert not any(entry[0] == "send" for entry in pool.log)
+
+
+def test_rebalance_keeps_shards_that_are_needed(pool):
+    async def run():
+        await pool.join(channels(25))
+        await pool.part(channels(3))
+        await pool.rebalance()
+
+    asyncio.run(run())
+
+    # 22 channels need three connections of ten.
+    assert pool.sizes() == [7, 10, 5]
+    assert not any(entry[0] == "close" for entry in pool.log)
+
+
+def test_the_bots_own_connection_is_never_closed(pool):
+    async def run():
+        await pool.join(channels(30))
+        await pool.part(channels(29))
+        await pool.rebalance()
+
+    asyncio.run(run())
+
+    assert pool.shards == [pool.bot._connection]
+    assert pool.sizes() == [1]
+    assert not pool.bot._connection.closed
+    check(pool)
+
+
+def test_rebalanced_joins_are_paced_by_the_account(pool):
+    class Limiter:
+        acquired = 0
+
+        async def acquire(self):
+            Limiter.acquired += 1
+
+    async def run():
+        await pool.join(channels(15))
+        await pool.part(channels(7))
+        pool.pace(Limiter(), None)
+        await pool.rebalance()
+
+    asyncio.run(run())
+
+    assert Limiter.acquired == 5
@@ -0,0 +1,65 @@
+# Copyright Alex Morais (thatsamorais@gmail.com) for perplexistential
+
+"""Splitting the bots across --workers processes by name, and their logging."""
+
+import io
+import itertools
+import logging
+import logging.handlers
+import queue
+
+from bots import logsink, supervisor
+from bots.logsink import LogSink
+from bots.supervisor import Supervisor, owns_bot, shard_for, split_bots
+
+BOTS = {f"bot{i}": {"channels": [f"channel{i}"]} for i in range(20)}
+
+
+def test_every_bot_is_on_the_shard_its_name_hashes_to():
+    shards = split_bots(BOTS, 4)
+
+    assert sorted(name for _, shard in shards for name in shard) == sorted(BOTS)
+    for index, shard in shards:
+        assert all(shard_for(name, 4) == index for name in shard)
+
+
+def test_empty_shards_keep_their_index():
+    bots = {name: config for name, config in BOTS.items() if shard_for(name, 4) != 1}
+
+    assert [index for index, _ in split_bots(bots, 4)] == [0, 2, 3]
+    assert split_bots(bots, 4, keep_empty=True)[1] == (1, {})
+
+
+def test_a_worker_owns_bots_added_later(monkeypatch):
+    monkeypatch.setattr(supervisor, "__worker_index", 2)
+    monkeypatch.setattr(supervisor, "__workers", 4)
+    started_with = dict(split_bots(BOTS, 4))[2]
+
+    owned = [name for name in BOTS if owns_bot(name)]
+    added = [f"new{i}" for i in range(20) if owns_bot(f"new{i}")]
+
+    assert owned == list(started_with)
+    assert added and all(shard_for(name, 4) == 2 for name in added)
+
+
+def test_everything_is_owned_outside_of_workers():
+    assert all(owns_bot(name) for name in BOTS)
+
+
+def test_worker_records_are_sampled_once(monkeypatch):
+    sink = LogSink(stream=io.StringIO(), sample={"chatty": 0.5})
+    # Kept and dropped by turns, whichever stage draws.
+    draws = itertools.cycle([0.25, 0.75])
+    monkeypatch.setattr(logsink.random, "random", lambda: next(draws))
+    log_queue = queue.Queue()
+    worker_handler = logging.handlers.QueueHandler(log_queue)
+    worker_handler.addFilter(sink.filter)
+    for i in range(100):
+        worker_handler.handle(logging.LogRecord("chatty", logging.INFO, __file__, 0, f"line {i}", None, None))
+    log_queue.put(None)
+
+    parent = Supervisor(None, {}, 2, log_filter=sink.filter, log_handler=sink.handler)
+    parent.log_queue = log_queue
+    parent._drain_logs()
+
+    assert sink.queue.qsize() == 50
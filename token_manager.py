@@ -1,30 +1,195 @@
 import os
 import json
+import asyncio
+import logging
+import random
+import tempfile
+import threading
+import time
 import httpx
 from cryptography.fernet import Fernet
 
-class SecureTokenStorage:
-    def __init__(self, file_path, key=None):
+from bots import metrics
+from oauth import user
+from oauth.callback import get_callback_server
+
+logger = logging.getLogger(__name__)
+
+# Refresh this long before a token expires, plus up to REFRESH_JITTER seconds.
+REFRESH_MARGIN = 300
+REFRESH_JITTER = 120
+# https://dev.twitch.tv/docs/authentication/validate-tokens/ asks for hourly validation.
+VALIDATE_INTERVAL = 3600
+RETRY_INTERVAL = 60
+
+TOKEN_STORE_PATH = os.getenv("TOKEN_STORE_PATH", "tokens.enc")
+TOKEN_KEY_PATH = os.getenv("TOKEN_KEY_PATH", ".token_key")
+
+
+def load_key(key_path=TOKEN_KEY_PATH):
+    """The Fernet key from TOKEN_STORE_KEY, else from the key file, created on first use."""
+    key = os.getenv("TOKEN_STORE_KEY")
+    if key:
+        return key.encode()
+    try:
+        with open(key_path, "rb") as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        pass
+    key = Fernet.generate_key()
+    fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(key)
+    return key
+
+
+def _atomic_write(file_path, data):
+    """Write to a temp file, fsync it and rename it over the target."""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tokens-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class TokenStore:
+    """Tokens of every bot in one encrypted file.
+
+    The file is decrypted once and served from memory afterwards. Writes go
+    through a temp file and rename, so a crash never leaves a torn file.
+    """
+
+    def __init__(self, file_path=TOKEN_STORE_PATH, key=None, key_path=TOKEN_KEY_PATH):
         self.file_path = file_path
-        self.key = key or Fernet.generate_key()
-        self.cipher_suite = Fernet(self.key)
+        self.cipher_suite = Fernet(key or load_key(key_path))
+        self._tokens = None
+        self._mtime = None
+        self._lock = threading.Lock()
 
-    def store_tokens(self, access_token, refresh_token):
+    def _file_mtime(self):
+        try:
+            return os.stat(self.file_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read(self):
+        try:
+            with open(self.file_path, "rb") as file:
+                encrypted_data = file.read()
+        except FileNotFoundError:
+            return {}
+        return json.loads(self.cipher_suite.decrypt(encrypted_data).decode())
+
+    def _write(self):
+        encrypted_data = self.cipher_suite.encrypt(json.dumps(self._tokens).encode())
+        _atomic_write(self.file_path, encrypted_data)
+
+    def load(self):
+        """Read and decrypt the store, unless it is cached already."""
+        with self._lock:
+            if self._tokens is None:
+                self._mtime = self._file_mtime()
+                self._tokens = self._read()
+        return self._tokens
+
+    def get(self, name):
+        data = self.load().get(name, {})
+        return data.get("access_token"), data.get("refresh_token")
+
+    def set(self, name, access_token, refresh_token):
+        self.load()
+        with self._lock:
+            # Another process (see bot.py --workers) may have written since we read.
+            mtime = self._file_mtime()
+            if mtime != self._mtime:
+                self._tokens = self._read()
+            self._tokens[name] = {"access_token": access_token, "refresh_token": refresh_token}
+            self._write()
+            self._mtime = self._file_mtime()
+
+    def names(self):
+        return list(self.load())
+
+
+class SqliteTokenStore(TokenStore):
+    """Single-file SQLite backend with one encrypted row per bot.
+
+    Rows are upserted individually, which makes it the safer choice when
+    several worker processes share the store.
+    """
+
+    def __init__(self, file_path, key=None, key_path=TOKEN_KEY_PATH):
+        import sqlite3
+
+        super().__init__(file_path, key, key_path)
+        self._db = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS tokens (name TEXT PRIMARY KEY, data BLOB NOT NULL)")
+
+    def _read(self):
+        return {
+            name: json.loads(self.cipher_suite.decrypt(data).decode())
+            for name, data in self._db.execute("SELECT name, data FROM tokens")
+        }
+
+    def set(self, name, access_token, refresh_token):
+        self.load()
         data = {"access_token": access_token, "refresh_token": refresh_token}
         encrypted_data = self.cipher_suite.encrypt(json.dumps(data).encode())
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tokens (name, data) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                (name, encrypted_data),
+            )
+            self._tokens[name] = data
 
-        with open(self.file_path, "wb") as file:
-            file.write(encrypted_data)
 
-    def retrieve_tokens(self):
-        if not os.path.exists(self.file_path):
-            return None, None
+__token_store = None
 
-        with open(self.file_path, "rb") as file:
-            encrypted_data = file.read()
 
-        data = json.loads(self.cipher_suite.decrypt(encrypted_data).decode())
-        return data.get("access_token"), data.get("refresh_token")
+def open_token_store(file_path=TOKEN_STORE_PATH, key=None, key_path=TOKEN_KEY_PATH):
+    """open_token_store."""
+    if file_path.endswith((".db", ".sqlite", ".sqlite3")):
+        return SqliteTokenStore(file_path, key, key_path)
+    return TokenStore(file_path, key, key_path)
+
+
+def get_token_store(file_path=None, key=None, key_path=None):
+    """The process-wide store. The first call may choose where it lives."""
+    global __token_store
+    if __token_store is None:
+        __token_store = open_token_store(
+            file_path or TOKEN_STORE_PATH, key.encode() if key else None, key_path or TOKEN_KEY_PATH
+        )
+    return __token_store
+
+
+class SecureTokenStorage:
+    """One bot's entry in a TokenStore, the process-wide one by default."""
+
+    def __init__(self, name, store=None):
+        self.name = name
+        self.store = store or get_token_store()
+
+    def store_tokens(self, access_token, refresh_token):
+        self.store.set(self.name, access_token, refresh_token)
+
+    def retrieve_tokens(self):
+        return self.store.get(self.name)
 
 
 class TokenManager:
@@ -34,6 +199,8 @@ class TokenManager:
         self.port = port
         self.scopes = scopes
         self.token_storage = token_storage
+        # Set by TokenRefreshScheduler.register so refreshes are coalesced.
+        self.scheduler = None
 
     async def generate_token(self):
         access_token, refresh_token = self.token_storage.retrieve_tokens()
@@ -44,13 +211,195 @@ class TokenManager:
         return access_token, refresh_token
 
     async def _generate_new_token(self):
-        # Implement token generation logic here, similar to your existing generate_token function.
-        ...
+        target_scope = []
+        for s in self.scopes or []:
+            if s == "all_scopes":
+                target_scope.extend(user.AuthScope.all_scopes())
+            else:
+                target_scope.append(s)
+        callback_server = get_callback_server()
+        url, port = callback_server.redirect(self.port)
+        auth = user.UserAuthenticator(
+            self.client_id,
+            self.client_secret,
+            target_scope or user.AuthScope.all_scopes(),
+            force_verify=False,
+            url=url,
+            port=port,
+            callback_server=callback_server,
+        )
+        access_token, refresh_token = await auth.authenticate_async()
+        self.token_storage.store_tokens(access_token, refresh_token)
+        return access_token, refresh_token
 
     async def refresh_tokens(self):
-        access_token, refresh_token = await refresh_tokens(
-            self.client_id, self.client_secret, self.token_storage.retrieve_refresh_token()
+        if self.scheduler:
+            return await self.scheduler.refresh(self.token_storage.name)
+        return await self._refresh_tokens()
+
+    async def _refresh_tokens(self):
+        _, refresh_token = self.token_storage.retrieve_tokens()
+        access_token, refresh_token = await user.refresh_access_token_async(
+            refresh_token, self.client_id, self.client_secret
         )
 
         self.token_storage.store_tokens(access_token, refresh_token)
         return access_token, refresh_token
+
+
+class _ScheduledToken:
+    def __init__(self, manager):
+        self.manager = manager
+        self.holders = []
+        self.refresh_at = None
+        self.validate_at = 0
+        self.busy = False
+
+
+class TokenRefreshScheduler:
+    """One task keeping every token in the process valid.
+
+    Tokens are validated on registration and hourly afterwards, as Twitch
+    requires, and refreshed ahead of the `expires_in` that validation returns.
+    Tokens are tracked by the name they are stored under, not by client id,
+    which several bots' accounts may share. Refreshes of the same token are
+    coalesced and the new token is pushed to every holder (see
+    Bot.set_tokens) without reconnecting.
+    """
+
+    def __init__(self, margin=REFRESH_MARGIN, jitter=REFRESH_JITTER, validate_interval=VALIDATE_INTERVAL):
+        self.margin = margin
+        self.jitter = jitter
+        self.validate_interval = validate_interval
+        self._tokens = {}
+        self._inflight = {}
+        self._wake = None
+        self._task = None
+
+    def register(self, manager, holder=None):
+        """Track the manager's token and update holder whenever it changes."""
+        name = manager.token_storage.name
+        entry = self._tokens.get(name)
+        if entry is None:
+            entry = self._tokens[name] = _ScheduledToken(manager)
+        if holder is not None:
+            entry.holders.append(holder)
+        manager.scheduler = self
+        if self._wake:
+            self._wake.set()
+
+    def unregister(self, manager, holder=None):
+        """Stop updating holder, and forget the token once nothing holds it."""
+        name = manager.token_storage.name
+        entry = self._tokens.get(name)
+        if entry is None:
+            return
+        if holder in entry.holders:
+            entry.holders.remove(holder)
+        if not entry.holders:
+            del self._tokens[name]
+            manager.scheduler = None
+            return
+        managers = [getattr(h, "token_manager", None) for h in entry.holders]
+        if entry.manager is manager and manager not in managers:
+            # Refresh through the manager of a holder that is still running.
+            entry.manager = next((m for m in managers if m is not None), manager)
+        if manager not in managers:
+            manager.scheduler = None
+
+    def _schedule_refresh(self, entry, expires_in):
+        if not expires_in:
+            # App tokens and some user tokens never expire.
+            entry.refresh_at = None
+            return
+        lead = min(self.margin + random.uniform(0, self.jitter), expires_in / 2)
+        entry.refresh_at = time.monotonic() + expires_in - lead
+
+    async def refresh(self, name):
+        """Refresh the token stored as name, joining a refresh already in flight."""
+        future = self._inflight.get(name)
+        if future is None:
+            future = self._inflight[name] = asyncio.ensure_future(self._refresh(name))
+            future.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return await asyncio.shield(future)
+
+    async def _refresh(self, name):
+        entry = self._tokens[name]
+        start = time.perf_counter()
+        try:
+            return await self._refresh_entry(name, entry)
+        except Exception:
+            metrics.TOKEN_REFRESH_ERRORS.labels(name).inc()
+            raise
+        finally:
+            metrics.TOKEN_REFRESH_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+    async def _refresh_entry(self, name, entry):
+        access_token, refresh_token = await entry.manager._refresh_tokens()
+        for holder in entry.holders:
+            holder.set_tokens(access_token, refresh_token)
+        data = await user.validate_token_async(access_token)
+        self._schedule_refresh(entry, data.get("expires_in"))
+        entry.validate_at = time.monotonic() + self.validate_interval
+        logger.info(f"refreshed token of {name}")
+        return access_token, refresh_token
+
+    async def _validate(self, name):
+        entry = self._tokens[name]
+        access_token, _ = entry.manager.token_storage.retrieve_tokens()
+        data = await user.validate_token_async(access_token)
+        if data.get("status", 200) == 401:
+            logger.info(f"token of {name} is no longer valid, refreshing")
+            await self.refresh(name)
+            return
+        self._schedule_refresh(entry, data.get("expires_in"))
+        entry.validate_at = time.monotonic() + self.validate_interval
+
+    async def _run_due(self, name, entry, work):
+        try:
+            await work(name)
+        except Exception as e:
+            logger.error(f"token maintenance of {name} failed: {e!r}")
+            entry.validate_at = time.monotonic() + RETRY_INTERVAL
+            entry.refresh_at = None
+        finally:
+            entry.busy = False
+            self._wake.set()
+
+    async def run(self):
+        """Sleep until the next refresh or validation is due and run it."""
+        self._wake = asyncio.Event()
+        while True:
+            now = time.monotonic()
+            next_due = now + self.validate_interval
+            for name, entry in self._tokens.items():
+                if entry.busy:
+                    continue
+                if entry.refresh_at is not None and entry.refresh_at <= now:
+                    entry.busy = True
+                    asyncio.ensure_future(self._run_due(name, entry, self.refresh))
+                    continue
+                if entry.validate_at <= now:
+                    entry.busy = True
+                    asyncio.ensure_future(self._run_due(name, entry, self._validate))
+                    continue
+                next_due = min(next_due, entry.validate_at)
+                if entry.refresh_at is not None:
+                    next_due = min(next_due, entry.refresh_at)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(next_due - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """start."""
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        """stop."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None